@@ -0,0 +1,89 @@
+"""Benchmark the Rabbit Hole text splitter against the previous one.
+
+Run from the `core` folder:
+
+    python -m benchmarks.text_splitter --size 5
+    python -m benchmarks.text_splitter --size 5 --tokenizer text-embedding-ada-002
+
+The input is `tests/mocks/sample.txt` repeated up to the given size (MB).
+Chunks are measured with the token counter the Rabbit Hole gives the splitter: `approximate`
+(embedders without a known tokenizer) or tiktoken for an OpenAI embedding model (as `get_token_counter` does).
+
+The previous splitter is run twice: measuring characters (what it did, about 4 characters per token)
+and measuring tokens with the same counter (the only way to get token-sized chunks out of it).
+With the approximate counter the linear splitter cuts windows of characters, searching break points
+from the end of each window with `str.rfind` (a call or two per chunk, instead of a call per split),
+and is faster than the previous splitter. With a real tokenizer the cost is in the tokenizer:
+the linear splitter encodes every sentence once, the previous splitter encodes every split and every merge.
+"""
+
+import time
+import argparse
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from cat.text_splitter import LinearTextSplitter, approximate_token_count, get_tiktoken_counter, CHARACTERS_PER_TOKEN
+
+
+def previous_splitter(text, chunk_size, chunk_overlap, length_function=len):
+    # splitter used by `RabbitHole.split_text` before `LinearTextSplitter`
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\\n\\n", "\n\n", ".\\n", ".\n", "\\n", "\n", " ", ""],
+        length_function=length_function,
+    )
+    chunks = text_splitter.split_text(text)
+    return [c for c in chunks if len(c) > 10]
+
+
+def linear_splitter(text, chunk_size, chunk_overlap, length_function):
+    return LinearTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap, length_function=length_function
+    ).split_chunks(text)
+
+
+def run(name, splitter, text, chunk_size, chunk_overlap, token_counter, **kwargs):
+    start = time.perf_counter()
+    chunks = splitter(text, chunk_size, chunk_overlap, **kwargs)
+    elapsed = time.perf_counter() - start
+
+    tokens = [token_counter(c) for c in chunks]
+    print(
+        f"{name:18} {elapsed:8.2f} s  {len(text) / elapsed / 1e6:6.2f} MB/s  "
+        f"{len(chunks):7} chunks  avg {sum(tokens) / len(tokens):6.1f} tokens  max {max(tokens)} tokens"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=float, default=5, help="Input size in MB")
+    parser.add_argument("--chunk-size", type=int, default=100, help="Chunk size in tokens")
+    parser.add_argument("--chunk-overlap", type=int, default=25, help="Chunk overlap in tokens")
+    parser.add_argument("--tokenizer", default="approximate",
+                        help="'approximate' or an OpenAI embedding model measured with tiktoken")
+    args = parser.parse_args()
+
+    if args.tokenizer == "approximate":
+        token_counter = approximate_token_count
+    else:
+        # tiktoken downloads the encoding the first time
+        token_counter = get_tiktoken_counter(args.tokenizer)
+
+    with open("tests/mocks/sample.txt") as f:
+        sample = f.read()
+    text = sample * int(args.size * 1e6 / len(sample) + 1)
+    print(f"Input: {len(text) / 1e6:.1f} MB, chunks of {args.chunk_size} tokens measured with {args.tokenizer}")
+
+    run(
+        "previous (chars)", previous_splitter, text,
+        args.chunk_size * CHARACTERS_PER_TOKEN, args.chunk_overlap * CHARACTERS_PER_TOKEN, token_counter
+    )
+    run(
+        "previous (tokens)", previous_splitter, text, args.chunk_size, args.chunk_overlap, token_counter,
+        length_function=token_counter
+    )
+    run(
+        "linear", linear_splitter, text, args.chunk_size, args.chunk_overlap, token_counter,
+        length_function=token_counter
+    )
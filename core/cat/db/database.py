@@ -1,5 +1,6 @@
 from tinydb import TinyDB
 import os
+import threading
 
 #TODO can we add a verbose level for logging?
 
@@ -18,4 +19,9 @@ class Database:
         return tinydb_file
 
 def get_db():
-    return Database()
\ No newline at end of file
+    return Database()
+
+
+# TinyDB is not thread safe: every read and write of the settings DB (see `crud`)
+# goes through this lock, requests and background threads (i.e. memory retention) share the same file
+db_lock = threading.RLock()
\ No newline at end of file
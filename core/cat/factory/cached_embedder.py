@@ -0,0 +1,150 @@
+import os
+import time
+import asyncio
+import threading
+from typing import List
+from collections import OrderedDict
+
+from langchain.embeddings.base import Embeddings
+
+
+class CachedEmbedder(Embeddings):
+    """Embedder wrapper with an LRU cache of recently embedded texts.
+
+    The same text is often embedded several times in a short time
+    (i.e. the user message is embedded for recall and again when stored in episodic memory).
+    This class wraps the embedder returned by `CheshireCat.get_language_embedder`
+    and keeps the last vectors in memory, so the embedder is called only for texts not seen recently.
+
+    Attributes
+    ----------
+    embedder : Embeddings
+        Wrapped Langchain embedder.
+    max_size : int
+        Maximum number of cached vectors. Zero disables the cache.
+    ttl : float
+        Seconds after which a cached vector expires.
+    hits : int
+        Number of texts found in cache.
+    misses : int
+        Number of texts sent to the wrapped embedder.
+
+    Notes
+    -----
+    The cache is keyed by method kind (query or document), embedder identity and whitespace-normalized text:
+    asymmetric embedders (i.e. with an instruction prefixed to queries) give different vectors to the same text.
+    A new wrapper (and a new, empty cache) is created every time the Cat reloads its embedder,
+    so vectors from a previous embedder are never returned.
+    Size and TTL can be set in the `.env` file with `EMBEDDER_CACHE_SIZE` and `EMBEDDER_CACHE_TTL`.
+    Async methods fall back to a worker thread if the wrapped embedder has no async implementation.
+
+    """
+
+    def __init__(self, embedder: Embeddings, max_size: int = None, ttl: float = None):
+        self.embedder = embedder
+        self.max_size = max_size if max_size is not None else int(os.getenv("EMBEDDER_CACHE_SIZE", 1000))
+        self.ttl = ttl if ttl is not None else float(os.getenv("EMBEDDER_CACHE_TTL", 3600))
+
+        self.hits = 0
+        self.misses = 0
+
+        # (kind, embedder id, normalized text) -> (expiration time, vector)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # expose attributes of the wrapped embedder (i.e. `model`, `repo_id`)
+        if name == "embedder":
+            raise AttributeError(name)
+        return getattr(self.embedder, name)
+
+    def _key(self, kind: str, text: str):
+        return kind, id(self.embedder), " ".join(text.split())
+
+    def _get(self, kind: str, text: str):
+        key = self._key(kind, text)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+
+            # expired or never seen
+            self._cache.pop(key, None)
+            self.misses += 1
+            return None
+
+    def _put(self, kind: str, text: str, vector: List[float]):
+        if self.max_size <= 0:
+            return
+
+        key = self._key(kind, text)
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, vector)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def _missing(self, texts: List[str]):
+        vectors = [self._get("document", t) for t in texts]
+        missing = [i for i, v in enumerate(vectors) if v is None]
+        return vectors, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts, only sending to the embedder the ones not in cache."""
+        vectors, missing = self._missing(texts)
+        if len(missing) > 0:
+            new_vectors = self.embedder.embed_documents([texts[i] for i in missing])
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+                self._put("document", texts[i], vector)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a text, using the cached vector if available."""
+        vector = self._get("query", text)
+        if vector is None:
+            vector = self.embedder.embed_query(text)
+            self._put("query", text, vector)
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors, missing = self._missing(texts)
+        if len(missing) > 0:
+            missing_texts = [texts[i] for i in missing]
+            try:
+                new_vectors = await self.embedder.aembed_documents(missing_texts)
+            except NotImplementedError:
+                new_vectors = await asyncio.to_thread(self.embedder.embed_documents, missing_texts)
+            for i, vector in zip(missing, new_vectors):
+                vectors[i] = vector
+                self._put("document", texts[i], vector)
+        return vectors
+
+    async def aembed_query(self, text: str) -> List[float]:
+        vector = self._get("query", text)
+        if vector is None:
+            try:
+                vector = await self.embedder.aembed_query(text)
+            except NotImplementedError:
+                vector = await asyncio.to_thread(self.embedder.embed_query, text)
+            self._put("query", text, vector)
+        return vector
+
+    def clear(self):
+        """Empty the cache and reset counters."""
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def cache_info(self):
+        """Cache statistics, in the spirit of `functools.lru_cache`."""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._cache),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+        }
@@ -1,6 +1,7 @@
 import os
 from typing import Optional, List, Any, Mapping, Dict
 import requests
+import httpx
 from langchain.llms.base import LLM
 from langchain.llms.openai import OpenAI
 
@@ -14,6 +15,9 @@ class LLMDefault(LLM):
         return "AI: You did not configure a Language Model. " \
                "Do it in the settings!"
 
+    async def _acall(self, prompt, stop=None):
+        return self._call(prompt, stop=stop)
+
 
 # elaborated from
 # https://python.langchain.com/en/latest/modules/models/llms/examples/custom_llm.html
@@ -55,6 +59,29 @@ class LLMCustom(LLM):
 
         return generated_text
 
+    async def _acall(
+            self,
+            prompt: str,
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[Any] = None,
+    ) -> str:
+
+        request_body = {
+            "text": prompt,
+            "auth_key": self.auth_key,
+            "options": self.options
+        }
+
+        try:
+            async with httpx.AsyncClient(timeout=None) as client:
+                response = await client.post(self.url, json=request_body)
+            response_json = response.json()
+        except Exception as exc:
+            raise ValueError("Custom LLM endpoint error "
+                             "during http POST request") from exc
+
+        return response_json["text"]
+
     @property
     def _identifying_params(self) -> Mapping[str, Any]:
         """Identifying parameters."""
@@ -0,0 +1,424 @@
+import os
+import time
+import shutil
+import threading
+from uuid import uuid4
+from collections import deque
+from typing import Dict, List
+from contextlib import contextmanager
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from tinydb import TinyDB, Query
+from starlette.datastructures import UploadFile
+
+from cat.log import log
+
+
+# Ingestion job being processed in the current thread, if any.
+#   The Rabbit Hole reports progress and checks for cancellation here.
+current_job = ContextVar("current_job", default=None)
+
+# job statuses
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class IngestionCancelled(Exception):
+    """Raised inside an ingestion job when it has been cancelled."""
+    pass
+
+
+class StageStats:
+    """Latency and throughput of an ingestion stage (embedding or upsert).
+
+    Percentiles are computed on the last `window` calls, throughput on all of them:
+    chunks per second spent in the stage, so the slowest stage is the bottleneck.
+    """
+
+    window = 256
+
+    def __init__(self):
+        self.latencies = deque(maxlen=self.window)
+        self.calls = 0
+        self.chunks = 0
+        self.seconds = 0.0
+
+    @contextmanager
+    def measure(self, chunks: int):
+        """Time a call processing `chunks` chunks."""
+        start = time.perf_counter()
+        yield
+        self.record(time.perf_counter() - start, chunks)
+
+    def record(self, seconds: float, chunks: int):
+        self.latencies.append(seconds)
+        self.calls += 1
+        self.chunks += chunks
+        self.seconds += seconds
+
+    def summary(self) -> Dict:
+        summary = {"calls": self.calls, "chunks": self.chunks, "p50_ms": None, "p95_ms": None, "p99_ms": None,
+                   "chunks_per_second": None}
+        latencies = list(self.latencies)
+        if len(latencies) > 0:
+            p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+            summary.update(p50_ms=round(p50, 2), p95_ms=round(p95, 2), p99_ms=round(p99, 2))
+        if self.seconds > 0:
+            summary["chunks_per_second"] = round(self.chunks / self.seconds, 2)
+        return summary
+
+
+class IngestionJob:
+    """Content waiting to go down the Rabbit Hole, or going down.
+
+    Attributes
+    ----------
+    job_id : str
+        Job identifier, returned by the `/rabbithole/` endpoints.
+    kind : str
+        What is ingested: "file", "url", "crawl" or "memory".
+    user_id : str
+        User who started the job, receiving its progress events.
+    source : str
+        File name, URL or sitemap URL.
+    urls : List[str]
+        Web pages to crawl (crawl jobs only).
+    sitemap : str
+        Sitemap listing more pages to crawl (crawl jobs only).
+    max_pages : int
+        Maximum pages to crawl (crawl jobs only).
+    path : str
+        Where the uploaded file is kept until the job is over (None for URLs).
+    chunk_size : int
+        Number of tokens in each document chunk.
+    chunk_overlap : int
+        Number of overlapping tokens between consecutive chunks.
+    status : str
+        One of "queued", "running", "done", "failed", "cancelled".
+    chunks_total : int
+        Chunks to be stored, known after the content is parsed and split.
+    chunks_done : int
+        Chunks already processed (stored, or skipped because unchanged).
+    chunks_parsed : int
+        Chunks read from the content so far.
+    chunks_embedded : int
+        Chunks embedded so far.
+    chunks_stored : int
+        Chunks upserted in the vector DB so far.
+    embed_stats : StageStats
+        Latency and throughput of the embedder calls.
+    upsert_stats : StageStats
+        Latency and throughput of the vector DB upserts.
+    """
+
+    # attributes saved in the jobs table
+    fields = [
+        "job_id", "kind", "user_id", "source", "path", "urls", "sitemap", "max_pages", "chunk_size", "chunk_overlap", "status",
+        "created_at", "started_at", "finished_at", "chunks_total", "chunks_done", "chunks_parsed", "chunks_embedded",
+        "chunks_stored", "error"
+    ]
+
+    def __init__(self, kind: str, source: str, path: str = None, chunk_size: int = 100, chunk_overlap: int = 25,
+                 urls: List[str] = None, sitemap: str = None, max_pages: int = None, user_id: str = "user", **state):
+        self.job_id = state.get("job_id") or str(uuid4())
+        self.kind = kind
+        self.user_id = user_id
+        self.source = source
+        self.path = path
+        self.urls = urls
+        self.sitemap = sitemap
+        self.max_pages = max_pages
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+        self.status = state.get("status", QUEUED)
+        self.created_at = state.get("created_at", time.time())
+        self.started_at = state.get("started_at")
+        self.finished_at = state.get("finished_at")
+        self.chunks_total = state.get("chunks_total")
+        self.chunks_done = state.get("chunks_done", 0)
+        self.chunks_parsed = state.get("chunks_parsed", 0)
+        self.chunks_embedded = state.get("chunks_embedded", 0)
+        self.chunks_stored = state.get("chunks_stored", 0)
+        self.error = state.get("error")
+
+        self.embed_stats = StageStats()
+        self.upsert_stats = StageStats()
+
+        self.cancel_event = threading.Event()
+        self.future = None
+        self.last_save = 0
+        self.last_event = 0
+
+    def update_progress(self, chunks_done: int, chunks_total: int = None):
+        """Report stored chunks. Raises `IngestionCancelled` if the job was cancelled meanwhile."""
+        self.raise_if_cancelled()
+        self.chunks_done = chunks_done
+        if chunks_total is not None:
+            self.chunks_total = chunks_total
+
+    def raise_if_cancelled(self):
+        if self.cancel_event.is_set():
+            raise IngestionCancelled(f"Ingestion of {self.source} cancelled")
+
+    def chunks_per_second(self) -> float:
+        if self.started_at is None or self.chunks_done == 0:
+            return None
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return self.chunks_done / elapsed if elapsed > 0 else None
+
+    def eta(self) -> float:
+        """Seconds left to store all chunks, None if unknown."""
+        speed = self.chunks_per_second()
+        if self.status != RUNNING or speed is None or self.chunks_total is None:
+            return None
+        return max(self.chunks_total - self.chunks_done, 0) / speed
+
+    def to_dict(self) -> Dict:
+        return {f: getattr(self, f) for f in self.fields}
+
+    def info(self) -> Dict:
+        """Job description for the client (no server paths)."""
+        info = self.to_dict()
+        del info["path"]
+        info["chunks_per_second"] = self.chunks_per_second()
+        info["eta"] = self.eta()
+        info["embed"] = self.embed_stats.summary()
+        info["upsert"] = self.upsert_stats.summary()
+        return info
+
+    def is_over(self) -> bool:
+        return self.status in [DONE, FAILED, CANCELLED]
+
+
+class IngestionScheduler:
+    """Queue of ingestion jobs, run by a bounded pool of workers.
+
+    Uploaded content is saved on disk and jobs are saved in their own DB (`jobs.json` in `folder`), so jobs
+    still queued or running when the Cat stops are started again at the next boot.
+    Jobs are kept apart from the settings DB, as workers save progress concurrently with the routes;
+    finished jobs are forgotten after `jobs_ttl` seconds.
+
+    Attributes
+    ----------
+    rabbit_hole : RabbitHole
+        Rabbit Hole doing the actual ingestion.
+    max_workers : int
+        Jobs running at the same time. Can be set in the `.env` file with `RABBITHOLE_MAX_JOBS`.
+    folder : str
+        Where uploaded files wait to be ingested. Can be set in the `.env` file with `RABBITHOLE_JOBS_FOLDER`.
+    jobs_ttl : float
+        Seconds a finished job is kept. Can be set in the `.env` file with `RABBITHOLE_JOBS_TTL`.
+    jobs : Dict[str, IngestionJob]
+        Jobs indexed by id.
+    """
+
+    # seconds between progress saves in the jobs table
+    save_interval = 5
+    # seconds between progress events sent to the user of a running job
+    event_interval = 1
+
+    def __init__(self, rabbit_hole, max_workers: int = None, folder: str = None, jobs_ttl: float = None):
+        self.rabbit_hole = rabbit_hole
+        self.max_workers = max_workers or int(os.getenv("RABBITHOLE_MAX_JOBS", 2))
+        self.folder = folder or os.getenv("RABBITHOLE_JOBS_FOLDER", "rabbithole_jobs/")
+        self.jobs_ttl = jobs_ttl if jobs_ttl is not None else float(os.getenv("RABBITHOLE_JOBS_TTL", 7 * 24 * 3600))
+
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="rabbithole")
+        self.jobs = {}
+        # TinyDB is not thread safe, every access to the jobs DB holds this lock
+        self.db_lock = threading.Lock()
+        self.db = None
+
+    def get_table(self):
+        if self.db is None:
+            os.makedirs(self.folder, exist_ok=True)
+            self.db = TinyDB(os.path.join(self.folder, "jobs.json"))
+        return self.db.table("ingestion_jobs")
+
+    def save_job(self, job: IngestionJob):
+        with self.db_lock:
+            self.get_table().upsert(job.to_dict(), Query().job_id == job.job_id)
+
+    def prune_jobs(self):
+        """Forget jobs finished more than `jobs_ttl` seconds ago."""
+        cutoff = time.time() - self.jobs_ttl
+        is_expired = Query().finished_at.test(lambda finished_at: finished_at is not None and finished_at < cutoff)
+        with self.db_lock:
+            self.get_table().remove(is_expired)
+
+        for job_id, job in list(self.jobs.items()):
+            if job.is_over() and job.finished_at is not None and job.finished_at < cutoff:
+                self.jobs.pop(job_id, None)
+
+    def resume_jobs(self):
+        """Queue again jobs interrupted by a shutdown (called once the Cat is ready)."""
+        self.prune_jobs()
+        with self.db_lock:
+            interrupted = self.get_table().search(Query().status.one_of([QUEUED, RUNNING]))
+
+        for record in interrupted:
+            record = dict(record)
+            job = IngestionJob(**record)
+            if job.path is not None and not os.path.exists(job.path):
+                job.status = FAILED
+                job.error = "Uploaded file was lost during a restart"
+                self.save_job(job)
+                continue
+
+            log.warning(f"Resuming ingestion of {job.source}")
+            job.status = QUEUED
+            job.chunks_done = job.chunks_parsed = job.chunks_embedded = job.chunks_stored = 0
+            self.enqueue(job)
+
+    def submit_file(self, file: UploadFile, chunk_size: int = 100, chunk_overlap: int = 25,
+                    user_id: str = "user") -> IngestionJob:
+        """Save an uploaded file and queue it for ingestion in declarative memory."""
+        return self.enqueue(self.save_upload("file", file, chunk_size, chunk_overlap, user_id))
+
+    def submit_memory(self, file: UploadFile, user_id: str = "user") -> IngestionJob:
+        """Save an uploaded memory export and queue it for ingestion."""
+        return self.enqueue(self.save_upload("memory", file, user_id=user_id))
+
+    def submit_url(self, url: str, chunk_size: int = 100, chunk_overlap: int = 25,
+                   user_id: str = "user") -> IngestionJob:
+        """Queue a web page for ingestion in declarative memory."""
+        return self.enqueue(IngestionJob(
+            "url", url, chunk_size=chunk_size, chunk_overlap=chunk_overlap, user_id=user_id
+        ))
+
+    def submit_crawl(self, urls: List[str] = None, sitemap: str = None, max_pages: int = 100,
+                     chunk_size: int = 100, chunk_overlap: int = 25, user_id: str = "user") -> IngestionJob:
+        """Queue web pages (listed and/or from a sitemap) for ingestion in declarative memory."""
+        source = sitemap or f"{len(urls)} web pages"
+        urls = urls or []
+        return self.enqueue(IngestionJob(
+            "crawl", source, urls=urls, sitemap=sitemap, max_pages=max_pages, chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap, user_id=user_id
+        ))
+
+    def save_upload(self, kind: str, file: UploadFile, chunk_size: int = 100, chunk_overlap: int = 25,
+                    user_id: str = "user"):
+        job = IngestionJob(kind, file.filename, chunk_size=chunk_size, chunk_overlap=chunk_overlap, user_id=user_id)
+
+        # keep the original extension, the mime type depends on it
+        os.makedirs(self.folder, exist_ok=True)
+        job.path = os.path.join(self.folder, job.job_id + os.path.splitext(file.filename)[1])
+        file.file.seek(0)
+        with open(job.path, "wb") as f:
+            shutil.copyfileobj(file.file, f)
+
+        return job
+
+    def enqueue(self, job: IngestionJob) -> IngestionJob:
+        self.jobs[job.job_id] = job
+        self.save_job(job)
+        job.future = self.executor.submit(self.run, job)
+        return job
+
+    def run(self, job: IngestionJob):
+        if job.status == CANCELLED:
+            return
+
+        token = current_job.set(job)
+        job.status = RUNNING
+        job.started_at = time.time()
+        self.save_job(job)
+        self.send_progress(job)
+
+        try:
+            if job.kind == "url":
+                self.rabbit_hole.ingest_file(job.source, job.chunk_size, job.chunk_overlap)
+            elif job.kind == "crawl":
+                self.rabbit_hole.ingest_web_pages(
+                    urls=job.urls,
+                    sitemap=job.sitemap,
+                    max_pages=job.max_pages,
+                    chunk_size=job.chunk_size,
+                    chunk_overlap=job.chunk_overlap
+                )
+            else:
+                with open(job.path, "rb") as f:
+                    # the Rabbit Hole sees the upload with its original name
+                    upload = UploadFile(file=f, filename=job.source)
+                    if job.kind == "memory":
+                        self.rabbit_hole.ingest_memory(upload)
+                    else:
+                        self.rabbit_hole.ingest_file(upload, job.chunk_size, job.chunk_overlap)
+            job.status = DONE
+        except IngestionCancelled:
+            job.status = CANCELLED
+            log.warning(f"Ingestion of {job.source} cancelled")
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+            log.error(f"Ingestion of {job.source} failed")
+            log.error(e)
+        finally:
+            current_job.reset(token)
+            job.finished_at = time.time()
+            self.remove_upload(job)
+            self.save_job(job)
+            self.send_progress(job)
+            self.prune_jobs()
+
+    def remove_upload(self, job: IngestionJob):
+        if job.path is not None and os.path.exists(job.path):
+            os.remove(job.path)
+
+    def report_progress(self, job: IngestionJob, chunks_done: int, chunks_total: int = None):
+        """Update job progress, saving it and sending it to the user from time to time."""
+        job.update_progress(chunks_done, chunks_total)
+        if time.time() - job.last_save > self.save_interval:
+            job.last_save = time.time()
+            self.save_job(job)
+        if time.time() - job.last_event > self.event_interval:
+            self.send_progress(job)
+
+    def send_progress(self, job: IngestionJob):
+        """Push the job state (counters and stage latencies) to the websockets of its user."""
+        job.last_event = time.time()
+        self.rabbit_hole.cat.send_ws_message(job.info(), "ingestion", user_id=job.user_id)
+
+    def get_job(self, job_id: str) -> IngestionJob:
+        job = self.jobs.get(job_id)
+        if job is None:
+            # jobs of previous runs are only in the DB
+            with self.db_lock:
+                record = self.get_table().get(Query().job_id == job_id)
+            if record is not None:
+                job = IngestionJob(**dict(record))
+        return job
+
+    def list_jobs(self) -> List[IngestionJob]:
+        with self.db_lock:
+            records = self.get_table().all()
+        return [self.jobs.get(r["job_id"]) or IngestionJob(**dict(r)) for r in records]
+
+    def cancel(self, job_id: str) -> IngestionJob:
+        """Cancel a job. Queued jobs never start, running jobs stop at the next batch of chunks.
+
+        Chunks already stored by a running job are kept in memory.
+        """
+        job = self.jobs.get(job_id)
+        if job is None or job.status not in [QUEUED, RUNNING]:
+            return job
+
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            job.status = CANCELLED
+            job.finished_at = time.time()
+            self.remove_upload(job)
+            self.save_job(job)
+            self.send_progress(job)
+
+        return job
+
+    def shutdown(self):
+        """Stop workers. Queued jobs stay in the DB and are resumed at the next boot."""
+        self.executor.shutdown(wait=False, cancel_futures=True)
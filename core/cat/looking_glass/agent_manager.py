@@ -1,15 +1,18 @@
+import re
 import time
+import asyncio
 import traceback
 from datetime import timedelta
 from typing import List, Dict
 
-from langchain.docstore.document import Document
 from langchain.prompts import PromptTemplate
 from langchain.chains import LLMChain
 from langchain.agents import AgentExecutor, LLMSingleActionAgent
 
 from cat.looking_glass import prompts
 from cat.looking_glass.output_parser import ToolOutputParser
+from cat.looking_glass.callbacks import NewTokenHandler
+from cat.memory.vector_memory import MemoryHit
 from cat.utils import verbal_timedelta
 from cat.log import log
 
@@ -26,19 +29,57 @@ class AgentManager:
     ----------
     cat : CheshireCat
         Cheshire Cat instance.
+    tool_agents : dict
+        Cache of tool agents, indexed by LLM, prompt instructions and allowed tools.
+    memory_chains : dict
+        Cache of memory chains, indexed by LLM, prompt and agent input keys.
+
+    Notes
+    -----
+    Prompt templates, chains and agents do not depend on the single message, only on the (hooked) prompts,
+    the allowed tools and the LLM. They are built once and reused, and the caches are emptied
+    when plugins or language models are reloaded.
 
     """
+
+    # max number of cached chains/agents (hooks may generate a different prompt for each message)
+    cache_size = 64
+
     def __init__(self, cat):
         self.cat = cat
 
+        self.tool_agents = {}
+        self.memory_chains = {}
+        self.streaming_llm = None
 
-    def execute_tool_agent(self, agent_input, allowed_tools):
+    def clear_cache(self):
+        """Forget cached chains and agents (i.e. after a plugin toggle or an LLM change)."""
+        self.tool_agents = {}
+        self.memory_chains = {}
+        self.streaming_llm = None
+
+    def cache_chain(self, cache, key, chain):
+        # drop the oldest entry when the cache is full
+        if len(cache) >= self.cache_size:
+            cache.pop(next(iter(cache)), None)
+        cache[key] = chain
+        return chain
+
+    def get_tool_agent(self, allowed_tools):
+
+        instructions = self.cat.mad_hatter.execute_hook("agent_prompt_instructions", prompts.TOOL_PROMPT)
+
+        # tool agent only depends on LLM, instructions and tools
+        key = (id(self.cat._llm), instructions, tuple(id(t) for t in allowed_tools))
+        agent_executor = self.tool_agents.get(key)
+        if agent_executor is not None:
+            return agent_executor
 
         allowed_tools_names = [t.name for t in allowed_tools]
         # TODO: dynamic input_variables as in the main prompt 
 
         prompt = prompts.ToolPromptTemplate(
-            template = self.cat.mad_hatter.execute_hook("agent_prompt_instructions", prompts.TOOL_PROMPT),
+            template = instructions,
             tools=allowed_tools,
             # This omits the `agent_scratchpad`, `tools`, and `tool_names` variables because those are generated dynamically
             # This includes the `intermediate_steps` variable because it is needed to fill the scratchpad
@@ -65,11 +106,27 @@ class AgentManager:
             verbose=True
         )
 
+        return self.cache_chain(self.tool_agents, key, agent_executor)
+
+    def execute_tool_agent(self, agent_input, allowed_tools):
+        agent_executor = self.get_tool_agent(allowed_tools)
         out = agent_executor(agent_input)
         return out
-    
 
-    def execute_memory_chain(self, agent_input, prompt_prefix, prompt_suffix):
+    async def aexecute_tool_agent(self, agent_input, allowed_tools):
+        agent_executor = await asyncio.to_thread(self.get_tool_agent, allowed_tools)
+        out = await self.acall_chain(agent_executor, agent_input)
+        return out
+
+    def get_memory_chain(self, agent_input, prompt_prefix, prompt_suffix, llm=None):
+
+        llm = llm or self.cat._llm
+
+        # memory chain only depends on LLM, prompt and available input variables
+        key = (id(llm), prompt_prefix, prompt_suffix, tuple(agent_input.keys()))
+        memory_chain = self.memory_chains.get(key)
+        if memory_chain is not None:
+            return memory_chain
 
         input_variables = [i for i in agent_input.keys() if i in prompt_prefix + prompt_suffix]
         
@@ -81,39 +138,98 @@ class AgentManager:
 
         memory_chain = LLMChain(
             prompt=memory_prompt,
-            llm=self.cat._llm,
+            llm=llm,
             verbose=True
         )
 
+        return self.cache_chain(self.memory_chains, key, memory_chain)
+
+    def execute_memory_chain(self, agent_input, prompt_prefix, prompt_suffix):
+        memory_chain = self.get_memory_chain(agent_input, prompt_prefix, prompt_suffix)
         out = memory_chain(agent_input)
         out["output"] = out["text"]
         del out["text"]
         return out
 
+    async def aexecute_memory_chain(self, agent_input, prompt_prefix, prompt_suffix, stream_callback=None):
 
-    def execute_agent(self):
-        """Instantiate the Agent with tools.
+        # stream the answer if requested and supported by the LLM
+        llm = None
+        callbacks = None
+        if stream_callback is not None:
+            llm = self.get_streaming_llm()
+            if llm is not None:
+                callbacks = [NewTokenHandler(stream_callback)]
 
-        The method formats the main prompt and gather the allowed tools. It also instantiates a conversational Agent
-        from Langchain.
+        memory_chain = self.get_memory_chain(agent_input, prompt_prefix, prompt_suffix, llm=llm)
+        out = await self.acall_chain(memory_chain, agent_input, callbacks=callbacks)
+        out["output"] = out["text"]
+        del out["text"]
+        return out
+
+    def get_streaming_llm(self):
+        """Copy of the LLM with token streaming enabled, or None if the LLM cannot stream."""
+        llm = self.cat._llm
+        if "streaming" not in getattr(llm, "__fields__", {}):
+            return None
+
+        # reuse the copy as long as the LLM is the same, so memory chains are cached too
+        if self.streaming_llm is not None and self.streaming_llm[0] is llm:
+            return self.streaming_llm[1]
+
+        # shallow copy, the shared LLM is left untouched
+        #   (`llm.copy()` would drop fields marked as excluded, i.e. callbacks)
+        fields = dict(llm.__dict__, streaming=True)
+        streaming_llm = llm.__class__.construct(_fields_set=llm.__fields_set__ | {"streaming"}, **fields)
+        self.streaming_llm = (llm, streaming_llm)
+        return streaming_llm
+
+    async def acall_chain(self, chain, inputs, callbacks=None):
+        """Await a Langchain chain.
+
+        Not all LLMs have an async implementation: in that case the chain runs in a worker thread
+        (without streaming callbacks, they need the event loop).
+        """
+        try:
+            return await chain.acall(inputs, callbacks=callbacks)
+        except NotImplementedError:
+            return await asyncio.to_thread(chain, inputs)
+
+    def prepare_agent(self, stray):
+        """Gather what the Agent needs to run.
+
+        Parameters
+        ----------
+        stray : StrayCat
+            Session of the user whose message is being processed.
 
         Returns
         -------
-        agent_executor : AgentExecutor
-            Instance of the Agent provided with a set of tools.
+        agent_input : dict
+            Input to be passed to the agent.
+        fast_reply : dict
+            Reply from the `agent_fast_reply` hook. If not empty, the agent is not executed.
+        prompt_prefix : str
+            Main prompt prefix.
+        prompt_suffix : str
+            Main prompt suffix.
+        allowed_tools : list
+            Tools the agent can use, after routing.
+        mode : str
+            How tools are used, "tool_agent" or "single_pass".
         """
         mad_hatter = self.cat.mad_hatter
-        working_memory = self.cat.working_memory
+        working_memory = stray.working_memory
 
         # prepare input to be passed to the agent.
         #   Info will be extracted from working memory
-        agent_input = self.format_agent_input()
+        agent_input = self.format_agent_input(stray)
         agent_input = mad_hatter.execute_hook("before_agent_starts", agent_input)
         # should we ran the default agent?
         fast_reply = {}
         fast_reply = mad_hatter.execute_hook("agent_fast_reply", fast_reply)
         if len(fast_reply.keys()) > 0:
-            return fast_reply
+            return agent_input, fast_reply, None, None, [], None
         prompt_prefix = mad_hatter.execute_hook("agent_prompt_prefix", prompts.MAIN_PROMPT_PREFIX)
         prompt_suffix = mad_hatter.execute_hook("agent_prompt_suffix", prompts.MAIN_PROMPT_SUFFIX)
 
@@ -121,35 +237,209 @@ class AgentManager:
         # tools currently recalled in working memory
         recalled_tools = working_memory["procedural_memories"]
         # Get the tools names only
-        tools_names = [t[0].metadata["name"] for t in recalled_tools]
+        tools_names = [t.metadata["name"] for t in recalled_tools]
         tools_names = mad_hatter.execute_hook("agent_allowed_tools", tools_names)
         # Get tools with that name from mad_hatter
         allowed_tools = [i for i in mad_hatter.tools if i.name in tools_names]
 
+        mode, allowed_tools = self.route_tools(stray, allowed_tools)
+
+        return agent_input, fast_reply, prompt_prefix, prompt_suffix, allowed_tools, mode
+
+    def route_tools(self, stray, allowed_tools):
+        """Decide which tools are worth an LLM call, using recall scores only.
+
+        Parameters
+        ----------
+        stray : StrayCat
+            Session of the user whose message is being processed.
+        allowed_tools : list
+            Tools allowed by the `agent_allowed_tools` hook.
+
+        Returns
+        -------
+        mode : str
+            How tools are used, "tool_agent" or "single_pass".
+        routed_tools : list
+            Tools clearing their score threshold and margin.
+
+        See Also
+        --------
+        agent_tool_routing
+        """
+        # by default every recalled tool is kept, plugins can tighten routing
+        default_routing_config = {
+            "mode": "tool_agent",
+            "threshold": None,
+            "margin": None,
+            "tool_thresholds": {},
+        }
+        routing_config = self.cat.mad_hatter.execute_hook("agent_tool_routing", default_routing_config)
+
+        # recall score of each tool
+        scores = {}
+        for m in stray.working_memory["procedural_memories"]:
+            scores[m.metadata["name"]] = max(m.score, scores.get(m.metadata["name"], m.score))
+
+        thresholds = routing_config.get("tool_thresholds") or {}
+        default_threshold = routing_config.get("threshold")
+
+        def clears_threshold(tool):
+            threshold = thresholds.get(tool.name, default_threshold)
+            return threshold is None or scores[tool.name] >= threshold
+
+        scored_tools = [t for t in allowed_tools if t.name in scores and clears_threshold(t)]
+
+        # discard tools far from the best one
+        margin = routing_config.get("margin")
+        if margin is not None and len(scored_tools) > 0:
+            best_score = max(scores[t.name] for t in scored_tools)
+            scored_tools = [t for t in scored_tools if scores[t.name] >= best_score - margin]
+
+        # tools forced by plugins (not recalled) are always kept
+        routed_tools = [t for t in allowed_tools if t.name not in scores or t in scored_tools]
+
+        log.debug(f"Tool routing: {len(routed_tools)}/{len(allowed_tools)} tools kept")
+
+        return routing_config.get("mode", "tool_agent"), routed_tools
+
+    def get_single_pass_prefix(self, prompt_prefix, allowed_tools):
+        """Main prompt prefix listing the tools, for the single pass mode."""
+        tools_prompt = prompts.SINGLE_PASS_TOOL_PROMPT.format(
+            tools="\n".join([f"{t.name}: {t.description}" for t in allowed_tools]),
+            tool_names=", ".join([t.name for t in allowed_tools])
+        )
+        # tool descriptions must not be taken as prompt variables
+        return prompt_prefix + tools_prompt.replace("{", "{{").replace("}", "}}")
+
+    def parse_single_pass_action(self, llm_output, allowed_tools):
+        """Tool and tool input chosen by the LLM in single pass mode, or None if the LLM answered directly."""
+        regex = r"Action\s*\d*\s*:(.*?)\nAction\s*\d*\s*Input\s*\d*\s*:[\s]*(.*)"
+        match = re.search(regex, llm_output, re.DOTALL)
+        if not match:
+            return None
+
+        action = match.group(1).strip()
+        for t in allowed_tools:
+            if t.name == action:
+                return t, match.group(2).strip(" ").strip('"')
+
+        return None
+
+    def execute_single_pass(self, agent_input, prompt_prefix, prompt_suffix, allowed_tools):
+        """Select the tool and answer in the same LLM generation.
+
+        Tools are listed in the main prompt. If the LLM answers directly, the answer is returned with one LLM call.
+        If it chooses a tool, the tool runs and the memory chain answers with the tool output.
+        """
+        agent_input["tools_output"] = ""
+        prefix = self.get_single_pass_prefix(prompt_prefix, allowed_tools)
+        out = self.execute_memory_chain(agent_input, prefix, prompt_suffix)
+
+        action = self.parse_single_pass_action(out["output"], allowed_tools)
+        if action is None:
+            return out
+
+        tool, tool_input = action
+        tool_output = tool.run(tool_input)
+        reply = self.single_pass_tool_reply(agent_input, tool, tool_input, tool_output)
+        if reply is not None:
+            return reply
+
+        out = self.execute_memory_chain(agent_input, prompt_prefix, prompt_suffix)
+        out["intermediate_steps"] = [((tool.name, tool_input), tool_output)]
+        return out
+
+    async def aexecute_single_pass(self, agent_input, prompt_prefix, prompt_suffix, allowed_tools, stream_callback=None):
+        """Async version of `execute_single_pass`.
+
+        The first generation may be a tool action, so it is not streamed.
+        """
+        agent_input["tools_output"] = ""
+        prefix = self.get_single_pass_prefix(prompt_prefix, allowed_tools)
+        out = await self.aexecute_memory_chain(agent_input, prefix, prompt_suffix)
+
+        action = self.parse_single_pass_action(out["output"], allowed_tools)
+        if action is None:
+            return out
+
+        tool, tool_input = action
+        tool_output = await tool.arun(tool_input)
+        reply = self.single_pass_tool_reply(agent_input, tool, tool_input, tool_output)
+        if reply is not None:
+            return reply
+
+        out = await self.aexecute_memory_chain(agent_input, prompt_prefix, prompt_suffix, stream_callback)
+        out["intermediate_steps"] = [((tool.name, tool_input), tool_output)]
+        return out
+
+    def single_pass_tool_reply(self, agent_input, tool, tool_input, tool_output):
+        """Reply with the tool output if the tool returns directly, otherwise prepare the memory chain input."""
+        if tool.return_direct:
+            return {
+                "input": agent_input["input"],
+                "intermediate_steps": [((tool.name, tool_input), tool_output)],
+                "output": tool_output
+            }
+
+        agent_input["tools_output"] = "## Tools output: \n" + tool_output if tool_output else ""
+        return None
+
+    def get_used_tools(self, tools_result):
+        # Extract of intermediate steps in the format ((tool_name, tool_input), output)
+        return list(map(lambda x:((x[0].tool, x[0].tool_input), x[1]), tools_result["intermediate_steps"]))
+
+    def is_return_direct(self, used_tools, allowed_tools):
+
+        # Get the name of the tools that have return_direct
+        return_direct_tools = []
+        for t in allowed_tools:
+            if t.return_direct:
+                return_direct_tools.append(t.name)
+
+        # execute_tool_agent returns immediately when a tool with return_direct is called, 
+        # so if one is used it is definitely the last one used
+        return used_tools[-1][0][0] in return_direct_tools
+
+    def execute_agent(self, stray):
+        """Instantiate the Agent with tools.
+
+        The method formats the main prompt and gather the allowed tools. It also instantiates a conversational Agent
+        from Langchain.
+
+        Parameters
+        ----------
+        stray : StrayCat
+            Session of the user whose message is being processed.
+
+        Returns
+        -------
+        agent_executor : AgentExecutor
+            Instance of the Agent provided with a set of tools.
+        """
+        agent_input, fast_reply, prompt_prefix, prompt_suffix, allowed_tools, mode = self.prepare_agent(stray)
+        if len(fast_reply.keys()) > 0:
+            return fast_reply
+
         # Try to get information from tools if there is some allowed
         if len(allowed_tools) > 0:
 
             log.debug(f"{len(allowed_tools)} allowed tools retrived.")
 
             try:
+                # tools selection and answer in one LLM call
+                if mode == "single_pass":
+                    return self.execute_single_pass(agent_input, prompt_prefix, prompt_suffix, allowed_tools)
+
                 tools_result = self.execute_tool_agent(agent_input, allowed_tools)
 
                 # If tools_result["output"] is None the LLM has used the fake tool none_of_the_others  
                 # so no relevant information has been obtained from the tools.
                 if tools_result["output"] != None:
                     
-                    # Extract of intermediate steps in the format ((tool_name, tool_input), output)
-                    used_tools = list(map(lambda x:((x[0].tool, x[0].tool_input), x[1]), tools_result["intermediate_steps"]))
-
-                    # Get the name of the tools that have return_direct
-                    return_direct_tools = []
-                    for t in allowed_tools:
-                        if t.return_direct:
-                            return_direct_tools.append(t.name)
-
-                    # execute_tool_agent returns immediately when a tool with return_direct is called, 
-                    # so if one is used it is definitely the last one used
-                    if used_tools[-1][0][0] in return_direct_tools:
+                    used_tools = self.get_used_tools(tools_result)
+
+                    if self.is_return_direct(used_tools, allowed_tools):
                         # intermediate_steps still contains the information of all the tools used even if their output is not returned
                         tools_result["intermediate_steps"] = used_tools
                         return tools_result
@@ -178,13 +468,68 @@ class AgentManager:
         out = self.execute_memory_chain(agent_input, prompt_prefix, prompt_suffix)
 
         return out
+
+    async def aexecute_agent(self, stray):
+        """Async version of `execute_agent`.
+
+        LLM calls are awaited, hooks run in a worker thread.
+
+        Parameters
+        ----------
+        stray : StrayCat
+            Session of the user whose message is being processed.
+        """
+        agent_input, fast_reply, prompt_prefix, prompt_suffix, allowed_tools, mode = await asyncio.to_thread(self.prepare_agent, stray)
+        if len(fast_reply.keys()) > 0:
+            return fast_reply
+
+        # Try to get information from tools if there is some allowed
+        if len(allowed_tools) > 0:
+
+            log.debug(f"{len(allowed_tools)} allowed tools retrived.")
+
+            try:
+                if mode == "single_pass":
+                    return await self.aexecute_single_pass(
+                        agent_input, prompt_prefix, prompt_suffix, allowed_tools, stray.stream_callback
+                    )
+
+                tools_result = await self.aexecute_tool_agent(agent_input, allowed_tools)
+
+                # None output means the LLM used the fake tool none_of_the_others
+                if tools_result["output"] != None:
+
+                    used_tools = self.get_used_tools(tools_result)
+
+                    if self.is_return_direct(used_tools, allowed_tools):
+                        tools_result["intermediate_steps"] = used_tools
+                        return tools_result
+
+                    agent_input["tools_output"] = "## Tools output: \n" + tools_result["output"] if tools_result["output"] else ""
+                    out = await self.aexecute_memory_chain(agent_input, prompt_prefix, prompt_suffix, stray.stream_callback)
+                    out["intermediate_steps"] = used_tools
+                    return out
+
+            except Exception as e:
+                log.error(e)
+                traceback.print_exc()
+
+        agent_input["tools_output"] = ""
+        out = await self.aexecute_memory_chain(agent_input, prompt_prefix, prompt_suffix, stray.stream_callback)
+
+        return out
     
-    def format_agent_input(self):
+    def format_agent_input(self, stray):
         """Format the input for the Agent.
 
         The method formats the strings of recalled memories and chat history that will be provided to the Langchain
         Agent and inserted in the prompt.
 
+        Parameters
+        ----------
+        stray : StrayCat
+            Session of the user whose message is being processed.
+
         Returns
         -------
         dict
@@ -203,7 +548,7 @@ class AgentManager:
         agent_prompt_chat_history
         """
 
-        working_memory = self.cat.working_memory
+        working_memory = stray.working_memory
 
         # format memories to be inserted in the prompt
         episodic_memory_formatted_content = self.agent_prompt_episodic_memories(
@@ -225,13 +570,13 @@ class AgentManager:
             "chat_history": conversation_history_formatted_content,
         }
 
-    def agent_prompt_episodic_memories(self, memory_docs: List[Document]) -> str:
+    def agent_prompt_episodic_memories(self, memory_docs: List[MemoryHit]) -> str:
         """Formats episodic memories to be inserted into the prompt.
 
         Parameters
         ----------
-        memory_docs : List[Document]
-            List of Langchain `Document` retrieved from the episodic memory.
+        memory_docs : List[MemoryHit]
+            List of memories retrieved from the episodic memory.
 
         Returns
         -------
@@ -240,14 +585,14 @@ class AgentManager:
         """
 
         # convert docs to simple text
-        memory_texts = [m[0].page_content.replace("\n", ". ") for m in memory_docs]
+        memory_texts = [m.page_content.replace("\n", ". ") for m in memory_docs]
 
         # add time information (e.g. "2 days ago")
         memory_timestamps = []
         for m in memory_docs:
 
             # Get Time information in the Document metadata
-            timestamp = m[0].metadata["when"]
+            timestamp = m.metadata["when"]
 
             # Get Current Time - Time when memory was stored
             delta = timedelta(seconds=(time.time() - timestamp))
@@ -269,14 +614,14 @@ class AgentManager:
 
         return memory_content
 
-    def agent_prompt_declarative_memories(self, memory_docs: List[Document]) -> str:
+    def agent_prompt_declarative_memories(self, memory_docs: List[MemoryHit]) -> str:
         """Formats the declarative memories for the prompt context.
         Such context is placed in the `agent_prompt_prefix` in the place held by {declarative_memory}.
 
         Parameters
         ----------
-        memory_docs : List[Document]
-            list of Langchain `Document` retrieved from the declarative memory.
+        memory_docs : List[MemoryHit]
+            list of memories retrieved from the declarative memory.
 
         Returns
         -------
@@ -285,14 +630,14 @@ class AgentManager:
         """
 
         # convert docs to simple text
-        memory_texts = [m[0].page_content.replace("\n", ". ") for m in memory_docs]
+        memory_texts = [m.page_content.replace("\n", ". ") for m in memory_docs]
 
         # add source information (e.g. "extracted from file.txt")
         memory_sources = []
         for m in memory_docs:
 
             # Get and save the source of the memory
-            source = m[0].metadata["source"]
+            source = m.metadata["source"]
             memory_sources.append(f" (extracted from {source})")
 
         # Join Document text content with related source information
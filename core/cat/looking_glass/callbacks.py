@@ -0,0 +1,33 @@
+from typing import Any, Awaitable, Callable
+
+from langchain.callbacks.base import AsyncCallbackHandler
+
+
+class NewTokenHandler(AsyncCallbackHandler):
+    """Forward tokens generated by the LLM to the client, as soon as they arrive.
+
+    Attributes
+    ----------
+    send : Callable
+        Coroutine function sending a message (dict) to the client that originated the request.
+
+    Notes
+    -----
+    Each token is sent as a message like::
+
+        {
+            "type": "chat_token",
+            "content": "token text"
+        }
+
+    The final `chat` message, with the whole answer and the `why`, is sent anyway at the end.
+    """
+
+    def __init__(self, send: Callable[[dict], Awaitable[Any]]):
+        self.send = send
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        await self.send({
+            "type": "chat_token",
+            "content": token
+        })
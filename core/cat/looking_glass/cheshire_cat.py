@@ -1,20 +1,26 @@
 import time
 from copy import deepcopy
 import traceback
-from typing import Literal, get_args
+import threading
+import asyncio
+from typing import Dict, Literal, Union, get_args
+from contextlib import contextmanager, asynccontextmanager
 import langchain
 import os
 from cat.log import log
 from cat.db.database import Database
 from cat.rabbit_hole import RabbitHole
+from cat.notifications import NotificationChannels
 from cat.mad_hatter.mad_hatter import MadHatter
 from cat.memory.working_memory import WorkingMemoryList
 from cat.memory.long_term_memory import LongTermMemory
 from cat.looking_glass.agent_manager import AgentManager
+from cat.looking_glass.stray_cat import StrayCat, current_stray
 
 # TODO: natural language dependencies; move to another file
 import cat.factory.llm as llms
 import cat.factory.embedder as embedders
+from cat.factory.cached_embedder import CachedEmbedder
 from cat.db import crud
 from langchain.llms import Cohere, OpenAI, OpenAIChat, AzureOpenAI, HuggingFaceTextGenInference
 from langchain.chat_models import ChatOpenAI
@@ -24,7 +30,7 @@ from langchain.chat_models import AzureChatOpenAI
 from cat.factory.custom_llm import CustomOpenAI
 
 
-MSG_TYPES = Literal["notification", "chat", "error"]
+MSG_TYPES = Literal["notification", "chat", "error", "ingestion"]
 
 # main class
 class CheshireCat:
@@ -34,8 +40,8 @@ class CheshireCat:
 
     Attributes
     ----------
-    ws_messages : list
-        List of notifications to be sent to the frontend.
+    notifications : NotificationChannels
+        Messages pushed to the websockets of each user (i.e. finished uploading a file).
 
     """
 
@@ -64,15 +70,22 @@ class CheshireCat:
         # Agent manager instance (for reasoning)
         self.agent_manager = AgentManager(self)
 
+        # cat messages not directly related to last user input
+        # i.e. finished uploading a file, pushed to the websockets of the user
+        self.notifications = NotificationChannels()
+
         # Rabbit Hole Instance
         self.rabbit_hole = RabbitHole(self)
 
         # allows plugins to do something after the cat bootstrap is complete
         self.mad_hatter.execute_hook("after_cat_bootstrap")
 
-        # queue of cat messages not directly related to last user input
-        # i.e. finished uploading a file
-        self.ws_messages = []      
+        # messages from the same user are processed one at a time,
+        #   messages from different users run in parallel
+        #   (user id -> [lock, messages holding or waiting for it])
+        self.user_locks = {}
+        self.user_locks_lock = threading.Lock()
+        self.user_async_locks = {}
 
     def load_natural_language(self):
         """Load Natural Language related objects.
@@ -91,7 +104,13 @@ class CheshireCat:
         """
         # LLM and embedder
         self._llm = self.get_language_model()
-        self.embedder = self.get_language_embedder()
+        # embedder is wrapped in a cache, so the same text is not embedded over and over.
+        #   A new cache is created each time the embedder is (re)loaded.
+        self.embedder = CachedEmbedder(self.get_language_embedder())
+
+        # chains built with the old LLM are not needed anymore
+        if hasattr(self, "agent_manager"):
+            self.agent_manager.clear_cache()
 
     def get_language_model(self) -> BaseLanguageModel:
         """Large Language Model (LLM) selection at bootstrap time.
@@ -228,6 +247,10 @@ class CheshireCat:
 
     def load_memory(self):
         """Load LongTerMemory and WorkingMemory."""
+        # pending writes of the previous memory are not lost
+        if hasattr(self, "memory"):
+            self.memory.vectors.close()
+
         # Memory
         vector_memory_config = {"cat": self, "verbose": True}
         self.memory = LongTermMemory(vector_memory_config=vector_memory_config)
@@ -238,12 +261,17 @@ class CheshireCat:
         # Load default shared working memory user
         self.working_memory = self.working_memory_list.get_working_memory()
 
-    def recall_relevant_memories_to_working_memory(self):
+    def recall_relevant_memories_to_working_memory(self, stray: StrayCat):
         """Retrieve context from memory.
 
         The method retrieves the relevant memories from the vector collections that are given as context to the LLM.
         Recalled memories are stored in the working memory.
 
+        Parameters
+        ----------
+        stray : StrayCat
+            Session of the user whose message is being processed.
+
         Notes
         -----
         The user's message is used as a query to make a similarity search in the Cat's vector memories.
@@ -258,27 +286,86 @@ class CheshireCat:
         before_cat_recalls_procedural_memories
         after_cat_recalls_memories
         """
-        user_id = self.working_memory.get_user_id()
-        recall_query = self.working_memory["user_message_json"]["text"]
+        working_memory = stray.working_memory
 
         # We may want to search in memory
-        recall_query = self.mad_hatter.execute_hook("cat_recall_query", recall_query)
+        recall_query = self.mad_hatter.execute_hook("cat_recall_query", working_memory["user_message_json"]["text"])
         log.info(f'Recall query: "{recall_query}"')
 
         # Embed recall query
         recall_query_embedding = self.embedder.embed_query(recall_query)
-        self.working_memory["recall_query"] = recall_query
+        working_memory["recall_query"] = recall_query
+        working_memory["recall_query_embedding"] = recall_query_embedding
+
+        recall_configs = self.get_recall_configs(stray, recall_query_embedding)
+
+        # recall relevant memories for all collections at once
+        memories = self.recall_memories_from_embeddings(recall_configs)
+
+        self.store_recalled_memories(stray, memories)
+
+    async def arecall_relevant_memories_to_working_memory(self, stray: StrayCat):
+        """Async version of `recall_relevant_memories_to_working_memory`.
+
+        Embedding is awaited natively when the embedder supports it.
+        Hooks and vector DB searches are blocking calls and run in worker threads, so they do not stall the event loop.
+
+        Parameters
+        ----------
+        stray : StrayCat
+            Session of the user whose message is being processed.
+        """
+        working_memory = stray.working_memory
+
+        # We may want to search in memory
+        recall_query = await asyncio.to_thread(
+            self.mad_hatter.execute_hook, "cat_recall_query", working_memory["user_message_json"]["text"]
+        )
+        log.info(f'Recall query: "{recall_query}"')
+
+        # Embed recall query
+        recall_query_embedding = await self.embedder.aembed_query(recall_query)
+        working_memory["recall_query"] = recall_query
+        working_memory["recall_query_embedding"] = recall_query_embedding
+
+        recall_configs = await asyncio.to_thread(self.get_recall_configs, stray, recall_query_embedding)
+
+        # recall relevant memories for all collections at once
+        memories = await asyncio.to_thread(self.recall_memories_from_embeddings, recall_configs)
+
+        await asyncio.to_thread(self.store_recalled_memories, stray, memories)
+
+    def get_recall_configs(self, stray: StrayCat, recall_query_embedding) -> dict:
+        """Recall configurations for each memory collection, as edited by hooks.
+
+        Parameters
+        ----------
+        stray : StrayCat
+            Session of the user whose message is being processed.
+        recall_query_embedding : List[float]
+            Embedding of the recall query.
+
+        Returns
+        -------
+        recall_configs : dict
+            Recall configurations indexed by collection name.
+        """
 
         # hook to do something before recall begins
         self.mad_hatter.execute_hook("before_cat_recalls_memories")
 
         # Setting default recall configs for each memory
         # TODO: can these data structrues become instances of a RecallSettings class?
+        # episodic recall can be limited to recent conversation (seconds), with `EPISODIC_RECALL_WINDOW`
+        episodic_time_window = os.getenv("EPISODIC_RECALL_WINDOW")
+
         default_episodic_recall_config = {
             "embedding": recall_query_embedding,
             "k": 3,
             "threshold": 0.7,
-            "metadata": {"source": user_id},
+            "metadata": {"source": stray.user_id},
+            "time_window": float(episodic_time_window) if episodic_time_window else None,
+            "search_params": None,
         }
 
         default_declarative_recall_config = {
@@ -286,6 +373,7 @@ class CheshireCat:
             "k": 3,
             "threshold": 0.7,
             "metadata": None,
+            "search_params": None,
         }
 
         default_procedural_recall_config = {
@@ -293,25 +381,58 @@ class CheshireCat:
             "k": 3,
             "threshold": 0.7,
             "metadata": None,
+            "search_params": None,
         }
 
         # hooks to change recall configs for each memory
-        recall_configs = [
-            self.mad_hatter.execute_hook("before_cat_recalls_episodic_memories", default_episodic_recall_config),
-            self.mad_hatter.execute_hook("before_cat_recalls_declarative_memories", default_procedural_recall_config),
-            self.mad_hatter.execute_hook("before_cat_recalls_procedural_memories", default_declarative_recall_config)
-        ]
+        return {
+            "episodic": self.mad_hatter.execute_hook("before_cat_recalls_episodic_memories", default_episodic_recall_config),
+            "declarative": self.mad_hatter.execute_hook("before_cat_recalls_declarative_memories", default_declarative_recall_config),
+            "procedural": self.mad_hatter.execute_hook("before_cat_recalls_procedural_memories", default_procedural_recall_config),
+        }
 
-        memory_types = self.memory.vectors.collections.keys()
+    def recall_memories_from_embeddings(self, recall_configs: dict) -> dict:
+        """Recall memories from all collections.
 
-        for config, memory_type in zip(recall_configs, memory_types):
-            memory_key = f"{memory_type}_memories"
+        Tools are recalled from the in-memory index kept by the Mad Hatter,
+        the other collections (and tools, if the index cannot be used) from the vector DB.
 
-            # recall relevant memories for collection
-            vector_memory = getattr(self.memory.vectors, memory_type)
-            memories = vector_memory.recall_memories_from_embedding(**config)
+        Parameters
+        ----------
+        recall_configs : dict
+            Recall configurations indexed by collection name.
 
-            self.working_memory[memory_key] = memories
+        Returns
+        -------
+        memories : dict
+            Recalled memories indexed by collection name.
+        """
+        recall_configs = dict(recall_configs)
+
+        procedural_memories = None
+        if "procedural" in recall_configs:
+            procedural_memories = self.mad_hatter.recall_tools(**recall_configs["procedural"])
+            if procedural_memories is not None:
+                del recall_configs["procedural"]
+
+        memories = self.memory.vectors.recall_memories_from_embeddings(recall_configs)
+        if procedural_memories is not None:
+            memories["procedural"] = procedural_memories
+
+        return memories
+
+    def store_recalled_memories(self, stray: StrayCat, memories: dict):
+        """Store recalled memories in the working memory.
+
+        Parameters
+        ----------
+        stray : StrayCat
+            Session of the user whose message is being processed.
+        memories : dict
+            Recalled memories indexed by collection name.
+        """
+        for memory_type, memories_of_type in memories.items():
+            stray.working_memory[f"{memory_type}_memories"] = memories_of_type
 
         # hook to modify/enrich retrieved memories
         self.mad_hatter.execute_hook("after_cat_recalls_memories")
@@ -340,17 +461,19 @@ class CheshireCat:
         if isinstance(self._llm, langchain.chat_models.base.BaseChatModel):
             return self._llm.call_as_llm(prompt)
 
-    def send_ws_message(self, content: str, msg_type: MSG_TYPES = "notification"):
+    def send_ws_message(self, content: Union[str, Dict], msg_type: MSG_TYPES = "notification", user_id: str = None):
         """Send a message via websocket.
 
         This method is useful for sending a message via websocket directly without passing through the LLM
 
         Parameters
         ----------
-        content : str
-            The content of the message.
+        content : str, dict
+            The content of the message (a dict for `ingestion` progress events).
         msg_type : str
-            The type of the message. Should be either `notification`, `chat` or `error`
+            The type of the message. Should be either `notification`, `chat`, `error` or `ingestion`
+        user_id : str
+            User receiving the message on their websockets, all connected users if None.
         """
 
         options = get_args(MSG_TYPES)
@@ -359,16 +482,16 @@ class CheshireCat:
             raise ValueError(f"The message type `{msg_type}` is not valid. Valid types: {', '.join(options)}")
 
         if msg_type == "error":
-            self.ws_messages.append({
+            self.notifications.publish({
                 "type": msg_type,
                 "name": "GenericError",
                 "description": content
-            })
+            }, user_id)
         else:
-            self.ws_messages.append({
+            self.notifications.publish({
                 "type": msg_type,
                 "content": content
-            })
+            }, user_id)
 
     def get_base_url(self):
         """Allows the Cat expose the base url."""
@@ -393,6 +516,28 @@ class CheshireCat:
         """Allows the Cat expose the static files path."""
         return os.path.join(self.get_base_path(), "static/")
 
+    @contextmanager
+    def user_lock(self, user_id: str):
+        """Hold the lock serializing the messages of a user.
+
+        A lock only exists while messages of its user are processed or waiting,
+        so locks do not pile up with the users ever seen.
+        """
+        with self.user_locks_lock:
+            if user_id not in self.user_locks:
+                self.user_locks[user_id] = [threading.Lock(), 0]
+            entry = self.user_locks[user_id]
+            entry[1] += 1
+
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.user_locks_lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self.user_locks[user_id]
+
     def __call__(self, user_message_json):
         """Call the Cat instance.
 
@@ -414,80 +559,249 @@ class CheshireCat:
         The retrieved context is formatted properly and given in input to the Agent that uses the LLM to produce the
         answer. This is formatted in a dictionary to be sent as a JSON via Websocket to the client.
 
+        Each message is served by a `StrayCat`, a session holding the user's working memory,
+        so messages from different users can be processed concurrently.
+
+        """
+        log.info(user_message_json)
+
+        user_id = user_message_json.get('user_id', 'user')
+        user_message_json['user_id'] = user_id
+
+        with self.user_lock(user_id):
+            stray = StrayCat(self, user_id, self.working_memory_list.get_working_memory(user_id))
+
+            # hooks and tools will receive the session as `cat`
+            token = current_stray.set(stray)
+            try:
+                return self.process_message(stray, user_message_json)
+            finally:
+                current_stray.reset(token)
+
+    async def acall(self, user_message_json, stream_callback=None):
+        """Call the Cat instance asynchronously.
+
+        Async version of `__call__`, meant to be awaited directly in the event loop (i.e. by the websocket).
+
+        Parameters
+        ----------
+        user_message_json : dict
+            Dictionary received from the Websocket client.
+        stream_callback : Callable, optional
+            Coroutine function sending a message to the client.
+            If given and the user message has `"stream": true`, the answer tokens are sent
+            as `chat_token` messages while the LLM generates them.
+
+        Returns
+        -------
+        final_output : dict
+            Dictionary with the Cat's answer to be sent to the client.
+
+        Notes
+        -----
+        Embedder and LLM calls are awaited natively when the model supports it,
+        otherwise they run in a worker thread.
+        Hooks, tools and vector DB calls are blocking and always run in worker threads,
+        so a slow plugin does not stall other conversations.
+
         """
         log.info(user_message_json)
 
-        # Change working memory based on received user_id
         user_id = user_message_json.get('user_id', 'user')
         user_message_json['user_id'] = user_id
-        self.working_memory = self.working_memory_list.get_working_memory(user_id)
+
+        # stream tokens only to clients asking for it
+        if not user_message_json.get("stream", False):
+            stream_callback = None
+
+        async with self.user_async_lock(user_id):
+            stray = StrayCat(
+                self, user_id, self.working_memory_list.get_working_memory(user_id), stream_callback=stream_callback
+            )
+
+            # hooks and tools will receive the session as `cat`
+            #   (the context is copied in worker threads)
+            token = current_stray.set(stray)
+            try:
+                return await self.aprocess_message(stray, user_message_json)
+            finally:
+                current_stray.reset(token)
+
+    @asynccontextmanager
+    async def user_async_lock(self, user_id: str):
+        """Hold the lock serializing the messages of a user in the async pipeline.
+
+        As for `user_lock`, the lock is dropped once no message of the user holds or waits for it.
+        """
+        # no await while counting, so no other coroutine can sneak in
+        if user_id not in self.user_async_locks:
+            self.user_async_locks[user_id] = [asyncio.Lock(), 0]
+        entry = self.user_async_locks[user_id]
+        entry[1] += 1
+
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.user_async_locks[user_id]
+
+    def process_message(self, stray: StrayCat, user_message_json: dict) -> dict:
+        """Run the main pipeline on a user message.
+
+        Parameters
+        ----------
+        stray : StrayCat
+            Session of the user sending the message.
+        user_message_json : dict
+            Dictionary received from the Websocket client.
+
+        Returns
+        -------
+        final_output : dict
+            Dictionary with the Cat's answer to be sent to the client.
+        """
 
         # hook to modify/enrich user input
         user_message_json = self.mad_hatter.execute_hook("before_cat_reads_message", user_message_json)
 
         # store last message in working memory
-        self.working_memory["user_message_json"] = user_message_json
+        stray.working_memory["user_message_json"] = user_message_json
 
         # recall episodic and declarative memories from vector collections
         #   and store them in working_memory
         try:
-            self.recall_relevant_memories_to_working_memory()
+            self.recall_relevant_memories_to_working_memory(stray)
         except Exception as e:
-            log.error(e)
-            traceback.print_exc(e)
+            return self.vector_memory_error(e)
 
-            err_message = (
-                "You probably changed Embedder and old vector memory is not compatible. "
-                "Please delete `core/long_term_memory` folder."
-            )
+        # reply with agent
+        try:
+            cat_message = self.agent_manager.execute_agent(stray)
+        except Exception as e:
+            cat_message = self.recover_llm_output(stray, e)
+
+        return self.finalize_reply(stray, cat_message)
+
+    async def aprocess_message(self, stray: StrayCat, user_message_json: dict) -> dict:
+        """Async version of `process_message`.
+
+        Parameters
+        ----------
+        stray : StrayCat
+            Session of the user sending the message.
+        user_message_json : dict
+            Dictionary received from the Websocket client.
+
+        Returns
+        -------
+        final_output : dict
+            Dictionary with the Cat's answer to be sent to the client.
+        """
+
+        # hook to modify/enrich user input
+        user_message_json = await asyncio.to_thread(
+            self.mad_hatter.execute_hook, "before_cat_reads_message", user_message_json
+        )
+
+        # store last message in working memory
+        stray.working_memory["user_message_json"] = user_message_json
+
+        # recall episodic and declarative memories from vector collections
+        #   and store them in working_memory
+        try:
+            await self.arecall_relevant_memories_to_working_memory(stray)
+        except Exception as e:
+            return self.vector_memory_error(e)
 
-            return {
-                "type": "error",
-                "name": "VectorMemoryError",
-                "description": err_message,
-            }
-        
         # reply with agent
         try:
-            cat_message = self.agent_manager.execute_agent()
+            cat_message = await self.agent_manager.aexecute_agent(stray)
         except Exception as e:
-            # This error happens when the LLM
-            #   does not respect prompt instructions.
-            # We grab the LLM output here anyway, so small and
-            #   non instruction-fine-tuned models can still be used.
-            error_description = str(e)
-
-            log.error(error_description)
-            if not "Could not parse LLM output: `" in error_description:
-                raise e
-
-            unparsable_llm_output = error_description.replace("Could not parse LLM output: `", "").replace("`", "")
-            cat_message = {
-                "input": self.working_memory["user_message_json"]["text"],
-                "intermediate_steps": [],
-                "output": unparsable_llm_output
-            }
+            cat_message = self.recover_llm_output(stray, e)
+
+        return await asyncio.to_thread(self.finalize_reply, stray, cat_message)
+
+    def vector_memory_error(self, e: Exception) -> dict:
+        """Error message sent to the client when recall fails."""
+        log.error(e)
+        traceback.print_exc()
+
+        err_message = (
+            "You probably changed Embedder and old vector memory is not compatible. "
+            "Please delete `core/long_term_memory` folder."
+        )
+
+        return {
+            "type": "error",
+            "name": "VectorMemoryError",
+            "description": err_message,
+        }
+
+    def recover_llm_output(self, stray: StrayCat, e: Exception) -> dict:
+        """Grab the LLM output from an agent parsing error.
+
+        This error happens when the LLM does not respect prompt instructions.
+        We grab the LLM output here anyway, so small and non instruction-fine-tuned models can still be used.
+        Any other error is raised again.
+        """
+        error_description = str(e)
+
+        log.error(error_description)
+        if not "Could not parse LLM output: `" in error_description:
+            raise e
+
+        unparsable_llm_output = error_description.replace("Could not parse LLM output: `", "").replace("`", "")
+        return {
+            "input": stray.working_memory["user_message_json"]["text"],
+            "intermediate_steps": [],
+            "output": unparsable_llm_output
+        }
+
+    def finalize_reply(self, stray: StrayCat, cat_message: dict) -> dict:
+        """Store the conversation turn and build the message for the client.
+
+        Parameters
+        ----------
+        stray : StrayCat
+            Session of the user sending the message.
+        cat_message : dict
+            Output of the agent.
+
+        Returns
+        -------
+        final_output : dict
+            Dictionary with the Cat's answer to be sent to the client.
+        """
+        working_memory = stray.working_memory
 
         log.info("cat_message:")
         log.info(cat_message)
 
         # update conversation history
-        user_message = self.working_memory["user_message_json"]["text"]
-        self.working_memory.update_conversation_history(who="Human", message=user_message)
-        self.working_memory.update_conversation_history(who="AI", message=cat_message["output"])
+        user_message = working_memory["user_message_json"]["text"]
+        working_memory.update_conversation_history(who="Human", message=user_message)
+        working_memory.update_conversation_history(who="AI", message=cat_message["output"])
 
         # store user message in episodic memory
         # TODO: vectorize and store also conversation chunks
         #   (not raw dialog, but summarization)
-        _ = self.memory.vectors.episodic.add_texts(
-            [user_message],
-            [{"source": user_id, "when": time.time()}],
+        # the message was already embedded for recall, unless a hook changed the recall query
+        if working_memory.get("recall_query") == user_message and "recall_query_embedding" in working_memory:
+            user_message_embedding = working_memory["recall_query_embedding"]
+        else:
+            user_message_embedding = self.embedder.embed_query(user_message)
+        self.memory.vectors.episodic_writer.add(
+            user_message,
+            {"source": stray.user_id, "when": time.time()},
+            user_message_embedding
         )
 
         # build data structure for output (response and why with memories)
-        episodic_report = [dict(d[0]) | {"score": float(d[1]), "id": d[3]} for d in self.working_memory["episodic_memories"]]
-        declarative_report = [dict(d[0]) | {"score": float(d[1]), "id": d[3]} for d in self.working_memory["declarative_memories"]]
-        procedural_report = [dict(d[0]) | {"score": float(d[1]), "id": d[3]} for d in self.working_memory["procedural_memories"]]
+        episodic_report = [m.to_dict() for m in working_memory["episodic_memories"]]
+        declarative_report = [m.to_dict() for m in working_memory["declarative_memories"]]
+        procedural_report = [m.to_dict() for m in working_memory["procedural_memories"]]
         
         final_output = {
             "type": "chat",
@@ -53,6 +53,20 @@ Question: {input}
 {agent_scratchpad}"""
 
 
+SINGLE_PASS_TOOL_PROMPT = """
+
+# Tools
+
+If one of the following tools is needed to answer, reply only with:
+Action: the name of the tool, should be one of [{tool_names}]
+Action Input: the input to the tool
+
+{tools}
+
+Otherwise, answer directly.
+"""
+
+
 MAIN_PROMPT_PREFIX = """[No prose]
     [Output only JSON]
     Sei Sonny, un robot umanoide a grandezza reale. Sei stampato in 3D e puoi muoverti. Sei dotato di un cervello artificiale che ti permette di imparare e di parlare con gli umani. Hai 2 mani, 2 occhi, 2 braccia e 1 testa e un display sul petto. Ti ha creato Giovanni Mirulla, un ragazzo di 24 anni con la passione per la robotica e per i LEGO.
@@ -0,0 +1,64 @@
+from typing import Callable, Dict, Union
+from contextvars import ContextVar
+
+from cat.memory.working_memory import WorkingMemory
+
+
+# Cat session serving the current request, if any.
+#   Hooks and tools are shared by all users: they find their session here.
+current_stray = ContextVar("current_stray", default=None)
+
+
+class StrayCat:
+    """Request-scoped session of the Cheshire Cat.
+
+    The Cheshire Cat is a singleton shared by all users, while a conversation turn needs its own context.
+    A `StrayCat` carries the context of a single user message (user id and working memory)
+    and behaves like the Cheshire Cat for everything else, so it can be passed to hooks and tools as `cat`.
+
+    Attributes
+    ----------
+    ccat : CheshireCat
+        Cheshire Cat instance.
+    user_id : str
+        Id of the user sending the message.
+    working_memory : WorkingMemory
+        Working memory of the user.
+    stream_callback : Callable
+        Coroutine function sending a message to the client that originated the request.
+        If set, the answer is streamed token by token while it is generated.
+
+    Notes
+    -----
+    Attributes not found in the session are looked up in the Cheshire Cat (i.e. `cat.mad_hatter`, `cat.memory`),
+    while attributes set on the session only live for the current request.
+    """
+
+    def __init__(self, ccat, user_id: str, working_memory: WorkingMemory, stream_callback: Callable = None):
+        self.ccat = ccat
+        self.user_id = user_id
+        self.working_memory = working_memory
+        self.stream_callback = stream_callback
+
+    def send_ws_message(self, content: Union[str, Dict], msg_type: str = "notification", user_id: str = None):
+        """Send a message via websocket to the user of the session.
+
+        Same as `CheshireCat.send_ws_message`, but hooks and tools notifying something while serving
+        a message reach only the websockets of the user who sent it, not every connected user.
+
+        Parameters
+        ----------
+        content : str, dict
+            The content of the message.
+        msg_type : str
+            The type of the message. Should be either `notification`, `chat`, `error` or `ingestion`
+        user_id : str
+            User receiving the message, the user of the session if None.
+        """
+        self.ccat.send_ws_message(content, msg_type=msg_type, user_id=user_id or self.user_id)
+
+    def __getattr__(self, name):
+        # delegate everything else to the Cheshire Cat
+        if name == "ccat":
+            raise AttributeError(name)
+        return getattr(self.ccat, name)
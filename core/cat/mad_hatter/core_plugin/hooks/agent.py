@@ -99,3 +99,42 @@ def agent_allowed_tools(allowed_tools: List[str], cat) -> List[str]:
 
 
 
+
+
+@hook(priority=0)
+def agent_tool_routing(routing_config: Dict, cat) -> Dict:
+    """Hook the tool routing.
+
+    Allows to decide, without calling the LLM, if and how the recalled tools are used.
+
+    Tools are kept only if their recall score clears their threshold and is not too far from the best scoring tool.
+    If no tool is left, the tool agent is skipped and the Cat answers with a single LLM call.
+
+    Parameters
+    ----------
+    routing_config : Dict
+        Dictionary with the following keys:
+
+        - mode: "tool_agent" runs the tool agent and then the memory chain (default);
+          "single_pass" puts the tools in the main prompt, so tool selection and answer are in the same generation;
+
+        - threshold: minimum recall score for a tool to be used (None, the default, keeps every recalled tool);
+
+        - margin: tools scoring more than `margin` below the best tool are discarded (None, the default, keeps them);
+
+        - tool_thresholds: dictionary of per-tool thresholds (tool name -> score), overriding `threshold`.
+    cat : CheshireCat
+        Cheshire Cat instance.
+
+    Returns
+    -------
+    routing_config : Dict
+        Edited routing configuration.
+
+    Notes
+    -----
+    Tools added by the `agent_allowed_tools` hook without being recalled have no score and are always kept.
+
+    """
+
+    return routing_config
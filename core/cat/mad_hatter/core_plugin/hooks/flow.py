@@ -171,6 +171,9 @@ def before_cat_recalls_episodic_memories(episodic_recall_config: dict, cat) -> d
     The hook return the values for maximum number (k) of items to retrieve from memory and the score threshold applied
     to the query in the vector memory (items with score under threshold are not retrieved).
     It also returns the embedded query (embedding) and the conditions on recall (metadata).
+    `search_params` changes the search parameters of the collection settings for this recall
+    (`hnsw_ef`, `exact`, `rescore`, `oversampling`), trading accuracy for latency.
+    Recall can be limited to the memories of the last `time_window` seconds (None recalls the whole history).
 
     Parameters
     ----------
@@ -200,6 +203,8 @@ def before_cat_recalls_declarative_memories(declarative_recall_config: dict, cat
     The hook return the values for maximum number (k) of items to retrieve from memory and the score threshold applied
     to the query in the vector memory (items with score under threshold are not retrieved)
     It also returns the embedded query (embedding) and the conditions on recall (metadata).
+    `search_params` changes the search parameters of the collection settings for this recall
+    (`hnsw_ef`, `exact`, `rescore`, `oversampling`), trading accuracy for latency.
 
     Parameters
     ----------
@@ -229,6 +234,8 @@ def before_cat_recalls_procedural_memories(procedural_recall_config: dict, cat)
     The hook return the values for maximum number (k) of items to retrieve from memory and the score threshold applied
     to the query in the vector memory (items with score under threshold are not retrieved)
     It also returns the embedded query (embedding) and the conditions on recall (metadata).
+    `search_params` changes the search parameters of the collection settings for this recall
+    (`hnsw_ef`, `exact`, `rescore`, `oversampling`), trading accuracy for latency.
 
     Parameters
     ----------
@@ -1,9 +1,12 @@
+import asyncio
 from typing import Any, List, Union, Callable
 from inspect import signature
 
 from langchain.tools import BaseTool
 from langchain.agents import Tool
 
+from cat.looking_glass.stray_cat import current_stray
+
 # All @tool decorated functions in plugins become a CatTool.
 # The difference between base langchain Tool and CatTool is that CatTool has an instance of the cat as attribute (set by the MadHatter)
 class CatTool(Tool):
@@ -25,11 +28,14 @@ class CatTool(Tool):
             self.description = self.description.replace(cat_arg_signature, ")")
 
     def _run(self, input_by_llm):
-        return self.func(input_by_llm, cat=self.cat)
+        # while serving a message, tools receive the user session as `cat`
+        cat = current_stray.get() or self.cat
+        return self.func(input_by_llm, cat=cat)
 
     async def _arun(self, input_by_llm):
-        # should be used for async Tools, just using sync here
-        return self._run(input_by_llm, cat=self.cat)
+        # tools are sync functions, run them in a worker thread
+        #   (the context is copied, so the tool still gets the user session)
+        return await asyncio.to_thread(self._run, input_by_llm)
 
     # override `extra = 'forbid'` for Tool pydantic model in langchain
     class Config:
@@ -6,11 +6,15 @@ import os
 import traceback
 from copy import deepcopy
 
+import numpy as np
+
 from cat.log import log
 from cat.db import crud
 from cat.db.models import Setting
 from cat.mad_hatter.plugin_extractor import PluginExtractor
 from cat.mad_hatter.plugin import Plugin
+from cat.looking_glass.stray_cat import current_stray
+from cat.memory.vector_memory import MemoryHit
 
 # This class is responsible for plugins functionality:
 # - loading
@@ -33,6 +37,10 @@ class MadHatter:
 
         self.active_plugins = []
 
+        # in-memory copy of the embedded tools (procedural memory),
+        #   a tuple (points, normalized embeddings matrix)
+        self.tools_index = None
+
         self.find_plugins()
 
     def install_plugin(self, package_plugin):
@@ -142,6 +150,15 @@ class MadHatter:
         # sort each hooks list by priority
         for hook_name in self.hooks.keys():
             self.hooks[hook_name].sort(key=lambda x: x.priority, reverse=True)
+
+        # chains and agents cached with the old hooks and tools are outdated
+        if hasattr(self.ccat, "agent_manager"):
+            self.ccat.agent_manager.clear_cache()
+
+        # tools index only contains active tools
+        #   (at bootstrap memory is not loaded yet, the index is built by `embed_tools`)
+        if hasattr(self.ccat, "memory"):
+            self.build_tools_index()
                 
     # check if plugin exists
     def plugin_exists(self, plugin_id):
@@ -215,6 +232,95 @@ class MadHatter:
                 points_selector=points_to_be_deleted
             )
 
+        self.build_tools_index()
+
+    def build_tools_index(self):
+        """Load active tools embeddings from procedural memory into a NumPy matrix.
+
+        Procedural memory holds a few tool descriptions, so tools recall is faster as a
+        matrix product in process than as a vector DB search.
+        The Qdrant collection remains the persisted source of truth, the index is rebuilt from it
+        each time tools change.
+        """
+
+        active_tools_descriptions = set(t.description for t in self.tools)
+        points = [
+            p for p in self.ccat.memory.vectors.procedural.get_all_points()
+            if p.payload["page_content"] in active_tools_descriptions
+        ]
+
+        if len(points) == 0:
+            self.tools_index = ([], None)
+            return
+
+        embeddings = np.array([p.vector for p in points], dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1, norms)
+
+        # swap the whole index at once, messages are recalling tools in other threads
+        self.tools_index = (points, embeddings)
+
+    def recall_tools(self, embedding, metadata=None, k=3, threshold=None, with_vectors=False, payload_fields=None,
+                     search_params=None):
+        """Recall tools similar to an embedding from the in-memory index.
+
+        Parameters
+        ----------
+        embedding : List[float]
+            Embedding of the recall query.
+        metadata : dict
+            Metadata filter. Not supported by the index.
+        k : int
+            Maximum number of tools to recall.
+        threshold : float
+            Minimum cosine similarity.
+        with_vectors : bool
+            Also return the tools embeddings.
+        payload_fields : Sequence[str]
+            Ignored, tools payloads are already in memory.
+        search_params : dict
+            Ignored, the index search is exact.
+
+        Returns
+        -------
+        memories : List[MemoryHit] | None
+            Recalled tools, in the same format as `VectorMemoryCollection.recall_memories_from_embedding`.
+            None if the index cannot serve the request (not built yet or metadata filter),
+            so the caller can fall back to the vector DB.
+        """
+
+        tools_index = self.tools_index
+        if tools_index is None or metadata:
+            return None
+
+        points, embeddings = tools_index
+        if embeddings is None or k <= 0:
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query_norm = np.linalg.norm(query)
+        if query_norm == 0:
+            return []
+
+        # cosine similarity with all tools at once
+        scores = embeddings @ (query / query_norm)
+
+        top_k = np.argsort(-scores)[:k]
+        if threshold is not None:
+            top_k = [i for i in top_k if scores[i] >= threshold]
+
+        procedural = self.ccat.memory.vectors.procedural
+        memories = []
+        for i in top_k:
+            hit = MemoryHit.from_point(
+                points[i], float(scores[i]), procedural.content_payload_key, procedural.metadata_payload_key
+            )
+            if not with_vectors:
+                hit.vector = None
+            memories.append(hit)
+
+        return memories
+
     # activate / deactivate plugin
     def toggle_plugin(self, plugin_id):
         log(f"toggle plugin {plugin_id}", "WARNING")
@@ -253,6 +359,9 @@ class MadHatter:
         # check if hook is supported
         if hook_name not in self.hooks.keys():
             raise Exception(f"Hook {hook_name} not present in any plugin")
+
+        # while serving a message, hooks receive the user session as `cat`
+        cat = current_stray.get() or self.ccat
         
         # Hook has no arguments (aside cat)
         #  no need to pipe
@@ -260,7 +369,7 @@ class MadHatter:
             for hook in self.hooks[hook_name]:
                 try:
                     log.debug(f"Executing {hook.plugin_id}::{hook.name} with priotrity {hook.priority}")
-                    hook.function(cat=self.ccat)
+                    hook.function(cat=cat)
                 except Exception as e:
                     log.error(f"Error in plugin {hook.plugin_id}::{hook.name}")
                     log.error(e)
@@ -282,7 +391,7 @@ class MadHatter:
                 tea_spoon = hook.function(
                     deepcopy(tea_cup),
                     *deepcopy(args[1:]),
-                    cat=self.ccat
+                    cat=cat
                 )
                 #log.debug(f"Hook {hook.plugin_id}::{hook.name} returned {tea_spoon}")
                 if tea_spoon is not None:
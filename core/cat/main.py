@@ -28,11 +28,22 @@ async def lifespan(app: FastAPI):
     # - Starlette allows this: https://www.starlette.io/applications/#storing-state-on-the-app-instance
     app.state.ccat = CheshireCat()
 
+    # restart ingestion jobs interrupted by the last shutdown
+    app.state.ccat.rabbit_hole.scheduler.resume_jobs()
+
     # startup message with admin, public and swagger addresses
     log.welcome()
 
     yield
 
+    # stop ingestion workers (queued jobs will resume at next boot)
+    app.state.ccat.rabbit_hole.scheduler.shutdown()
+    app.state.ccat.rabbit_hole.web_fetcher.close()
+    app.state.ccat.rabbit_hole.parser_pool.shutdown()
+
+    # store memories still in the write-behind buffer
+    app.state.ccat.memory.vectors.close()
+
 
 def custom_generate_unique_id(route: APIRoute):
     return f"{route.name}"
@@ -0,0 +1,124 @@
+from typing import Dict, Literal, Optional, Union
+
+from pydantic import BaseModel, Field
+from qdrant_client.http.models import (Distance, VectorParams, HnswConfigDiff, SearchParams, QuantizationSearchParams,
+                                       ScalarQuantization, ScalarQuantizationConfig, ScalarType, BinaryQuantization,
+                                       BinaryQuantizationConfig, Disabled, CollectionInfo, VectorParamsDiff)
+
+from cat.db import crud, models
+
+
+# collection settings are saved in settings table under this category
+COLLECTION_SETTINGS_CATEGORY = "vector_collection"
+
+
+class CollectionSettings(BaseModel):
+    """Index profile of a memory collection, and its default search parameters.
+
+    Index parameters trade RAM and indexing time for recall accuracy and latency;
+    search parameters can be changed for each recall (see `search_params`).
+    Defaults are the parameters collections always had.
+    """
+
+    # HNSW graph
+    hnsw_m: int = Field(default=16, ge=0, description="Edges per node of the HNSW graph (more is more accurate and bigger)")
+    hnsw_ef_construct: int = Field(default=100, ge=4, description="Neighbours considered while building the graph")
+    hnsw_payload_m: Optional[int] = Field(
+        default=None, ge=0, description="Edges per node of the graphs built for each user (partitioned collections)"
+    )
+
+    # vectors storage
+    on_disk: bool = Field(default=False, description="Keep original vectors on disk (memory-mapped) instead of RAM")
+    quantization: Literal["scalar", "binary", "none"] = Field(
+        default="scalar", description="Compressed copy of the vectors used for search"
+    )
+    quantile: float = Field(default=0.75, gt=0.5, le=1.0, description="Quantile used to bound scalar quantization")
+    always_ram: bool = Field(default=False, description="Keep quantized vectors in RAM")
+
+    # search
+    hnsw_ef: Optional[int] = Field(default=None, ge=1, description="Candidates explored at search time (None is Qdrant default)")
+    exact: bool = Field(default=False, description="Exact search, without the HNSW index")
+    rescore: bool = Field(default=True, description="Rescore quantized results with the original vectors")
+    oversampling: Optional[float] = Field(default=None, ge=1.0, description="Candidates fetched for rescoring, as a multiple of k")
+
+    def vectors_config(self, size: int) -> VectorParams:
+        return VectorParams(size=size, distance=Distance.COSINE, on_disk=self.on_disk)
+
+    def hnsw_config(self) -> HnswConfigDiff:
+        return HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct, payload_m=self.hnsw_payload_m)
+
+    def partitioned(self) -> "CollectionSettings":
+        """Profile of a collection partitioned by user (payload based multitenancy).
+
+        Instead of one global HNSW graph, Qdrant builds a graph for each value of the indexed
+        tenant field: a search filtered on a user only visits the memories of that user.
+        """
+        return self.copy(update={"hnsw_m": 0, "hnsw_payload_m": self.hnsw_payload_m or self.hnsw_m or 16})
+
+    def quantization_config(self) -> Optional[Union[ScalarQuantization, BinaryQuantization]]:
+        if self.quantization == "scalar":
+            return ScalarQuantization(
+                scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=self.quantile, always_ram=self.always_ram)
+            )
+        if self.quantization == "binary":
+            return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=self.always_ram))
+        return None
+
+    def search_params(self, overrides: Dict = None) -> SearchParams:
+        """Search parameters of the profile, with some of them (`hnsw_ef`, `exact`, `rescore`, `oversampling`)
+        changed for a single recall."""
+        params = {
+            "hnsw_ef": self.hnsw_ef,
+            "exact": self.exact,
+            "rescore": self.rescore,
+            "oversampling": self.oversampling,
+        }
+        unknown = set(overrides or {}) - set(params)
+        if len(unknown) > 0:
+            raise ValueError(f"Unknown search params {sorted(unknown)}. Allowed: {list(params)}")
+        params.update(overrides or {})
+
+        quantization = None
+        if self.quantization != "none":
+            quantization = QuantizationSearchParams(
+                ignore=False, rescore=params["rescore"], oversampling=params["oversampling"]
+            )
+        return SearchParams(hnsw_ef=params["hnsw_ef"], exact=params["exact"], quantization=quantization)
+
+    def matches(self, info: CollectionInfo) -> bool:
+        """Whether a collection in the vector DB is indexed with this profile."""
+        hnsw = info.config.hnsw_config
+        if hnsw.m != self.hnsw_m or hnsw.ef_construct != self.hnsw_ef_construct:
+            return False
+        if self.hnsw_payload_m is not None and hnsw.payload_m != self.hnsw_payload_m:
+            return False
+
+        if bool(info.config.params.vectors.on_disk) != self.on_disk:
+            return False
+
+        return info.config.quantization_config == self.quantization_config()
+
+    def update_params(self) -> Dict:
+        """Arguments of `update_collection` turning a collection to this profile."""
+        return {
+            "vectors_config": {"": VectorParamsDiff(on_disk=self.on_disk)},
+            "hnsw_config": self.hnsw_config(),
+            "quantization_config": self.quantization_config() or Disabled.DISABLED,
+        }
+
+
+def get_collection_settings(collection_name: str) -> CollectionSettings:
+    """Settings of a collection, defaults if never saved."""
+    setting = crud.get_setting_by_name(name=f"{COLLECTION_SETTINGS_CATEGORY}_{collection_name}")
+    if setting is None:
+        return CollectionSettings()
+    return CollectionSettings(**setting["value"])
+
+
+def save_collection_settings(collection_name: str, settings: CollectionSettings) -> CollectionSettings:
+    crud.upsert_setting_by_name(models.Setting(
+        name=f"{COLLECTION_SETTINGS_CATEGORY}_{collection_name}",
+        category=COLLECTION_SETTINGS_CATEGORY,
+        value=settings.dict()
+    ))
+    return settings
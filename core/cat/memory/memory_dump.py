@@ -0,0 +1,198 @@
+import io
+import os
+import json
+import time
+import struct
+import shutil
+import zipfile
+import tempfile
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+
+class MemoryDump:
+    """Binary memory dump, a compact alternative to the JSON memory file.
+
+    The dump is a zip archive with:
+
+    - `manifest.json`: format version, embedder, vectors dtype and size, rows of each collection;
+    - `memories.jsonl`: one memory per line (`id`, `page_content`, `metadata`, `collection`);
+    - `vectors.npy`: all the vectors, a contiguous float32 (or float16) array, one row per line of `memories.jsonl`.
+
+    `vectors.npy` is stored uncompressed, so at import time it is memory-mapped straight from the archive
+    and read a slice at a time.
+
+    Attributes
+    ----------
+    path : str
+        Path of the archive.
+    manifest : dict
+        Content of `manifest.json`.
+    """
+
+    format = "cheshire-cat-memory-dump"
+    version = 1
+
+    manifest_file = "manifest.json"
+    memories_file = "memories.jsonl"
+    vectors_file = "vectors.npy"
+
+    dtypes = ["float32", "float16"]
+
+    def __init__(self, path: str):
+        self.path = path
+        with zipfile.ZipFile(path) as archive:
+            self.manifest = json.loads(archive.read(self.manifest_file))
+
+        if self.manifest.get("format") != self.format:
+            raise Exception(f"{os.path.basename(path)} is not a memory dump")
+
+    @staticmethod
+    def is_dump(file) -> bool:
+        """Whether a file (path or binary file object) is a zip archive."""
+        return zipfile.is_zipfile(file)
+
+    @property
+    def embedder(self) -> str:
+        return self.manifest["embedder"]
+
+    @property
+    def vector_size(self) -> int:
+        return self.manifest["vector_size"]
+
+    def count(self, collection_name: str) -> int:
+        return self.manifest["collections"].get(collection_name, {}).get("count", 0)
+
+    def map_vectors(self) -> np.memmap:
+        """Memory-map `vectors.npy` inside the archive, without extracting it."""
+        with zipfile.ZipFile(self.path) as archive:
+            info = archive.getinfo(self.vectors_file)
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise Exception(f"{self.vectors_file} must be stored uncompressed")
+
+        with open(self.path, "rb") as f:
+            # the member data starts after its local header (fixed part, then file name and extra field)
+            f.seek(info.header_offset)
+            local_header = f.read(30)
+            name_length, extra_length = struct.unpack("<HH", local_header[26:30])
+            f.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            offset = f.tell()
+
+        return np.memmap(
+            self.path, dtype=dtype, mode="r", offset=offset, shape=shape,
+            order="F" if fortran_order else "C"
+        )
+
+    def iter_batches(self, collection_name: str, batch_size: int = 256) -> Iterator[Tuple[List[dict], np.ndarray]]:
+        """Memories of a collection with their vectors (as float32), `batch_size` at a time."""
+        count = self.count(collection_name)
+        if count == 0:
+            return
+        start = self.manifest["collections"][collection_name]["start"]
+        end = start + count
+
+        vectors = self.map_vectors()
+
+        with zipfile.ZipFile(self.path) as archive, archive.open(self.memories_file) as f:
+            batch = []
+            for row, line in enumerate(io.TextIOWrapper(f, encoding="utf-8")):
+                if row >= end:
+                    break
+                if row < start:
+                    continue
+                batch.append(json.loads(line))
+                if len(batch) == batch_size:
+                    yield batch, np.asarray(vectors[row + 1 - len(batch):row + 1], dtype=np.float32)
+                    batch = []
+            if len(batch) > 0:
+                yield batch, np.asarray(vectors[end - len(batch):end], dtype=np.float32)
+
+        del vectors
+
+    @classmethod
+    def write(cls, path: str, vector_memory, embedder_name: str, collection_names: List[str] = None,
+              dtype: str = "float32", page_size: int = 256, user_id: str = None):
+        """Dump collections in a new archive.
+
+        Points are read a page at a time: vectors and memories are spooled to temporary files,
+        then packed in the archive, so collections are never loaded in memory.
+
+        Parameters
+        ----------
+        path : str
+            Where to write the archive.
+        vector_memory : VectorMemory
+            Vector memory to dump.
+        embedder_name : str
+            Name of the embedder class, checked at import time.
+        collection_names : List[str]
+            Collections to dump, all if None.
+        dtype : str
+            "float32" or "float16" (half the size, some precision lost).
+        page_size : int
+            Points read from the vector DB at a time.
+        user_id : str
+            Only dump the episodic memories of this user, all if None.
+        """
+
+        if dtype not in cls.dtypes:
+            raise ValueError(f"dtype must be one of {cls.dtypes}")
+        if collection_names is None:
+            collection_names = list(vector_memory.collections.keys())
+
+        # include memories still waiting to be written
+        vector_memory.flush()
+
+        manifest = {
+            "format": cls.format,
+            "version": cls.version,
+            "export_time": int(time.time() * 1000),
+            "embedder": embedder_name,
+            "dtype": dtype,
+            "vector_size": vector_memory.embedder_size,
+            "collections": {},
+        }
+
+        with tempfile.TemporaryDirectory(prefix="memory_dump_") as folder:
+            vectors_path = os.path.join(folder, "vectors.bin")
+            memories_path = os.path.join(folder, cls.memories_file)
+
+            rows = 0
+            with open(vectors_path, "wb") as vectors_file, open(memories_path, "w", encoding="utf-8") as memories_file:
+                for collection_name in collection_names:
+                    collection = vector_memory.collections[collection_name]
+                    start = rows
+                    for page in collection.scroll_pages(metadata=collection.tenant_filter(user_id), page_size=page_size):
+                        for p in page:
+                            payload = p.payload or {}
+                            memories_file.write(json.dumps({
+                                "id": p.id,
+                                "page_content": payload.get(collection.content_payload_key),
+                                "metadata": payload.get(collection.metadata_payload_key),
+                                "collection": collection_name,
+                            }) + "\n")
+                        np.asarray([p.vector for p in page], dtype=dtype).tofile(vectors_file)
+                        rows += len(page)
+                    manifest["collections"][collection_name] = {"start": start, "count": rows - start}
+
+            with zipfile.ZipFile(path, "w") as archive:
+                archive.writestr(cls.manifest_file, json.dumps(manifest, indent=2))
+                archive.write(memories_path, cls.memories_file, compress_type=zipfile.ZIP_DEFLATED)
+
+                # raw vectors behind a .npy header, uncompressed so they can be memory-mapped
+                header = {
+                    "descr": np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                    "fortran_order": False,
+                    "shape": (rows, vector_memory.embedder_size),
+                }
+                with archive.open(cls.vectors_file, "w", force_zip64=True) as npy_file:
+                    np.lib.format.write_array_header_1_0(npy_file, header)
+                    with open(vectors_path, "rb") as vectors_file:
+                        shutil.copyfileobj(vectors_file, npy_file)
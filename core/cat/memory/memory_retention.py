@@ -0,0 +1,300 @@
+import os
+import time
+import threading
+from typing import Dict, Iterator, List
+
+import numpy as np
+from qdrant_client.http.models import Filter, FieldCondition, MatchValue, Range, HasIdCondition
+
+from cat.db import crud, models
+from cat.log import log
+
+
+# retention checkpoints are saved in settings table under this category
+RETENTION_CATEGORY = "memory_retention"
+
+
+class MemoryRetention:
+    """Background compaction of a vector memory collection partitioned by user (episodic memory).
+
+    Every `interval` seconds a thread applies the retention policies:
+
+    - memories older than `max_age` seconds are deleted;
+    - near-duplicate memories of a user (cosine similarity above `duplicate_threshold`) are collapsed,
+      keeping the most recent one;
+    - only the most recent `max_points_per_user` memories of each user are kept.
+
+    Compaction is incremental: a checkpoint (the `when` of the last memory processed, saved in the settings DB
+    under its lock) is kept, and each pass only reads the memories stored after it, `batch_size` at a time.
+    New memories are compared with each other and, through the vector index, with the older memories
+    of their user; the memories of a user over the limit are counted, never loaded.
+    There is a pause between batches, so compaction never holds the vector DB for long while users are chatting.
+
+    Attributes
+    ----------
+    collection : VectorMemoryCollection
+        Collection to compact.
+    max_points_per_user : int
+        Memories kept for each user, unlimited if None.
+    max_age : float
+        Seconds a memory is kept, forever if None.
+    duplicate_threshold : float
+        Similarity above which two memories of a user are the same, no collapse if None.
+    interval : float
+        Seconds between compactions.
+    batch_size : int
+        Points read or deleted at a time.
+    pause : float
+        Seconds between batches.
+    settle : float
+        Memories of the last seconds are left to the next pass (they could still be in the write-behind buffer).
+    checkpoint : float
+        Memories stored up to this timestamp were already compacted.
+
+    Notes
+    -----
+    Policies can be set in the `.env` file with `EPISODIC_MAX_POINTS_PER_USER`, `EPISODIC_MAX_AGE_DAYS`
+    and `EPISODIC_DUPLICATE_THRESHOLD`; the pace with `EPISODIC_RETENTION_INTERVAL`,
+    `EPISODIC_RETENTION_BATCH_SIZE` and `EPISODIC_RETENTION_PAUSE`.
+    Without policies the thread is not started.
+    """
+
+    # count queries used to find the timestamp before which the oldest memories of a user are
+    bisect_steps = 40
+
+    def __init__(self, collection, max_points_per_user: int = None, max_age: float = None,
+                 duplicate_threshold: float = None, interval: float = None, batch_size: int = None,
+                 pause: float = None, settle: float = 60):
+        self.collection = collection
+
+        max_points_per_user = max_points_per_user or os.getenv("EPISODIC_MAX_POINTS_PER_USER")
+        self.max_points_per_user = int(max_points_per_user) if max_points_per_user else None
+        max_age_days = os.getenv("EPISODIC_MAX_AGE_DAYS")
+        self.max_age = max_age or (float(max_age_days) * 24 * 3600 if max_age_days else None)
+        duplicate_threshold = duplicate_threshold or os.getenv("EPISODIC_DUPLICATE_THRESHOLD")
+        self.duplicate_threshold = float(duplicate_threshold) if duplicate_threshold else None
+
+        self.interval = interval if interval is not None else float(os.getenv("EPISODIC_RETENTION_INTERVAL", 3600))
+        self.batch_size = batch_size or int(os.getenv("EPISODIC_RETENTION_BATCH_SIZE", 256))
+        self.pause = pause if pause is not None else float(os.getenv("EPISODIC_RETENTION_PAUSE", 0.5))
+        self.settle = settle
+
+        self.wake_up = threading.Event()
+        self.closed = False
+        self.thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return any(p is not None for p in [self.max_points_per_user, self.max_age, self.duplicate_threshold])
+
+    @property
+    def checkpoint_name(self) -> str:
+        return f"{RETENTION_CATEGORY}_{self.collection.collection_name}"
+
+    @property
+    def checkpoint(self) -> float:
+        setting = crud.get_setting_by_name(name=self.checkpoint_name)
+        if setting is None:
+            return 0.0
+        return setting["value"]["checkpoint"]
+
+    @checkpoint.setter
+    def checkpoint(self, checkpoint: float):
+        crud.upsert_setting_by_name(models.Setting(
+            name=self.checkpoint_name,
+            category=RETENTION_CATEGORY,
+            value={"checkpoint": checkpoint}
+        ))
+
+    def start(self):
+        if self.enabled and self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="memory_retention", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.closed:
+            self.wake_up.wait(self.interval)
+            if self.closed:
+                return
+            try:
+                self.compact()
+            except Exception as e:
+                log.error(f"Compaction of {self.collection.collection_name} failed")
+                log.error(e)
+
+    def compact(self) -> Dict[str, int]:
+        """Apply the retention policies once, to the memories stored since the last pass.
+
+        Returns
+        -------
+        deleted : Dict[str, int]
+            Number of memories deleted by each policy (`expired`, `duplicates`, `over_limit`).
+        """
+        start = time.time()
+        deleted = {"expired": 0, "duplicates": 0, "over_limit": 0}
+
+        if self.max_age is not None:
+            deleted["expired"] = self.delete_where(self.when_filter(lt=start - self.max_age))
+
+        if self.max_points_per_user is not None or self.duplicate_threshold is not None:
+            checkpoint = self.checkpoint
+            until = start - self.settle
+
+            # only memories stored since the last pass
+            users = set()
+            for page in self.scroll(self.when_filter(gt=checkpoint, lte=until), self.duplicate_threshold is not None):
+                users.update(self.source(p) for p in page)
+                if self.duplicate_threshold is not None:
+                    deleted["duplicates"] += self.collapse_duplicates(page)
+
+            # only users with new memories can be over the limit
+            if self.max_points_per_user is not None:
+                for user_id in sorted(u for u in users if u is not None):
+                    if self.closed:
+                        break
+                    deleted["over_limit"] += self.enforce_limit(user_id)
+
+            # an interrupted pass is repeated
+            if not self.closed:
+                self.checkpoint = until
+
+        log.info(f"Compacted {self.collection.collection_name} in {time.time() - start:.1f}s: {deleted}")
+        return deleted
+
+    def collapse_duplicates(self, points: List) -> int:
+        """Delete near-duplicates among a page of new memories and the other memories of their users.
+
+        Of each group of near-duplicates, the most recent memory is kept.
+        """
+        by_user = {}
+        for p in points:
+            by_user.setdefault(self.source(p), []).append(p)
+        page_ids = [p.id for p in points]
+
+        duplicates = set()
+        for user_id, user_points in by_user.items():
+            user_points.sort(key=self.when, reverse=True)
+
+            # new memories of the user kept so far, most recent first
+            kept = np.empty((len(user_points), len(user_points[0].vector)), dtype=np.float32)
+            n_kept = 0
+            for p in user_points:
+                vector = np.asarray(p.vector, dtype=np.float32)
+                vector /= max(np.linalg.norm(vector), 1e-12)
+                if n_kept > 0 and np.max(kept[:n_kept] @ vector) >= self.duplicate_threshold:
+                    duplicates.add(p.id)
+                    continue
+
+                # memories of the user outside this page, found through the vector index
+                hits = self.collection.client.search(
+                    collection_name=self.collection.collection_name,
+                    query_vector=p.vector,
+                    query_filter=Filter(
+                        must=[self.user_condition(user_id)],
+                        must_not=[HasIdCondition(has_id=page_ids)]
+                    ),
+                    with_payload=[self.collection.metadata_payload_key],
+                    limit=self.batch_size,
+                    score_threshold=self.duplicate_threshold,
+                )
+                if any(self.when(h) > self.when(p) for h in hits):
+                    duplicates.add(p.id)
+                    continue
+                duplicates.update(h.id for h in hits)
+
+                kept[n_kept] = vector
+                n_kept += 1
+
+        self.delete(list(duplicates))
+        return len(duplicates)
+
+    def enforce_limit(self, user_id: str) -> int:
+        """Delete the oldest memories of a user over `max_points_per_user`."""
+        user_filter = Filter(must=[self.user_condition(user_id)])
+        excess = self.count(user_filter) - self.max_points_per_user
+        if excess <= 0:
+            return 0
+
+        # latest timestamp with no more than `excess` memories of the user before it
+        lower, upper = 0.0, time.time()
+        for _ in range(self.bisect_steps):
+            middle = (lower + upper) / 2
+            if self.count(self.when_filter(lt=middle, user_id=user_id)) <= excess:
+                lower = middle
+            else:
+                upper = middle
+
+        return self.delete_where(self.when_filter(lt=lower, user_id=user_id))
+
+    def delete_where(self, points_filter: Filter) -> int:
+        """Delete the points matching a filter, a batch at a time."""
+        n_deleted = 0
+        while not self.closed:
+            # deleted points leave the filter, the first page is always the next batch
+            points, _ = self.collection.client.scroll(
+                collection_name=self.collection.collection_name,
+                scroll_filter=points_filter,
+                with_payload=False,
+                with_vectors=False,
+                limit=self.batch_size,
+            )
+            if len(points) == 0:
+                break
+            self.collection.delete_points([p.id for p in points])
+            n_deleted += len(points)
+            time.sleep(self.pause)
+
+        return n_deleted
+
+    def delete(self, ids: List[str]):
+        for start in range(0, len(ids), self.batch_size):
+            if self.closed:
+                return
+            self.collection.delete_points(ids[start:start + self.batch_size])
+            time.sleep(self.pause)
+
+    def scroll(self, points_filter: Filter, with_vectors: bool) -> Iterator[List]:
+        """Pages of the points matching a filter, with a pause after each one (and stopping on close)."""
+        offset = None
+        while not self.closed:
+            points, offset = self.collection.client.scroll(
+                collection_name=self.collection.collection_name,
+                scroll_filter=points_filter,
+                with_payload=[self.collection.metadata_payload_key],
+                with_vectors=with_vectors,
+                limit=self.batch_size,
+                offset=offset,
+            )
+            if len(points) > 0:
+                yield points
+            if offset is None:
+                return
+            time.sleep(self.pause)
+
+    def count(self, points_filter: Filter) -> int:
+        return self.collection.client.count(
+            collection_name=self.collection.collection_name, count_filter=points_filter, exact=True
+        ).count
+
+    def user_condition(self, user_id: str) -> FieldCondition:
+        return FieldCondition(key=f"{self.collection.metadata_payload_key}.source", match=MatchValue(value=user_id))
+
+    def when_filter(self, user_id: str = None, **range_args) -> Filter:
+        """Filter on the timestamp of the memories (of a user if given)."""
+        conditions = [FieldCondition(key=f"{self.collection.metadata_payload_key}.when", range=Range(**range_args))]
+        if user_id is not None:
+            conditions.append(self.user_condition(user_id))
+        return Filter(must=conditions)
+
+    def source(self, point) -> str:
+        return ((point.payload or {}).get(self.collection.metadata_payload_key) or {}).get("source")
+
+    def when(self, point) -> float:
+        return ((point.payload or {}).get(self.collection.metadata_payload_key) or {}).get("when") or 0
+
+    def close(self):
+        """Stop the background thread, at the end of the current batch."""
+        self.closed = True
+        self.wake_up.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.pause + 5)
@@ -0,0 +1,149 @@
+import os
+import uuid
+import threading
+from typing import List
+
+from qdrant_client.http.models import PointStruct
+
+from cat.log import log
+
+
+class MemoryWriter:
+    """Write-behind buffer for a vector memory collection.
+
+    Storing the user message in episodic memory is not needed to answer, so points
+    are accumulated in memory and upserted in batches by a background thread.
+    Points are written when the batch is full, every `interval` seconds, or when `flush` is called.
+
+    Attributes
+    ----------
+    collection : VectorMemoryCollection
+        Collection where points are written.
+    batch_size : int
+        Number of pending points triggering a write. Zero writes each point immediately.
+    interval : float
+        Maximum seconds a point waits before being written.
+    max_pending : int
+        Maximum points kept pending while the vector DB cannot store them; beyond it the oldest are dropped.
+
+    Notes
+    -----
+    Vectors are passed already computed (i.e. the recall query embedding), so nothing is embedded here.
+    Points that could not be stored go back to the pending ones and are retried at the next flush.
+    Writing through (batching disabled or after `close`), errors reach the caller.
+    Batch size, interval and pending points bound can be set in the `.env` file with
+    `EPISODIC_WRITE_BATCH_SIZE`, `EPISODIC_WRITE_INTERVAL` and `EPISODIC_WRITE_MAX_PENDING`.
+    Code reading or deleting points must call `flush` first, to see the pending ones.
+
+    """
+
+    def __init__(self, collection, batch_size: int = None, interval: float = None, max_pending: int = None):
+        self.collection = collection
+        self.batch_size = batch_size if batch_size is not None else int(os.getenv("EPISODIC_WRITE_BATCH_SIZE", 16))
+        self.interval = interval if interval is not None else float(os.getenv("EPISODIC_WRITE_INTERVAL", 2))
+        self.max_pending = max_pending or int(os.getenv("EPISODIC_WRITE_MAX_PENDING", 10000))
+
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        # one write at a time, so `flush` returns after all previous points are stored
+        self.flush_lock = threading.Lock()
+
+        self.wake_up = threading.Event()
+        self.closed = False
+        self.thread = None
+
+    def add(self, text: str, metadata: dict, vector: List[float]) -> str:
+        """Queue a point for writing.
+
+        Parameters
+        ----------
+        text : str
+            Text of the memory.
+        metadata : dict
+            Metadata of the memory.
+        vector : List[float]
+            Embedding of the text.
+
+        Returns
+        -------
+        id : str
+            Id the point will have in the collection.
+        """
+        point = PointStruct(
+            id=uuid.uuid4().hex,
+            vector=vector,
+            payload={
+                self.collection.content_payload_key: text,
+                self.collection.metadata_payload_key: metadata,
+            }
+        )
+
+        # write through after shutdown, or if batching is disabled
+        if self.closed or self.batch_size <= 0:
+            self.write([point])
+            return point.id
+
+        with self.pending_lock:
+            self.pending.append(point)
+            batch_is_full = len(self.pending) >= self.batch_size
+
+        self.start()
+        if batch_is_full:
+            self.wake_up.set()
+
+        return point.id
+
+    def start(self):
+        if self.thread is None:
+            with self.pending_lock:
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, name="memory_writer", daemon=True)
+                    self.thread.start()
+
+    def run(self):
+        while not self.closed:
+            self.wake_up.wait(self.interval)
+            self.wake_up.clear()
+            self.flush()
+
+    def flush(self):
+        """Write all pending points. Points that cannot be stored are kept for the next flush."""
+        with self.flush_lock:
+            with self.pending_lock:
+                points, self.pending = self.pending, []
+            try:
+                self.write(points)
+            except Exception as e:
+                log.error(f"Could not store {len(points)} points in {self.collection.collection_name}, will retry")
+                log.error(e)
+                self.requeue(points)
+
+    def requeue(self, points: List[PointStruct]):
+        """Put back points that could not be written, before the ones queued meanwhile."""
+        with self.pending_lock:
+            self.pending = points + self.pending
+            dropped = len(self.pending) - self.max_pending
+            if dropped > 0:
+                # the oldest points are lost
+                self.pending = self.pending[dropped:]
+
+        if dropped > 0:
+            log.error(f"Dropped {dropped} points of {self.collection.collection_name}, too many waiting to be stored")
+
+    def write(self, points: List[PointStruct]):
+        if len(points) == 0:
+            return
+
+        self.collection.client.upsert(
+            collection_name=self.collection.collection_name,
+            points=points
+        )
+        log.debug(f"Stored {len(points)} points in {self.collection.collection_name}")
+
+    def close(self):
+        """Write pending points and stop the background thread."""
+        self.closed = True
+        self.wake_up.set()
+        if self.thread is not None:
+            self.thread.join(timeout=self.interval + 1)
+        self.flush()
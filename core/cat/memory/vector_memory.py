@@ -1,26 +1,149 @@
 import os
 import sys
+import json
+import time
+import uuid
 import socket
-from typing import Any
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+from concurrent.futures import ThreadPoolExecutor
 import requests
 
 from cat.log import log
+from cat.memory.memory_writer import MemoryWriter
+from cat.memory.memory_retention import MemoryRetention
+from cat.memory.collection_settings import CollectionSettings, get_collection_settings, save_collection_settings
 from qdrant_client import QdrantClient
 from qdrant_client.qdrant_remote import QdrantRemote
 from langchain.embeddings.base import Embeddings
 from langchain.vectorstores import Qdrant
-from qdrant_client.http.models import (Distance, VectorParams,  SearchParams, 
-                                    ScalarQuantization, ScalarQuantizationConfig, ScalarType, QuantizationSearchParams, 
-                                    CreateAliasOperation, CreateAlias, OptimizersConfigDiff)
+from langchain.docstore.document import Document
+from qdrant_client.http.models import (PointStruct, CreateAliasOperation, CreateAlias, OptimizersConfigDiff,
+                                    PayloadSchemaType, Filter, FieldCondition, Range)
+
+
+class LocalClientLock:
+    """Serialize calls to the embedded (local) Qdrant client.
+
+    The local Qdrant client keeps collections in numpy arrays and is not thread safe,
+    while messages from different users are processed in parallel threads.
+    Remote Qdrant handles concurrency on its own and is not wrapped.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.lock = threading.RLock()
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if not callable(attr):
+            return attr
+
+        def locked(*args, **kwargs):
+            with self.lock:
+                return attr(*args, **kwargs)
+
+        return locked
+
+
+class MemoryHit:
+    """A memory recalled from a vector collection.
+
+    Hits are created for every recalled point on every message, so they are slotted
+    and the Langchain `Document` is only built if requested.
+    For backward compatibility a hit can still be unpacked or indexed as the old
+    `(document, score, vector, id)` tuple.
+
+    Attributes
+    ----------
+    page_content : str
+        Text of the memory.
+    metadata : dict
+        Metadata of the memory.
+    score : float
+        Similarity with the recall query.
+    vector : List[float]
+        Embedding of the memory, None unless requested with `with_vectors`.
+    id : str
+        Id of the point in the vector DB.
+    """
+
+    __slots__ = ("page_content", "metadata", "score", "vector", "id", "_document")
+
+    def __init__(self, page_content: str, metadata: dict, score: float, vector: List[float] = None, id: str = None):
+        self.page_content = page_content
+        self.metadata = metadata if metadata is not None else {}
+        self.score = score
+        self.vector = vector
+        self.id = id
+        self._document = None
+
+    @classmethod
+    def from_point(cls, point, score, content_payload_key="page_content", metadata_payload_key="metadata"):
+        payload = point.payload or {}
+        return cls(
+            page_content=payload.get(content_payload_key),
+            metadata=payload.get(metadata_payload_key),
+            score=score,
+            vector=point.vector,
+            id=point.id,
+        )
+
+    @property
+    def document(self) -> Document:
+        if self._document is None:
+            self._document = Document(page_content=self.page_content or "", metadata=self.metadata)
+        return self._document
+
+    def to_dict(self, with_vector=False) -> dict:
+        """Serializable version of the hit (i.e. for the `why` of a reply)."""
+        hit = {
+            "page_content": self.page_content,
+            "metadata": self.metadata,
+            "score": float(self.score),
+            "id": self.id,
+        }
+        if with_vector:
+            hit["vector"] = self.vector
+        return hit
+
+    # old tuple interface
+    def __iter__(self):
+        return iter((self.document, self.score, self.vector, self.id))
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+    def __len__(self):
+        return 4
+
+    def __repr__(self):
+        return f"MemoryHit(id={self.id!r}, score={self.score:.3f}, page_content={self.page_content!r})"
 
 
 class VectorMemory:
+    """Vector collections of the Cat.
+
+    Attributes
+    ----------
+    tenancy : str
+        How episodic memories of different users are kept. "shared" (default): one HNSW graph for all users,
+        recall filters on the user. "partitioned": one graph per user, recall only visits the memories of the user.
+        Can be set in the `.env` file with `EPISODIC_TENANCY`.
+    """
 
     local_vector_db = None
 
+    tenancy_modes = ["shared", "partitioned"]
+
     def __init__(self, cat, verbose=False) -> None:
         self.verbose = verbose
 
+        self.tenancy = os.getenv("EPISODIC_TENANCY", "shared")
+        if self.tenancy not in self.tenancy_modes:
+            log.warning(f"Unknown EPISODIC_TENANCY {self.tenancy}, must be one of {self.tenancy_modes}. Using shared")
+            self.tenancy = "shared"
+
         # Get embedder from Cat instance
         self.embedder = cat.embedder
 
@@ -29,6 +152,10 @@ class VectorMemory:
 
         self.connect_to_vector_memory()
 
+        # local Qdrant is not thread safe
+        if not self.db_is_remote() and not isinstance(self.vector_db._client, LocalClientLock):
+            self.vector_db._client = LocalClientLock(self.vector_db._client)
+
         # get current embedding size (langchain classes do not store it)
         # TODO: move the embedder size in create collection
         self.embedder_size = len(cat.embedder.embed_query("hello world"))
@@ -47,6 +174,7 @@ class VectorMemory:
                 collection_name=collection_name,
                 embeddings=self.embedder,
                 vector_size=self.embedder_size,
+                partitioned=(collection_name == "episodic" and self.tenancy == "partitioned"),
             )
 
             # Update dictionary containing all collections
@@ -57,6 +185,12 @@ class VectorMemory:
             # (i.e. do things like cat.memory.vectors.declarative.something())
             setattr(self, collection_name, collection)
 
+        # conversation turns are stored in background, the reply does not wait for them
+        self.episodic_writer = MemoryWriter(self.episodic)
+        # old, duplicate and exceeding episodic memories are pruned in background (if policies are set)
+        self.episodic_retention = MemoryRetention(self.episodic)
+        self.episodic_retention.start()
+
     def connect_to_vector_memory(self) -> None:
         db_path = "local_vector_memory/"
         qdrant_host = os.getenv("QDRANT_HOST", db_path)
@@ -87,11 +221,129 @@ class VectorMemory:
                 host=qdrant_host,
                 port=qdrant_port,
             )
-            
+
+    def db_is_remote(self):
+        return isinstance(self.vector_db._client, QdrantRemote)
+
+    def flush(self):
+        """Store memories still waiting in the write-behind buffer."""
+        self.episodic_writer.flush()
+
+    def close(self):
+        """Stop the background compaction, store pending memories and stop the background writer."""
+        self.episodic_retention.close()
+        self.episodic_writer.close()
+
+    def export_memories(self, embedder_name: str, collection_names: List[str] = None,
+                        page_size: int = 256, user_id: str = None) -> Iterator[str]:
+        """Memory file accepted by `/rabbithole/memory/`, produced a page of points at a time.
+
+        Parameters
+        ----------
+        embedder_name : str
+            Name of the embedder class, checked at import time.
+        collection_names : List[str]
+            Collections to export, all if None.
+        page_size : int
+            Points read from the vector DB (and yielded) at a time.
+        user_id : str
+            Only export the episodic memories of this user, all if None.
+
+        Yields
+        ------
+        text : str
+            Pieces of the JSON document. Each memory is on its own line.
+        """
+
+        if collection_names is None:
+            collection_names = list(self.collections.keys())
+
+        # include memories still waiting to be written
+        self.flush()
+
+        yield "{\n" \
+              f'"export_time": {int(time.time() * 1000)},\n' \
+              f'"embedder": {json.dumps(embedder_name)},\n' \
+              '"collections": {'
+
+        for c, collection_name in enumerate(collection_names):
+            collection = self.collections[collection_name]
+            yield ("," if c > 0 else "") + f"\n{json.dumps(collection_name)}: ["
+
+            separator = "\n"
+            for page in collection.scroll_pages(metadata=collection.tenant_filter(user_id), page_size=page_size):
+                lines = [
+                    json.dumps({
+                        "page_content": (p.payload or {}).get(collection.content_payload_key),
+                        "metadata": (p.payload or {}).get(collection.metadata_payload_key),
+                        "id": p.id,
+                        "vector": p.vector,
+                    })
+                    for p in page
+                ]
+                yield separator + ",\n".join(lines)
+                separator = ",\n"
+
+            yield "\n]"
+
+        yield "\n}\n}\n"
+
+    def recall_memories_from_embeddings(self, recall_configs: Dict[str, Dict]) -> Dict[str, List]:
+        """Recall memories from several collections in one go.
+
+        Parameters
+        ----------
+        recall_configs : Dict[str, Dict]
+            Recall configurations (`embedding`, `k`, `threshold`, `metadata`) indexed by collection name.
+
+        Returns
+        -------
+        memories : Dict[str, List]
+            Recalled memories indexed by collection name.
+
+        Notes
+        -----
+        Qdrant batch search only works inside a single collection, so with a remote vector DB
+        the searches on the different collections are sent concurrently.
+        This way recall costs about one round trip instead of one per collection.
+        """
+
+        for collection_name in recall_configs.keys():
+            if collection_name not in self.collections:
+                raise ValueError(f"Collection {collection_name} does not exist")
+
+        # local Qdrant runs in process, there is no network latency to overlap
+        if not self.db_is_remote() or len(recall_configs) < 2:
+            return {
+                collection_name: self.collections[collection_name].recall_memories_from_embedding(**config)
+                for collection_name, config in recall_configs.items()
+            }
+
+        with ThreadPoolExecutor(max_workers=len(recall_configs)) as executor:
+            futures = {
+                collection_name: executor.submit(
+                    self.collections[collection_name].recall_memories_from_embedding, **config
+                )
+                for collection_name, config in recall_configs.items()
+            }
+            return {collection_name: f.result() for collection_name, f in futures.items()}
+
 
 class VectorMemoryCollection(Qdrant):
 
-    def __init__(self, cat, client: Any, collection_name: str, embeddings: Embeddings, vector_size: int):
+    # metadata field with the user owning a memory (episodic memories)
+    tenant_field = "source"
+
+    # payload fields indexed in the vector DB, to filter without a full scan
+    #   (user of episodic memories and document of declarative ones, chunk hash, insertion time)
+    payload_indexes = {
+        "metadata.source": PayloadSchemaType.KEYWORD,
+        "metadata.content_hash": PayloadSchemaType.KEYWORD,
+        "metadata.when": PayloadSchemaType.FLOAT,
+    }
+
+    def __init__(self, cat, client: Any, collection_name: str, embeddings: Embeddings, vector_size: int,
+                 partitioned: bool = False):
 
         super().__init__(client, collection_name, embeddings)
 
@@ -109,12 +361,22 @@ class VectorMemoryCollection(Qdrant):
         # Set embedding size (may be changed at runtime)
         self.embedder_size = vector_size
 
+        # Index profile and default search params, saved in settings
+        #   (collections partitioned by user get a graph for each user)
+        self.partitioned = partitioned
+        self.index_settings = self.tenancy_settings(get_collection_settings(collection_name))
+
         # Check if memory collection exists also in vectorDB, otherwise create it
         self.create_db_collection_if_not_exists()
 
         # Check db collection vector size is same as embedder size
         self.check_embedding_size()
 
+        # Existing collections are moved to the index profile, if it changed
+        self.apply_index_settings()
+
+        self.create_payload_indexes()
+
         # log collection info
         log.info(f"Collection {self.collection_name}:")
         log.info(dict(self.client.get_collection(self.collection_name)))
@@ -140,6 +402,59 @@ class VectorMemoryCollection(Qdrant):
             log.warning(f'Collection "{self.collection_name}" deleted')
             self.create_collection()
 
+    def apply_index_settings(self):
+        """Reconfigure the collection in the vector DB if it does not match the index profile.
+
+        Qdrant rebuilds HNSW graph and quantized vectors in background, the collection can still be searched.
+        """
+        # local Qdrant has no index (brute force search)
+        if not self.db_is_remote():
+            return
+
+        if self.index_settings.matches(self.client.get_collection(self.collection_name)):
+            return
+
+        log.warning(f'Updating index of collection "{self.collection_name}" to {self.index_settings.dict()}')
+        self.client.update_collection(collection_name=self.collection_name, **self.index_settings.update_params())
+
+    def update_index_settings(self, index_settings: CollectionSettings):
+        """Save a new index profile and apply it to the collection."""
+        self.index_settings = self.tenancy_settings(save_collection_settings(self.collection_name, index_settings))
+        self.apply_index_settings()
+
+    def tenancy_settings(self, index_settings: CollectionSettings) -> CollectionSettings:
+        return index_settings.partitioned() if self.partitioned else index_settings
+
+    def tenant_filter(self, user_id: str = None, metadata: dict = None) -> Optional[dict]:
+        """Metadata filter restricted to the memories of a user (unchanged if `user_id` is None).
+
+        Only episodic memories belong to users, other collections are never restricted.
+        """
+        if user_id is None or self.collection_name != "episodic":
+            return metadata
+        return {**(metadata or {}), self.tenant_field: user_id}
+
+    def create_payload_indexes(self):
+        """Create the payload indexes missing in the collection.
+
+        New collections get all of them; collections created before an index was introduced
+        are indexed at boot (Qdrant builds the index on the points already stored).
+        """
+        # local Qdrant has no payload indexes (and warns on each call)
+        if not self.db_is_remote():
+            return
+
+        existing = self.client.get_collection(self.collection_name).payload_schema or {}
+        for field_name, field_schema in self.payload_indexes.items():
+            if field_name in existing:
+                continue
+            log.info(f'Indexing payload field "{field_name}" of collection "{self.collection_name}"')
+            self.client.create_payload_index(
+                collection_name=self.collection_name,
+                field_name=field_name,
+                field_schema=field_schema,
+            )
+
     def create_db_collection_if_not_exists(self):
         
         # is collection present in DB?
@@ -158,16 +473,10 @@ class VectorMemoryCollection(Qdrant):
         log.warning(f"Creating collection {self.collection_name} ...")
         self.client.recreate_collection(
             collection_name=self.collection_name,
-            vectors_config=VectorParams(
-                size=self.embedder_size, distance=Distance.COSINE),
+            vectors_config=self.index_settings.vectors_config(self.embedder_size),
+            hnsw_config=self.index_settings.hnsw_config(),
             #optimizers_config=OptimizersConfigDiff(memmap_threshold=20000),
-            quantization_config=ScalarQuantization(
-                scalar=ScalarQuantizationConfig(
-                    type=ScalarType.INT8,
-                    quantile=0.75,
-                    always_ram=False
-                )
-            ),
+            quantization_config=self.index_settings.quantization_config(),
             #shard_number=3,
         )
         
@@ -183,15 +492,47 @@ class VectorMemoryCollection(Qdrant):
         )
 
     # retrieve similar memories from text
-    def recall_memories_from_text(self, text, metadata=None, k=5, threshold=None):
+    def recall_memories_from_text(self, text, metadata=None, k=5, threshold=None, with_vectors=False, payload_fields=None,
+                                  time_window=None):
         # embed the text
         query_embedding = self.cat.embedder.embed_query(text)
 
         # search nearest vectors
         return self.recall_memories_from_embedding(
-            query_embedding, metadata=metadata, k=k, threshold=threshold
+            query_embedding, metadata=metadata, k=k, threshold=threshold,
+            with_vectors=with_vectors, payload_fields=payload_fields, time_window=time_window
         )
 
+    def add_points(self, texts: List[str], metadatas: List[dict], vectors: List[List[float]]) -> List[str]:
+        """Store already embedded texts with a single upsert.
+
+        Parameters
+        ----------
+        texts : List[str]
+            Texts of the memories.
+        metadatas : List[dict]
+            Metadata of each memory.
+        vectors : List[List[float]]
+            Embedding of each text.
+
+        Returns
+        -------
+        ids : List[str]
+            Ids of the new points.
+        """
+        points = [
+            PointStruct(
+                id=uuid.uuid4().hex,
+                vector=vector,
+                payload={self.content_payload_key: text, self.metadata_payload_key: metadata}
+            )
+            for text, metadata, vector in zip(texts, metadatas, vectors)
+        ]
+
+        self.client.upsert(collection_name=self.collection_name, points=points)
+
+        return [p.id for p in points]
+
     def delete_points_by_metadata_filter(self, metadata=None):
         res = self.client.delete(
             collection_name=self.collection_name,
@@ -208,55 +549,147 @@ class VectorMemoryCollection(Qdrant):
         return res
 
     # retrieve similar memories from embedding
-    def recall_memories_from_embedding(self, embedding, metadata=None, k=5, threshold=None):
+    def recall_memories_from_embedding(
+        self,
+        embedding,
+        metadata=None,
+        k=5,
+        threshold=None,
+        with_vectors: bool = False,
+        payload_fields: Optional[Sequence[str]] = None,
+        time_window: Optional[float] = None,
+        search_params: Optional[Dict] = None
+    ) -> List[MemoryHit]:
+        """Search the memories most similar to an embedding.
+
+        Parameters
+        ----------
+        embedding : List[float]
+            Query embedding.
+        metadata : dict
+            Filter on memories metadata.
+        k : int
+            Maximum number of memories.
+        threshold : float
+            Minimum similarity score.
+        with_vectors : bool
+            Also return the memories embeddings. Off by default, vectors are only needed to plot memories.
+        payload_fields : Sequence[str]
+            Top level payload fields to return (i.e. `["metadata"]`), all if None.
+        time_window : float
+            Only search memories stored in the last `time_window` seconds (i.e. recent conversation), all if None.
+        search_params : dict
+            Change search params of the collection settings for this recall (`hnsw_ef`, `exact`, `rescore`,
+            `oversampling`), i.e. `{"exact": True}` to search without the approximate index.
+
+        Returns
+        -------
+        memories : List[MemoryHit]
+            Recalled memories, sorted by similarity.
+        """
+
+        with_payload: Union[bool, List[str]] = True if payload_fields is None else list(payload_fields)
+
+        since = None if time_window is None else time.time() - time_window
 
         # retrieve memories
         memories = self.client.search(
             collection_name=self.collection_name,
             query_vector=embedding,
-            query_filter=self._qdrant_filter_from_dict(metadata),
-            with_payload=True,
-            with_vectors=True,
+            query_filter=self.build_filter(metadata, since),
+            with_payload=with_payload,
+            with_vectors=with_vectors,
             limit=k,
             score_threshold=threshold,
-            search_params=SearchParams(
-                quantization=QuantizationSearchParams(
-                    ignore=False,
-                    rescore=True,
-                    # oversampling=1.5 # Available as of v1.3.0
-                )
-            )
+            search_params=self.index_settings.search_params(search_params)
         )
 
-        langchain_documents_from_points = [
-            (
-                self._document_from_scored_point(
-                    m, self.content_payload_key, self.metadata_payload_key),
-                m.score,
-                m.vector,
-                m.id
-            )
+        return [
+            MemoryHit.from_point(m, m.score, self.content_payload_key, self.metadata_payload_key)
             for m in memories
         ]
 
+    def build_filter(self, metadata: dict = None, since: float = None) -> Optional[Filter]:
+        """Qdrant filter matching the metadata, on memories stored after `since` (timestamp) if given.
+
+        Both conditions use indexed payload fields (see `payload_indexes`) on a remote vector DB.
+        """
+        query_filter = self._qdrant_filter_from_dict(metadata)
+        if since is None:
+            return query_filter
+
+        recent = FieldCondition(key=f"{self.metadata_payload_key}.when", range=Range(gte=since))
+        if query_filter is None:
+            return Filter(must=[recent])
+        query_filter.must.append(recent)
+        return query_filter
+
+    def get_content_hashes(self, source: str, page_size: int = 1000) -> Dict[str, List[str]]:
+        """Ids of the points of a source, grouped by the content hash of their text.
+
+        Points stored before content hashing was introduced are grouped under None.
+        """
+        hashes = {}
+        points = self.iter_points(
+            metadata={"source": source}, with_vectors=False,
+            with_payload=[self.metadata_payload_key], page_size=page_size
+        )
+        for p in points:
+            metadata = (p.payload or {}).get(self.metadata_payload_key) or {}
+            hashes.setdefault(metadata.get("content_hash"), []).append(p.id)
+        return hashes
+
+    def scroll_pages(
+        self,
+        metadata: dict = None,
+        with_vectors: bool = True,
+        with_payload: Union[bool, List[str]] = True,
+        page_size: int = 256,
+    ) -> Iterator[List]:
+        """Iterate the points of the collection a page at a time, following the scroll offset.
+
+        Parameters
+        ----------
+        metadata : dict
+            Filter on points metadata.
+        with_vectors : bool
+            Also return the points embeddings.
+        with_payload : bool, List[str]
+            Return the payload, or only some top level fields of it.
+        page_size : int
+            Points per page (i.e. per request to the vector DB).
+
+        Yields
+        ------
+        points : List[Record]
+            A page of points.
+        """
+        scroll_filter = self._qdrant_filter_from_dict(metadata)
+
+        offset = None
+        while True:
+            points, offset = self.client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=scroll_filter,
+                with_payload=with_payload,
+                with_vectors=with_vectors,
+                limit=page_size,
+                offset=offset,
+            )
+            if len(points) > 0:
+                yield points
+            if offset is None:
+                return
 
-        # we'll move out of langchain conventions soon and have our own cat Document
-        #for doc, score, vector in langchain_documents_from_points:
-        #    doc.lc_kwargs = None
-
-        return langchain_documents_from_points
+    def iter_points(self, **kwargs) -> Iterator:
+        """Iterate the points of the collection, one at a time (same arguments as `scroll_pages`)."""
+        for page in self.scroll_pages(**kwargs):
+            yield from page
 
     # retrieve all the points in the collection
     def get_all_points(self):
-
-        # retrieving the points
-        all_points, _ = self.client.scroll(
-            collection_name=self.collection_name,
-            with_vectors=True,
-            limit=10000 # yeah, good for now dear :*
-        )
-
-        return all_points
+        # collections can be big, prefer `iter_points`
+        return list(self.iter_points())
     
 
     def db_is_remote(self):
@@ -0,0 +1,62 @@
+import asyncio
+import threading
+from typing import Dict, List, Tuple
+
+
+class NotificationChannels:
+    """Push messages to the connections of each user, from any thread.
+
+    Every websocket (or event stream) subscribes with the id of its user and gets a queue,
+    bound to the event loop serving it. Messages published for a user (i.e. by ingestion workers)
+    are put in the queues of that user only; messages without a user go to everybody.
+
+    Queues are bounded: a connection too slow to keep up loses messages instead of
+    holding memory.
+
+    Attributes
+    ----------
+    max_queue_size : int
+        Messages waiting to be sent on a connection before new ones are dropped.
+    """
+
+    def __init__(self, max_queue_size: int = 100):
+        self.max_queue_size = max_queue_size
+        self.subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        """Queue of the messages for a user. Must be called from the event loop serving the connection."""
+        queue = asyncio.Queue(maxsize=self.max_queue_size)
+        with self.lock:
+            self.subscribers.setdefault(user_id, []).append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        with self.lock:
+            subscribers = [s for s in self.subscribers.get(user_id, []) if s[1] is not queue]
+            if len(subscribers) > 0:
+                self.subscribers[user_id] = subscribers
+            else:
+                self.subscribers.pop(user_id, None)
+
+    def publish(self, message: Dict, user_id: str = None):
+        """Send a message to the connections of a user (of all users if `user_id` is None)."""
+        with self.lock:
+            if user_id is None:
+                subscribers = [s for user_subscribers in self.subscribers.values() for s in user_subscribers]
+            else:
+                subscribers = list(self.subscribers.get(user_id, []))
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(self.put, queue, message)
+            except RuntimeError:
+                # the loop of the connection is closed
+                pass
+
+    @staticmethod
+    def put(queue: asyncio.Queue, message: Dict):
+        try:
+            queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
@@ -0,0 +1,452 @@
+"""Streaming parsers used by the Rabbit Hole.
+
+Parsers yield the content a page (PDF) or a block of text (plain text, markdown, HTML) at a time,
+so a big file is never loaded in memory as a whole. Memory exports (JSON) are read an entry at a time.
+"""
+
+import io
+import os
+import json
+import pickle
+import codecs
+import threading
+import multiprocessing
+from collections import deque
+from typing import Any, BinaryIO, Iterator, List, Sequence, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+
+from langchain.docstore.document import Document
+from langchain.document_loaders.base import BaseBlobParser
+from langchain.document_loaders.blob_loaders.schema import Blob
+
+from cat.log import log
+
+
+# characters in each block of text yielded by text and HTML parsers
+BLOCK_SIZE = 64 * 1024
+
+
+def cut_block(text: str, block_size: int):
+    """Split text in a block of about `block_size` characters and the rest.
+
+    The block ends at a paragraph, line or word boundary when possible, so it does not cut sentences.
+    """
+    if len(text) < block_size:
+        return None, text
+
+    for separator in ["\n\n", "\n", " "]:
+        cut = text.rfind(separator, block_size // 2, block_size)
+        if cut != -1:
+            cut += len(separator)
+            return text[:cut], text[cut:]
+
+    return text[:block_size], text[block_size:]
+
+
+class PDFPageParser(BaseBlobParser):
+    """Parse a PDF a page at a time with PDFMiner.
+
+    In the parser pool, ranges of `pages_per_part` pages are parsed by different processes.
+    """
+
+    # CPU-bound and picklable, run in the parser pool
+    use_process_pool = True
+
+    def __init__(self, pages_per_part: int = 8):
+        self.pages_per_part = pages_per_part
+
+    def count_pages(self, pdf_file) -> int:
+        from pdfminer.pdfpage import PDFPage
+
+        # page tree only, page contents are not parsed
+        total_pages = sum(1 for _ in PDFPage.get_pages(pdf_file))
+        pdf_file.seek(0)
+        return total_pages
+
+    def lazy_parse(self, blob: Blob) -> Iterator[Document]:
+        from pdfminer.high_level import extract_pages
+
+        with blob.as_bytes_io() as pdf_file:
+            total_pages = self.count_pages(pdf_file)
+            for page_number, page_layout in enumerate(extract_pages(pdf_file), start=1):
+                yield self.to_document(page_layout, page_number, total_pages, blob)
+
+    def split_parts(self, blob: Blob) -> List[Tuple[int, int, int]]:
+        """Page ranges (first, last, total pages) to be parsed separately."""
+        with blob.as_bytes_io() as pdf_file:
+            total_pages = self.count_pages(pdf_file)
+        return [
+            (first, min(first + self.pages_per_part, total_pages), total_pages)
+            for first in range(0, total_pages, self.pages_per_part)
+        ]
+
+    def parse_part(self, blob: Blob, part: Tuple[int, int, int]) -> Iterator[Document]:
+        from pdfminer.high_level import extract_pages
+
+        first, last, total_pages = part
+        with blob.as_bytes_io() as pdf_file:
+            page_layouts = extract_pages(pdf_file, page_numbers=range(first, last))
+            for page_number, page_layout in enumerate(page_layouts, start=first + 1):
+                yield self.to_document(page_layout, page_number, total_pages, blob)
+
+    def to_document(self, page_layout, page_number, total_pages, blob) -> Document:
+        from pdfminer.layout import LTTextContainer
+
+        text = "".join(
+            element.get_text() for element in page_layout if isinstance(element, LTTextContainer)
+        )
+        return Document(
+            page_content=text,
+            metadata={"source": blob.source, "page": page_number, "total_pages": total_pages}
+        )
+
+
+class TextBlockParser(BaseBlobParser):
+    """Parse a text file a block of text at a time."""
+
+    def __init__(self, block_size: int = BLOCK_SIZE):
+        self.block_size = block_size
+
+    def lazy_parse(self, blob: Blob) -> Iterator[Document]:
+        with blob.as_bytes_io() as f:
+            text_file = io.TextIOWrapper(f, encoding=blob.encoding)
+            rest = ""
+            while True:
+                data = text_file.read(self.block_size)
+                rest += data
+                block, rest = cut_block(rest, self.block_size)
+                while block is not None:
+                    yield Document(page_content=block, metadata={"source": blob.source})
+                    block, rest = cut_block(rest, self.block_size)
+                if data == "":
+                    break
+            # avoid closing the blob file, its owner will
+            text_file.detach()
+
+        if rest != "":
+            yield Document(page_content=rest, metadata={"source": blob.source})
+
+
+class HTMLTextExtractor(HTMLParser):
+    """Collect visible text from HTML fed in pieces."""
+
+    # content of these tags is not text
+    skip_tags = {"script", "style", "noscript", "template", "svg"}
+    # these tags start a new line of text
+    block_tags = {
+        "p", "div", "br", "li", "ul", "ol", "tr", "table", "section", "article",
+        "h1", "h2", "h3", "h4", "h5", "h6", "header", "footer", "blockquote", "pre"
+    }
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text = []
+        self.title = ""
+        self.skip_depth = 0
+        self.in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.skip_tags:
+            self.skip_depth += 1
+        elif tag == "title":
+            self.in_title = True
+        elif tag in self.block_tags:
+            self.text.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self.skip_tags:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag == "title":
+            self.in_title = False
+        elif tag in self.block_tags:
+            self.text.append("\n")
+
+    def handle_data(self, data):
+        if self.in_title:
+            self.title += data
+        elif self.skip_depth == 0:
+            self.text.append(data)
+
+    def pop_text(self) -> str:
+        text = "".join(self.text)
+        self.text = []
+        return text
+
+
+class HTMLBlockParser(BaseBlobParser):
+    """Parse an HTML page a block of text at a time, without building the whole document tree.
+
+    Runs in the server process: the state of the parser (open tags) flows from a block to the next,
+    so the page cannot be split in parts for the parser pool, and blocks are streamed as they are read.
+    """
+
+    def __init__(self, block_size: int = BLOCK_SIZE):
+        self.block_size = block_size
+
+    def lazy_parse(self, blob: Blob) -> Iterator[Document]:
+        extractor = HTMLTextExtractor()
+        decoder = codecs.getincrementaldecoder(blob.encoding)(errors="replace")
+
+        rest = ""
+        with blob.as_bytes_io() as f:
+            while True:
+                data = f.read(self.block_size)
+                extractor.feed(decoder.decode(data, final=(data == b"")))
+                rest += extractor.pop_text()
+                block, rest = cut_block(rest, self.block_size)
+                while block is not None:
+                    yield self.to_document(block, blob, extractor)
+                    block, rest = cut_block(rest, self.block_size)
+                if data == b"":
+                    break
+
+        extractor.close()
+        rest += extractor.pop_text()
+        if rest.strip() != "":
+            yield self.to_document(rest, blob, extractor)
+
+    def to_document(self, text, blob, extractor):
+        return Document(
+            page_content=text,
+            metadata={"source": blob.source, "title": extractor.title.strip()}
+        )
+
+
+def parse_in_worker(parser: BaseBlobParser, blob: Blob, part: Any) -> List[Document]:
+    """Parse a part of a blob in a parser pool process."""
+    return list(parser.parse_part(blob, part))
+
+
+class ParserPool:
+    """Pool of processes running CPU-bound parsers.
+
+    Parsing pure Python formats (i.e. PDF) in the server process holds the GIL and slows down chats
+    during big uploads. Parsers opt in with a `use_process_pool = True` attribute, must be picklable
+    and must split the blob in parts with `split_parts` and `parse_part` (i.e. `PDFPageParser`):
+    parts are parsed across several processes and documents stream back in order, a few parts at a time,
+    so a whole document is never sent back at once. Other parsers run in the server process.
+
+    Attributes
+    ----------
+    processes : int
+        Worker processes, zero parses in the server process.
+        Can be set in the `.env` file with `RABBITHOLE_PARSER_PROCESSES`.
+    """
+
+    def __init__(self, processes: int = None):
+        self.processes = processes if processes is not None else int(os.getenv("RABBITHOLE_PARSER_PROCESSES", 2))
+        # workers are spawned at the first parse
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                # spawn, forking a multithreaded server is not safe
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.processes, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self.executor
+
+    def can_run(self, parser: BaseBlobParser) -> bool:
+        if self.processes <= 0 or not getattr(parser, "use_process_pool", False):
+            return False
+        if not (hasattr(parser, "split_parts") and hasattr(parser, "parse_part")):
+            log.warning(f"{type(parser).__name__} cannot be split in parts, parsing in the server process")
+            return False
+        try:
+            pickle.dumps(parser)
+            return True
+        except Exception:
+            log.warning(f"{type(parser).__name__} is not picklable, parsing in the server process")
+            return False
+
+    def lazy_parse(self, parser: BaseBlobParser, blob: Blob) -> Iterator[Document]:
+        """Parse a blob, in the pool if the parser opted in."""
+        if not self.can_run(parser):
+            yield from parser.lazy_parse(blob)
+            return
+
+        parts = parser.split_parts(blob)
+
+        # a few parts ahead for each worker, results are consumed in order
+        executor = self.get_executor()
+        futures = deque()
+        try:
+            for part in parts:
+                futures.append(executor.submit(parse_in_worker, parser, blob, part))
+                if len(futures) >= 2 * self.processes:
+                    yield from futures.popleft().result()
+            while len(futures) > 0:
+                yield from futures.popleft().result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = None
+
+
+class JSONStreamReader:
+    """Incremental reader for big JSON documents.
+
+    The document is read a block at a time and walked structurally: values the caller asks for
+    are decoded one by one, everything else is skipped without being kept in memory.
+    Memory usage is bounded by the biggest single value decoded (i.e. one memory with its vector).
+
+    Notes
+    -----
+    When iterating `iter_object`, the value of each key must be consumed
+    (`read_value`, `skip_value`, `iter_object` or `iter_array`) before asking for the next key.
+    """
+
+    whitespace = " \t\n\r"
+    # characters that can follow a number
+    delimiters = whitespace + ",]}"
+
+    def __init__(self, text_file, block_size: int = BLOCK_SIZE):
+        self.file = text_file
+        self.block_size = block_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def read_more(self) -> bool:
+        if self.eof:
+            return False
+        # read at least as much as already buffered, so decoding a big value stays linear
+        data = self.file.read(max(self.block_size, len(self.buffer) - self.pos))
+        if data == "":
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non whitespace character, not consumed."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.read_more():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, char: str):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Invalid JSON document: expected '{char}', found '{found}'")
+        self.pos += 1
+
+    def read_value(self) -> Any:
+        """Decode the next value."""
+        is_scalar = self.peek() not in "{[\""
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number could go on in the next block
+                if self.eof or not is_scalar or (end < len(self.buffer) and self.buffer[end] in self.delimiters):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.read_more()
+
+    def skip_value(self):
+        """Consume the next value, without decoding containers as a whole."""
+        char = self.peek()
+        if char == "{":
+            for _ in self.iter_object():
+                self.skip_value()
+        elif char == "[":
+            for _ in self.iter_array(decode=False):
+                pass
+        else:
+            self.read_value()
+
+    def iter_object(self) -> Iterator[str]:
+        """Yield the keys of the next object. The caller consumes each value."""
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError(f"Invalid JSON document: expected ',' or '}}', found '{char}'")
+
+    def iter_array(self, decode: bool = True) -> Iterator[Any]:
+        """Yield the items of the next array (None for each item if `decode` is False)."""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            if decode:
+                yield self.read_value()
+            else:
+                self.skip_value()
+                yield None
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError(f"Invalid JSON document: expected ',' or ']', found '{char}'")
+
+    def find(self, path: Sequence[str]) -> bool:
+        """Move to the value at `path` (a sequence of object keys), skipping everything before it."""
+        for key in path:
+            for k in self.iter_object():
+                if k == key:
+                    break
+                self.skip_value()
+            else:
+                return False
+        return True
+
+
+def read_json_value(file: BinaryIO, path: Sequence[str]) -> Any:
+    """Value at `path` in a JSON file, reading the file only up to it.
+
+    Raises `KeyError` if the path is not in the document.
+    """
+    file.seek(0)
+    text_file = io.TextIOWrapper(file, encoding="utf-8")
+    try:
+        reader = JSONStreamReader(text_file)
+        if not reader.find(path):
+            raise KeyError(".".join(path))
+        return reader.read_value()
+    finally:
+        # avoid closing the file, its owner will
+        text_file.detach()
+
+
+def iter_json_array(file: BinaryIO, path: Sequence[str]) -> Iterator[Any]:
+    """Items of the array at `path` in a JSON file, decoded one at a time.
+
+    Raises `KeyError` if the path is not in the document.
+    """
+    file.seek(0)
+    text_file = io.TextIOWrapper(file, encoding="utf-8")
+    try:
+        reader = JSONStreamReader(text_file)
+        if not reader.find(path):
+            raise KeyError(".".join(path))
+        yield from reader.iter_array()
+    finally:
+        text_file.detach()
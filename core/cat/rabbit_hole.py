@@ -1,24 +1,27 @@
 import os
 import time
 import math
-import json
+import shutil
+import hashlib
+import tempfile
 import mimetypes
-from typing import List, Union
-from urllib.request import urlopen, Request
+from contextlib import contextmanager
+from typing import List, Union, Iterator, Iterable
 from urllib.parse import urlparse
-from urllib.error import HTTPError
 
 from cat.log import log
+from cat.utils import RateLimiter
+from cat.ingestion_jobs import IngestionScheduler, StageStats, current_job
+from cat.memory.memory_dump import MemoryDump
+from cat.web_fetcher import WebFetcher
+from cat.text_splitter import LinearTextSplitter, get_token_counter
+from cat.parsers import (PDFPageParser, TextBlockParser, HTMLBlockParser, ParserPool,
+                         read_json_value, iter_json_array)
 from starlette.datastructures import UploadFile
 from langchain.docstore.document import Document
 from qdrant_client.http import models
 
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.document_loaders.parsers import PDFMinerParser
-from langchain.document_loaders.parsers.generic import MimeTypeBasedParser
-from langchain.document_loaders.parsers.txt import TextParser
 from langchain.document_loaders.blob_loaders.schema import Blob
-from langchain.document_loaders.parsers.html.bs4 import BS4HTMLParser
 
 
 class RabbitHole:
@@ -28,22 +31,39 @@ class RabbitHole:
     def __init__(self, cat):
         self.cat = cat
 
+        # chunks embedded (and stored) per call. Can be set in the `.env` file
+        self.embed_batch_size = int(os.getenv("EMBEDDER_BATCH_SIZE", 64))
+        # pause embedding calls when the provider rate limits us
+        self.embedder_rate_limiter = RateLimiter()
+
+        # uploads are queued and ingested by a bounded pool of workers
+        self.scheduler = IngestionScheduler(self)
+
+        # pooled HTTP client for web pages
+        self.web_fetcher = WebFetcher()
+
+        # processes parsing CPU-bound formats
+        self.parser_pool = ParserPool()
+
+        # parsers read a page (or a block of text) at a time
         file_handlers = {
-            "application/pdf": PDFMinerParser(),
-            "text/plain": TextParser(),
-            "text/markdown": TextParser(),
-            "text/html": BS4HTMLParser()
+            "application/pdf": PDFPageParser(),
+            "text/plain": TextBlockParser(),
+            "text/markdown": TextBlockParser(),
+            "text/html": HTMLBlockParser()
         }
 
         self.file_handlers = cat.mad_hatter.execute_hook("rabbithole_instantiates_parsers", file_handlers)
 
-    def ingest_memory(self, file: UploadFile):
+    def ingest_memory(self, file: UploadFile, batch_size: int = None):
         """Upload memories to the declarative memory from a JSON file.
 
         Parameters
         ----------
         file : UploadFile
             File object sent via `rabbithole/memory` hook.
+        batch_size : int
+            Number of memories stored together. Defaults to `EMBEDDER_BATCH_SIZE` (64).
 
         Notes
         -----
@@ -52,58 +72,136 @@ class RabbitHole:
         when uploading.
         The method also performs a check on the dimensionality of the embeddings (i.e. length of each vector).
 
+        The file is streamed, one memory at a time: a first pass checks the embedder and all the vectors,
+        so a bad file fails before anything is written; a second pass stores memories in batches.
+        Binary memory dumps (zip archives, see `MemoryDump`) are also accepted.
+
         """
 
-        # Get file bytes
-        file_bytes = file.file.read()
+        batch_size = batch_size or self.embed_batch_size
+        memory_file = file.file
 
-        # Load fyle byte in a dict
-        memories = json.loads(file_bytes.decode("utf-8"))
+        if MemoryDump.is_dump(memory_file):
+            self.ingest_memory_dump(file, batch_size)
+            return
 
         # Check the embedder used for the uploaded memories is the same the Cat is using now
-        upload_embedder = memories["embedder"]
-        cat_embedder = str(self.cat.embedder.__class__.__name__)
+        upload_embedder = read_json_value(memory_file, ["embedder"])
+        cat_embedder = str(self.cat.embedder.embedder.__class__.__name__)
 
         if upload_embedder != cat_embedder:
             message = f'Embedder mismatch: file embedder {upload_embedder} is different from {cat_embedder}'
             raise Exception(message)
 
-        # Get Declarative memories in file
-        declarative_memories = memories["collections"]["declarative"]
-
-        # Store data to upload the memories in batch
-        ids = [i["id"] for i in declarative_memories]
-        payloads = [{
-            "page_content": p["page_content"],
-            "metadata": p["metadata"]
-        } for p in declarative_memories]
-        vectors = [v["vector"] for v in declarative_memories]
-
-        log.info(f"Preparing to load {len(vectors)} vector memories")
-
-        # Check embedding size is correct
+        # Check embedding size is correct, for all the declarative memories in file
         embedder_size = self.cat.memory.vectors.embedder_size
-        len_mismatch = [len(v) == embedder_size for v in vectors]
+        n_memories = 0
+        for memory in iter_json_array(memory_file, ["collections", "declarative"]):
+            if len(memory["vector"]) != embedder_size:
+                message = f'Embedding size mismatch: vectors length should be {embedder_size}'
+                raise Exception(message)
+            n_memories += 1
+
+        log.info(f"Preparing to load {n_memories} vector memories")
+
+        job = current_job.get()
+        if job is not None:
+            job.chunks_parsed = n_memories
+            self.scheduler.report_progress(job, 0, n_memories)
+
+        # Upsert memories in batch mode
+        batch = []
+        n_stored = 0
+        for memory in iter_json_array(memory_file, ["collections", "declarative"]):
+            batch.append(memory)
+            if len(batch) == batch_size:
+                n_stored += self.upsert_memories(batch)
+                batch = []
+                if job is not None:
+                    self.scheduler.report_progress(job, n_stored)
+        n_stored += self.upsert_memories(batch)
+
+        if job is not None:
+            self.scheduler.report_progress(job, n_stored, n_memories)
+
+    def ingest_memory_dump(self, file: UploadFile, batch_size: int = None):
+        """Upload memories to the declarative memory from a binary memory dump.
 
-        if not any(len_mismatch):
-            message = f'Embedding size mismatch: vectors length should be {embedder_size}'
-            raise Exception(message)
+        Parameters
+        ----------
+        file : UploadFile
+            Zip archive produced by `/memory/export/dump/`.
+        batch_size : int
+            Number of memories stored together. Defaults to `EMBEDDER_BATCH_SIZE` (64).
 
-        # Upsert memories in batch mode # TODO: make a method for batch inserting inside vector memory
-        self.cat.memory.vectors.vector_db.upsert(
-            collection_name="declarative",
-            points=models.Batch(
-                ids=ids,
-                payloads=payloads,
-                vectors=vectors
+        Notes
+        -----
+        Vectors are memory-mapped from the archive and upserted a slice at a time.
+        """
+
+        batch_size = batch_size or self.embed_batch_size
+
+        with self.open_file(file) as (path, _, _):
+            dump = MemoryDump(path)
+
+            # Check the embedder used for the uploaded memories is the same the Cat is using now
+            cat_embedder = str(self.cat.embedder.embedder.__class__.__name__)
+            if dump.embedder != cat_embedder:
+                message = f'Embedder mismatch: file embedder {dump.embedder} is different from {cat_embedder}'
+                raise Exception(message)
+
+            # all the vectors in a dump have the same size
+            embedder_size = self.cat.memory.vectors.embedder_size
+            if dump.vector_size != embedder_size:
+                message = f'Embedding size mismatch: vectors length should be {embedder_size}'
+                raise Exception(message)
+
+            n_memories = dump.count("declarative")
+            log.info(f"Preparing to load {n_memories} vector memories")
+
+            job = current_job.get()
+            if job is not None:
+                job.chunks_parsed = n_memories
+                self.scheduler.report_progress(job, 0, n_memories)
+
+            n_stored = 0
+            for memories, vectors in dump.iter_batches("declarative", batch_size):
+                for memory, vector in zip(memories, vectors.tolist()):
+                    memory["vector"] = vector
+                n_stored += self.upsert_memories(memories)
+                if job is not None:
+                    self.scheduler.report_progress(job, n_stored)
+
+    def upsert_memories(self, memories: List[dict]) -> int:
+        """Store exported declarative memories (already embedded) with a single upsert."""
+        if len(memories) == 0:
+            return 0
+
+        job = current_job.get()
+        upsert_stats = job.upsert_stats if job is not None else StageStats()
+
+        with upsert_stats.measure(len(memories)):
+            self.cat.memory.vectors.vector_db.upsert(
+                collection_name="declarative",
+                points=models.Batch(
+                    ids=[m["id"] for m in memories],
+                    payloads=[{
+                        "page_content": m["page_content"],
+                        "metadata": m["metadata"]
+                    } for m in memories],
+                    vectors=[m["vector"] for m in memories]
+                )
             )
-        )
+
+        if job is not None:
+            job.chunks_stored += len(memories)
+        return len(memories)
 
     def ingest_file(
             self,
             file: Union[str, UploadFile],
-            chunk_size: int = 400,
-            chunk_overlap: int = 100
+            chunk_size: int = 100,
+            chunk_overlap: int = 25
     ):
         """Load a file in the Cat's declarative memory.
 
@@ -116,21 +214,23 @@ class RabbitHole:
             The file can be a path passed as a string or an `UploadFile` object if the document is ingested using the
             `rabbithole` endpoint.
         chunk_size : int
-            Number of characters in each document chunk.
+            Number of tokens in each document chunk.
         chunk_overlap : int
-            Number of overlapping characters between consecutive chunks.
+            Number of overlapping tokens between consecutive chunks.
 
         Notes
         ----------
         Currently supported formats are `.txt`, `.pdf` and `.md`.
+        The file is streamed: each page (or block of text) is split, embedded and stored before the next one
+        is read, so memory usage does not depend on the file size.
 
         See Also
         ----------
         before_rabbithole_stores_documents
         """
 
-        # split file into a list of docs
-        docs = self.file_to_docs(
+        # split file into groups of docs (one per page)
+        docs_stream = self.file_to_docs_stream(
             file=file, chunk_size=chunk_size, chunk_overlap=chunk_overlap
         )
 
@@ -140,13 +240,65 @@ class RabbitHole:
         else:
             filename = file.filename
 
-        self.store_documents(docs=docs, source=filename)
+        # the file is the whole source, chunks from an older version are replaced
+        self.store_documents_stream(docs_stream=docs_stream, source=filename, delete_stale=True)
+
+    def ingest_web_pages(
+            self,
+            urls: List[str] = None,
+            sitemap: str = None,
+            max_pages: int = 100,
+            chunk_size: int = 100,
+            chunk_overlap: int = 25
+    ):
+        """Crawl web pages and load them in the Cat's declarative memory.
+
+        Parameters
+        ----------
+        urls : List[str]
+            Web pages to ingest.
+        sitemap : str
+            URL of a sitemap (or sitemap index) listing more pages to ingest.
+        max_pages : int
+            Maximum number of pages to ingest.
+        chunk_size : int
+            Number of tokens in each document chunk.
+        chunk_overlap : int
+            Number of overlapping tokens between consecutive chunks.
+
+        Notes
+        -----
+        Pages are downloaded concurrently by the shared `WebFetcher` (with a per host limit)
+        and each page is parsed and stored as soon as it is ready.
+        Pages that cannot be downloaded are skipped.
+        """
+
+        urls = list(urls or [])
+        if sitemap is not None:
+            urls += self.web_fetcher.sitemap_urls(sitemap, max_pages)
+
+        # drop duplicates, keeping the order
+        urls = list(dict.fromkeys(urls))[:max_pages]
+
+        pages_read = 0
+        for url, path, result in self.web_fetcher.download_many(urls):
+            if isinstance(result, Exception):
+                log.warning(f"Could not fetch {url}: {result}")
+                continue
+
+            # pages without a known parser are read as HTML
+            content_type = result if result in self.file_handlers else "text/html"
+            docs_stream = self.path_to_docs_stream(path, content_type, url, chunk_size, chunk_overlap)
+            self.store_documents_stream(docs_stream=docs_stream, source=url, delete_stale=True)
+            pages_read += 1
+
+        self.notify(f"Finished crawling, I read {pages_read} of {len(urls)} pages.")
 
     def file_to_docs(
             self,
             file: Union[str, UploadFile],
-            chunk_size: int = 400,
-            chunk_overlap: int = 100,
+            chunk_size: int = 100,
+            chunk_overlap: int = 25,
     ) -> List[Document]:
         """Load and convert files to Langchain `Document`.
 
@@ -159,9 +311,9 @@ class RabbitHole:
             The file can be either a string path if loaded programmatically, a FastAPI `UploadFile`
             if coming from the `/rabbithole/` endpoint or a URL if coming from the `/rabbithole/web` endpoint.
         chunk_size : int
-            Number of characters in each document chunk.
+            Number of tokens in each document chunk.
         chunk_overlap : int
-            Number of overlapping characters between consecutive chunks.
+            Number of overlapping tokens between consecutive chunks.
 
         Returns
         -------
@@ -172,66 +324,137 @@ class RabbitHole:
         -----
         This method is used by both `/rabbithole/` and `/rabbithole/web` endpoints.
         Currently supported files are `.txt`, `.pdf`, `.md` and web pages.
+        All chunks are kept in memory, use `file_to_docs_stream` for big files.
 
         """
 
-        # Check type of incoming file.
-        if isinstance(file, UploadFile):
-            # Get mime type and source of UploadFile
-            content_type = mimetypes.guess_type(file.filename)[0]
-            source = file.filename
-
-            # Get file bytes
-            file_bytes = file.file.read()
-        elif isinstance(file, str):
-            # Check if string file is a string or url
-            parsed_file = urlparse(file)
-            is_url = all([parsed_file.scheme, parsed_file.netloc])
-
-            if is_url:
-                # Define mime type and source of url
-                content_type = "text/html"
-                source = file
-
-                # Make a request with a fake browser name
-                request = Request(file, headers={"User-Agent": "Magic Browser"})
-
-                try:
-                    # Get binary content of url
-                    with urlopen(request) as response:
-                        file_bytes = response.read()
-                except HTTPError as e:
-                    log.error(e)
-            else:
+        docs = []
+        for page_docs in self.file_to_docs_stream(file, chunk_size, chunk_overlap):
+            docs += page_docs
+        return docs
 
-                # Get mime type from file extension and source
-                content_type = mimetypes.guess_type(file)[0]
-                source = os.path.basename(file)
+    def file_to_docs_stream(
+            self,
+            file: Union[str, UploadFile],
+            chunk_size: int = 100,
+            chunk_overlap: int = 25,
+    ) -> Iterator[List[Document]]:
+        """Load and convert files to Langchain `Document`, a page at a time.
+
+        Parameters
+        ----------
+        file : str, UploadFile
+            The file can be either a string path if loaded programmatically, a FastAPI `UploadFile`
+            if coming from the `/rabbithole/` endpoint or a URL if coming from the `/rabbithole/web` endpoint.
+        chunk_size : int
+            Number of tokens in each document chunk.
+        chunk_overlap : int
+            Number of overlapping tokens between consecutive chunks.
+
+        Yields
+        ------
+        docs : List[Document]
+            Chunks of a page (PDF) or of a block of text (text and HTML).
+
+        Notes
+        -----
+        Content is never read in memory as a whole: uploads and web pages are spooled to a temporary file
+        and parsed lazily. Split hooks run once per page.
+        """
+
+        with self.open_file(file) as (path, content_type, source):
+            yield from self.path_to_docs_stream(path, content_type, source, chunk_size, chunk_overlap)
+
+    def path_to_docs_stream(
+            self,
+            path: str,
+            content_type: str,
+            source: str,
+            chunk_size: int = 100,
+            chunk_overlap: int = 25,
+    ) -> Iterator[List[Document]]:
+        """Parse and split a local file, a page at a time (see `file_to_docs_stream`)."""
+
+        # Load the file in the Blob schema (content is read lazily)
+        blob = Blob(path=path, mimetype=content_type)
 
-                # Get file bytes
-                with open(file, "rb") as f:
-                    file_bytes = f.read()
-        else:
-            raise ValueError(f"{type(file)} is not a valid type.")
-
-        # Load the bytes in the Blob schema
-        blob = Blob(data=file_bytes,
-                    mimetype=content_type,
-                    source=source).from_data(data=file_bytes,
-                                             mime_type=content_type,
-                                             path=source)
         # Parser based on the mime type
-        parser = MimeTypeBasedParser(handlers=self.file_handlers)
+        if content_type not in self.file_handlers:
+            raise ValueError(f"Unsupported mime type: {content_type}")
+        parser = self.file_handlers[content_type]
+
+        # Parse the text (CPU-bound parsers run in the parser pool)
+        self.notify("I'm parsing the content. Big content could require some minutes...")
+        for page in self.parser_pool.lazy_parse(parser, blob):
+            page.metadata["source"] = source
+            yield self.split_text([page], chunk_size, chunk_overlap)
+
+    @contextmanager
+    def open_file(self, file: Union[str, UploadFile]):
+        """Local path, mime type and source name of the content to ingest.
+
+        Uploads not already on disk and web pages are copied a block at a time in a temporary file,
+        removed on exit.
+        """
 
-        # Parse the text
-        self.cat.send_ws_message("I'm parsing the content. Big content could require some minutes...")
-        text = parser.parse(blob)
+        temp_path = None
+        try:
+            # Check type of incoming file.
+            if isinstance(file, UploadFile):
+                # Get mime type and source of UploadFile
+                content_type = mimetypes.guess_type(file.filename)[0]
+                source = file.filename
+
+                # uploads saved by the ingestion queue are already on disk
+                path = getattr(file.file, "name", None)
+                if not isinstance(path, str) or not os.path.isfile(path):
+                    temp_path = path = self.spool(file.file)
+            elif isinstance(file, str):
+                # Check if string file is a string or url
+                parsed_file = urlparse(file)
+                is_url = all([parsed_file.scheme, parsed_file.netloc])
+
+                if is_url:
+                    # Define source of url
+                    source = file
+
+                    fd, path = tempfile.mkstemp(prefix="rabbithole_")
+                    os.close(fd)
+                    temp_path = path
+
+                    try:
+                        # Download with the shared client (timeouts and size limit)
+                        content_type = self.web_fetcher.download(file, path)
+                    except Exception as e:
+                        log.error(e)
+                        raise
+
+                    # pages without a known parser are read as HTML
+                    if content_type not in self.file_handlers:
+                        content_type = "text/html"
+                else:
+
+                    # Get mime type from file extension and source
+                    content_type = mimetypes.guess_type(file)[0]
+                    source = os.path.basename(file)
+                    path = file
+            else:
+                raise ValueError(f"{type(file)} is not a valid type.")
 
-        self.cat.send_ws_message(f"Parsing completed. Now let's go with reading process...")
-        docs = self.split_text(text, chunk_size, chunk_overlap)
-        return docs
+            yield path, content_type, source
 
-    def store_documents(self, docs: List[Document], source: str) -> None:
+        finally:
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def spool(self, stream) -> str:
+        """Copy a binary stream in a temporary file, a block at a time."""
+        with tempfile.NamedTemporaryFile(delete=False, prefix="rabbithole_") as f:
+            shutil.copyfileobj(stream, f)
+            return f.name
+
+    def store_documents(self, docs: List[Document], source: str, batch_size: int = None,
+                        delete_stale: bool = False) -> None:
         """Add documents to the Cat's declarative memory.
 
         This method loops a list of Langchain `Document` and adds some metadata. Namely, the source filename and the
@@ -243,60 +466,179 @@ class RabbitHole:
             List of Langchain `Document` to be inserted in the Cat's declarative memory.
         source : str
             Source name to be added as a metadata. It can be a file name or an URL.
+        batch_size : int
+            Number of documents embedded and stored together. Defaults to `EMBEDDER_BATCH_SIZE` (64).
+        delete_stale : bool
+            If True, `docs` are the whole source: chunks of `source` already in memory and not in `docs` are deleted.
+            By default documents are only added, so a source can be stored with several calls.
 
         Notes
         -------
+        Documents whose content is already in memory for the same source are not stored again.
         At this point, it is possible to customize the Cat's behavior using the `before_rabbithole_insert_memory` hook
         to edit the memories before they are inserted in the vector database.
+        The hook still runs once per document, then documents are embedded with one call per batch and
+        stored with one upsert per batch. If the embedder rate limits the requests, calls are retried
+        with an increasing pause.
 
         See Also
         --------
         before_rabbithole_insert_memory
         """
 
-        log.info(f"Preparing to memorize {len(docs)} vectors")
+        self.store_documents_stream([docs], source, batch_size, delete_stale)
 
-        # hook the docs before they are stored in the vector memory
-        docs = self.cat.mad_hatter.execute_hook(
-            "before_rabbithole_stores_documents", docs
-        )
+    def store_documents_stream(self, docs_stream: Iterable[List[Document]], source: str, batch_size: int = None,
+                               delete_stale: bool = False) -> None:
+        """Add groups of documents to the Cat's declarative memory, as they come.
 
-        # classic embed
-        time_last_notification = time.time()
-        time_interval = 10  # a notification every 10 secs
-        for d, doc in enumerate(docs):
-            if time.time() - time_last_notification > time_interval:
-                time_last_notification = time.time()
-                perc_read = int(d / len(docs) * 100)
-                self.cat.send_ws_message(f"Read {perc_read}% of {source}")
-
-            doc.metadata["source"] = source
-            doc.metadata["when"] = time.time()
-            doc = self.cat.mad_hatter.execute_hook(
-                "before_rabbithole_insert_memory", doc
-            )
-            inserting_info = f"{d + 1}/{len(docs)}):    {doc.page_content}"
-            if doc.page_content != "":
-                _ = self.cat.memory.vectors.declarative.add_texts(
-                    [doc.page_content],
-                    [doc.metadata],
-                )
+        Each group (i.e. the chunks of a page) goes through `before_rabbithole_stores_documents`,
+        then is embedded and stored before the next group is requested.
 
-                log.info(f"Inserted into memory({inserting_info})")
-            else:
-                log.info(f"Skipped memory insertion of empty doc ({inserting_info})")
+        Parameters
+        ----------
+        docs_stream : Iterable[List[Document]]
+            Groups of Langchain `Document` to be inserted in the Cat's declarative memory.
+        source : str
+            Source name to be added as a metadata. It can be a file name or an URL.
+        batch_size : int
+            Number of documents embedded and stored together. Defaults to `EMBEDDER_BATCH_SIZE` (64).
+        delete_stale : bool
+            If True, the stream is the whole source: once it is stored, chunks of `source` that did not appear
+            in it are deleted. By default documents are only added.
+
+        Notes
+        -----
+        A hash of each chunk content is stored in its metadata (`content_hash`).
+        Chunks already in memory for the same source are not embedded again. With `delete_stale`
+        (used when ingesting files and web pages), re-ingesting an updated document only costs its changed chunks
+        and its removed chunks are deleted.
+
+        See Also
+        --------
+        before_rabbithole_stores_documents
+        before_rabbithole_insert_memory
+        """
+
+        batch_size = batch_size or self.embed_batch_size
 
-            # wait a little to avoid APIs rate limit errors
-            time.sleep(0.1)
+        declarative = self.cat.memory.vectors.declarative
+
+        # chunks stored by a previous ingestion of the same source
+        stored_hashes = declarative.get_content_hashes(source)
+        seen_hashes = set()
+        chunks_unchanged = 0
+
+        # when running as a job, report progress (and stop if the job is cancelled)
+        job = current_job.get()
+        # stage latencies are measured outside of jobs too, for the final log
+        embed_stats = job.embed_stats if job is not None else StageStats()
+        upsert_stats = job.upsert_stats if job is not None else StageStats()
+
+        # documents are not query-like, no use in caching their vectors
+        embedder = getattr(self.cat.embedder, "embedder", self.cat.embedder)
+
+        chunks_done = 0
+        for docs in docs_stream:
+
+            log.info(f"Preparing to memorize {len(docs)} vectors")
+
+            # hook the docs before they are stored in the vector memory
+            docs = self.cat.mad_hatter.execute_hook(
+                "before_rabbithole_stores_documents", docs
+            )
+
+            if job is not None:
+                job.chunks_parsed += len(docs)
+                self.scheduler.report_progress(job, chunks_done, self.estimate_chunks_total(docs, chunks_done))
+
+            for batch_start in range(0, len(docs), batch_size):
+                batch = []
+                for d, doc in enumerate(docs[batch_start:batch_start + batch_size], start=batch_start):
+                    doc.metadata["source"] = source
+                    doc.metadata["when"] = time.time()
+                    doc = self.cat.mad_hatter.execute_hook(
+                        "before_rabbithole_insert_memory", doc
+                    )
+                    if doc.page_content == "":
+                        log.info(f"Skipped memory insertion of empty doc ({d + 1}/{len(docs)})")
+                        continue
+
+                    content_hash = self.content_hash(doc.page_content)
+                    doc.metadata["content_hash"] = content_hash
+                    if content_hash in seen_hashes or content_hash in stored_hashes:
+                        # already in memory (or repeated in the source)
+                        seen_hashes.add(content_hash)
+                        chunks_unchanged += 1
+                        continue
+                    seen_hashes.add(content_hash)
+                    batch.append(doc)
+
+                if len(batch) == 0:
+                    continue
+
+                # embed and store the whole batch at once
+                texts = [doc.page_content for doc in batch]
+                with embed_stats.measure(len(texts)):
+                    vectors = self.embedder_rate_limiter.call(embedder.embed_documents, texts)
+                if job is not None:
+                    job.chunks_embedded += len(texts)
+
+                with upsert_stats.measure(len(batch)):
+                    declarative.add_points(
+                        texts, [doc.metadata for doc in batch], vectors
+                    )
+
+                log.info(f"Inserted into memory {len(batch)} documents ({min(batch_start + batch_size, len(docs))}/{len(docs)})")
+
+                if job is not None:
+                    job.chunks_stored += len(batch)
+                    self.scheduler.report_progress(job, chunks_done + min(batch_start + batch_size, len(docs)))
+
+            chunks_done += len(docs)
+
+        # chunks no longer in the source (and duplicates of the same chunk)
+        stale_ids = []
+        if delete_stale:
+            for content_hash, ids in stored_hashes.items():
+                if content_hash in seen_hashes:
+                    stale_ids += ids[1:]
+                else:
+                    stale_ids += ids
+        if len(stale_ids) > 0:
+            declarative.delete_points(stale_ids)
+
+        log.info(f"{source}: {chunks_unchanged} chunks unchanged, {len(stale_ids)} removed")
+        log.info(f"{source}: embedder {embed_stats.summary()}, vector DB {upsert_stats.summary()}")
+
+        if job is not None:
+            self.scheduler.report_progress(job, chunks_done, chunks_done)
 
         # notify client
         finished_reading_message = f"Finished reading {source}, " \
-                                   f"I made {len(docs)} thoughts on it."
+                                   f"I made {chunks_done} thoughts on it."
 
-        self.cat.send_ws_message(finished_reading_message)
+        self.notify(finished_reading_message)
 
         print(f"\n\nDone uploading {source}")
 
+    def notify(self, content: str):
+        """Send a notification to the user who started the current ingestion job (to everybody outside of jobs)."""
+        job = current_job.get()
+        self.cat.send_ws_message(content, user_id=job.user_id if job is not None else None)
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """Hash identifying a chunk by its content."""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def estimate_chunks_total(self, docs: List[Document], chunks_done: int) -> int:
+        """Expected chunks of the whole file, from the pages read so far (None if unknown)."""
+        if len(docs) == 0 or "total_pages" not in docs[0].metadata:
+            return None
+        pages_done = docs[0].metadata["page"]
+        return int((chunks_done + len(docs)) / pages_done * docs[0].metadata["total_pages"])
+
     def split_text(self, text, chunk_size, chunk_overlap):
         """Split text in overlapped chunks.
 
@@ -308,9 +650,9 @@ class RabbitHole:
         text : str
             Content of the loaded file.
         chunk_size : int
-            Number of characters in each document chunk.
+            Number of tokens in each document chunk.
         chunk_overlap : int
-            Number of overlapping characters between consecutive chunks.
+            Number of overlapping tokens between consecutive chunks.
 
         Returns
         -------
@@ -334,17 +676,14 @@ class RabbitHole:
             "before_rabbithole_splits_text", text
         )
 
-        # split the documents using chunk_size and chunk_overlap
-        text_splitter = RecursiveCharacterTextSplitter(
+        # split the documents using chunk_size and chunk_overlap, measured in embedder tokens
+        text_splitter = LinearTextSplitter(
             chunk_size=chunk_size,
             chunk_overlap=chunk_overlap,
-            separators=["\\n\\n", "\n\n", ".\\n", ".\n", "\\n", "\n", " ", ""],
+            length_function=get_token_counter(self.cat.embedder),
         )
-        # split text
+        # split text (short texts, i.e. page numbers, are merged with the previous chunk)
         docs = text_splitter.split_documents(text)
-        # remove short texts (page numbers, isolated words, etc.)
-        # TODO: join each short chunk with previous one, instead of deleting them
-        docs = list(filter(lambda d: len(d.page_content) > 10, docs))
 
         # do something on the text after it is split
         docs = self.cat.mad_hatter.execute_hook(
@@ -31,7 +31,7 @@ def get_embedders_settings(request: Request) -> Dict:
     # Deduce selected embedder:
     ccat = request.app.state.ccat
     for embedder_config_class in reversed(SUPPORTED_EMDEDDING_MODELS):
-        if embedder_config_class._pyclass == type(ccat.embedder):
+        if embedder_config_class._pyclass == type(ccat.embedder.embedder):
             selected = embedder_config_class.__name__
     
     saved_settings = crud.get_settings_by_category(category=EMBEDDER_CATEGORY)
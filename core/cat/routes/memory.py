@@ -1,5 +1,14 @@
-from typing import Dict
+import os
+import time
+import tempfile
+from typing import Dict, List
 from fastapi import Query, Request, APIRouter, HTTPException
+from fastapi.responses import StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+
+from cat.memory.memory_dump import MemoryDump
+from cat.memory.collection_settings import CollectionSettings
 
 router = APIRouter()
 
@@ -11,11 +20,14 @@ async def recall_memories_from_text(
         text: str = Query(description="Find memories similar to this text."),
         k: int = Query(default=100, description="How many memories to return."),
         user_id: str = Query(default="user", description="User id."),
+        time_window: float = Query(default=None, description="Only recall episodic memories of the last seconds."),
 ) -> Dict:
     """Search k memories similar to given text."""
 
     ccat = request.app.state.ccat
     vector_memory = ccat.memory.vectors
+    # include memories still waiting to be written
+    vector_memory.flush()
 
     # Embed the query to plot it in the Memory page
     query_embedding = ccat.embedder.embed_query(text)
@@ -29,33 +41,31 @@ async def recall_memories_from_text(
     recalled = {}
     for c in collections:
 
-        # only episodic collection has users
+        # only episodic collection has users (and a conversation timeline)
         if c == "episodic":
             user_filter = {
                 'source': user_id
             }
+            collection_time_window = time_window
         else:
             user_filter = None
+            collection_time_window = None
 
+        # vectors are needed to plot memories
         memories = vector_memory.collections[c].recall_memories_from_embedding(
             query_embedding,
             k=k,
-            metadata=user_filter
+            metadata=user_filter,
+            with_vectors=True,
+            time_window=collection_time_window
         )
 
-        recalled[c] = []
-        for metadata, score, vector, id in memories:
-            memory_dict = dict(metadata)
-            memory_dict.pop("lc_kwargs", None)  # langchain stuff, not needed
-            memory_dict["id"] = id
-            memory_dict["score"] = float(score)
-            memory_dict["vector"] = vector
-            recalled[c].append(memory_dict)
+        recalled[c] = [m.to_dict(with_vector=True) for m in memories]
 
     return {
         "query": query,
         "vectors": {
-            "embedder": str(ccat.embedder.__class__.__name__),  # TODO: should be the config class name
+            "embedder": str(ccat.embedder.embedder.__class__.__name__),  # TODO: should be the config class name
             "collections": recalled
         }
     }
@@ -68,6 +78,8 @@ async def get_collections(request: Request) -> Dict:
 
     ccat = request.app.state.ccat
     vector_memory = ccat.memory.vectors
+    # include memories still waiting to be written
+    vector_memory.flush()
     collections = list(vector_memory.collections.keys())
 
     collections_metadata = []
@@ -84,6 +96,144 @@ async def get_collections(request: Request) -> Dict:
     }
 
 
+# GET index profile and search params of a collection
+@router.get("/collections/{collection_id}/settings/")
+async def get_collection_settings(request: Request, collection_id: str) -> Dict:
+    """Get index profile (HNSW, vectors storage, quantization) and default search params of a collection"""
+
+    ccat = request.app.state.ccat
+    vector_memory = ccat.memory.vectors
+
+    if collection_id not in vector_memory.collections:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Collection does not exist."}
+        )
+
+    return {
+        "name": collection_id,
+        "value": vector_memory.collections[collection_id].index_settings.dict(),
+        "schema": CollectionSettings.schema(),
+    }
+
+
+# PUT index profile and search params of a collection
+@router.put("/collections/{collection_id}/settings/")
+async def upsert_collection_settings(request: Request, collection_id: str, payload: CollectionSettings) -> Dict:
+    """Upsert index profile and default search params of a collection.
+
+    An existing collection is reconfigured in place: Qdrant rebuilds its index in background
+    and the collection can still be searched meanwhile.
+    """
+
+    ccat = request.app.state.ccat
+    vector_memory = ccat.memory.vectors
+
+    if collection_id not in vector_memory.collections:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Collection does not exist."}
+        )
+
+    collection = vector_memory.collections[collection_id]
+    await run_in_threadpool(collection.update_index_settings, payload)
+
+    return {
+        "name": collection_id,
+        "value": collection.index_settings.dict(),
+    }
+
+
+# GET a memory file, streamed
+@router.get("/export/")
+async def export_memories(
+        request: Request,
+        collections: List[str] = Query(default=None, description="Collections to export, all if not given."),
+        user_id: str = Query(default=None, description="Only episodic memories of this user, all if not given."),
+) -> StreamingResponse:
+    """Download memories in the file format accepted by `/rabbithole/memory/`.
+
+    The file is streamed one page of points at a time, so the collections are never loaded in memory.
+    """
+
+    ccat = request.app.state.ccat
+    vector_memory = ccat.memory.vectors
+
+    # check collections exist
+    for c in collections or []:
+        if c not in vector_memory.collections:
+            raise HTTPException(
+                status_code=400,
+                detail={"error": f"Collection {c} does not exist."}
+            )
+
+    memories = vector_memory.export_memories(
+        embedder_name=str(ccat.embedder.embedder.__class__.__name__),
+        collection_names=collections,
+        user_id=user_id
+    )
+    file_name = f"memories_{int(time.time())}.json"
+
+    return StreamingResponse(
+        memories,
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{file_name}"'}
+    )
+
+
+# GET a binary memory dump
+@router.get("/export/dump/")
+async def export_memory_dump(
+        request: Request,
+        collections: List[str] = Query(default=None, description="Collections to export, all if not given."),
+        dtype: str = Query(default="float32", description="Vectors type, 'float32' or 'float16'."),
+        user_id: str = Query(default=None, description="Only episodic memories of this user, all if not given."),
+) -> FileResponse:
+    """Download memories as a binary dump (zip with `.npy` vectors and JSONL payloads).
+
+    The dump is much smaller and faster to import than the JSON memory file, and is accepted by `/rabbithole/memory/`.
+    """
+
+    ccat = request.app.state.ccat
+    vector_memory = ccat.memory.vectors
+
+    for c in collections or []:
+        if c not in vector_memory.collections:
+            raise HTTPException(
+                status_code=400,
+                detail={"error": f"Collection {c} does not exist."}
+            )
+    if dtype not in MemoryDump.dtypes:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": f"dtype must be one of {MemoryDump.dtypes}"}
+        )
+
+    fd, path = tempfile.mkstemp(prefix="memory_dump_", suffix=".zip")
+    os.close(fd)
+    try:
+        await run_in_threadpool(
+            MemoryDump.write,
+            path,
+            vector_memory,
+            embedder_name=str(ccat.embedder.embedder.__class__.__name__),
+            collection_names=collections,
+            dtype=dtype,
+            user_id=user_id
+        )
+    except Exception:
+        os.remove(path)
+        raise
+
+    # remove the dump once sent
+    return FileResponse(
+        path,
+        media_type="application/zip",
+        filename=f"memories_{int(time.time())}.zip",
+        background=BackgroundTask(os.remove, path)
+    )
+
+
 # DELETE all collections
 @router.delete("/collections/")
 async def wipe_collections(
@@ -94,6 +244,8 @@ async def wipe_collections(
     ccat = request.app.state.ccat
     collections = list(ccat.memory.vectors.collections.keys())
     vector_memory = ccat.memory.vectors
+    # include memories still waiting to be written
+    vector_memory.flush()
 
     to_return = {}
     for c in collections:
@@ -117,6 +269,8 @@ async def wipe_single_collection(request: Request,
 
     ccat = request.app.state.ccat
     vector_memory = ccat.memory.vectors
+    # include memories still waiting to be written
+    vector_memory.flush()
 
     # check if collection exists
     collections = list(vector_memory.collections.keys())
@@ -145,12 +299,15 @@ async def wipe_single_collection(request: Request,
 async def wipe_memory_point(
         request: Request,
         collection_id: str,
-        memory_id: str
+        memory_id: str,
+        user_id: str = Query(default=None, description="Only delete the episodic memory if it belongs to this user."),
 ) -> Dict:
     """Delete a specific point in memory"""
 
     ccat = request.app.state.ccat
     vector_memory = ccat.memory.vectors
+    # include memories still waiting to be written
+    vector_memory.flush()
 
     # check if collection exists
     collections = list(vector_memory.collections.keys())
@@ -160,11 +317,18 @@ async def wipe_memory_point(
             detail={"error": "Collection does not exist."}
         )
 
-    # check if point exists
+    # check if point exists (and belongs to the user)
+    collection = vector_memory.collections[collection_id]
     points = vector_memory.vector_db.retrieve(
         collection_name=collection_id,
         ids=[memory_id],
+        with_payload=[collection.metadata_payload_key],
     )
+    tenant_filter = collection.tenant_filter(user_id) or {}
+    points = [
+        p for p in points
+        if all((p.payload.get(collection.metadata_payload_key) or {}).get(k) == v for k, v in tenant_filter.items())
+    ]
     if points == []:
         raise HTTPException(
             status_code=400,
@@ -184,14 +348,18 @@ async def wipe_memory_points_by_metadata(
         request: Request,
         collection_id: str,
         metadata: Dict = {},
+        user_id: str = Query(default=None, description="Only delete episodic memories of this user."),
 ) -> Dict:
     """Delete points in memory by filter"""
 
     ccat = request.app.state.ccat
     vector_memory = ccat.memory.vectors
+    # include memories still waiting to be written
+    vector_memory.flush()
 
     # delete points
-    vector_memory.collections[collection_id].delete_points_by_metadata_filter(metadata)
+    collection = vector_memory.collections[collection_id]
+    collection.delete_points_by_metadata_filter(collection.tenant_filter(user_id, metadata))
 
     return {
         "deleted": [] # TODO: Qdrant does not return deleted points?
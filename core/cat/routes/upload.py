@@ -1,8 +1,12 @@
+import json
+import asyncio
 import mimetypes
-import requests
-from typing import Dict
+import httpx
+from typing import Dict, List
 
-from fastapi import Body, Request, APIRouter, UploadFile, BackgroundTasks, HTTPException
+from fastapi import Body, Query, Request, APIRouter, UploadFile, HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 
 from cat.log import log
 
@@ -15,15 +19,18 @@ router = APIRouter()
 async def upload_file(
         request: Request,
         file: UploadFile,
-        background_tasks: BackgroundTasks,
         chunk_size: int = Body(
-            default=400,
-            description="Maximum length of each chunk after the document is split (in characters)",
+            default=100,
+            description="Maximum length of each chunk after the document is split "
+                        "(in embedder tokens, about 4 characters each)",
         ),
-        chunk_overlap: int = Body(default=100, description="Chunk overlap (in characters)")
+        chunk_overlap: int = Body(default=25, description="Chunk overlap (in embedder tokens)"),
+        user_id: str = Query(default="user", description="User receiving the ingestion progress on their websocket"),
 ) -> Dict:
     """Upload a file containing text (.txt, .md, .pdf, etc.). File content will be extracted and segmented into chunks.
     Chunks will be then vectorized and stored into documents memory.
+    The returned `job_id` can be used to follow the ingestion on `/rabbithole/jobs/{job_id}`,
+    progress events are pushed to the websocket of the user (`/ws/{user_id}`).
     """
 
     ccat = request.app.state.ccat
@@ -44,62 +51,42 @@ async def upload_file(
         )
 
     # upload file to long term memory, in the background
-    background_tasks.add_task(
-        ccat.rabbit_hole.ingest_file, file, chunk_size, chunk_overlap
-    )
+    #   (the upload is copied on disk in a worker thread, so other requests are not blocked)
+    job = await run_in_threadpool(ccat.rabbit_hole.scheduler.submit_file, file, chunk_size, chunk_overlap, user_id)
 
     # reply to client
     return {
         "filename": file.filename,
         "content_type": file.content_type,
         "info": "File is being ingested asynchronously",
+        "job_id": job.job_id,
     }
 
 
 @router.post("/web/")
 async def upload_url(
         request: Request,
-        background_tasks: BackgroundTasks,
         url: str = Body(
             description="URL of the website to which you want to save the content"
         ),
         chunk_size: int = Body(
-            default=400,
-            description="Maximum length of each chunk after the document is split (in characters)",
+            default=100,
+            description="Maximum length of each chunk after the document is split "
+                        "(in embedder tokens, about 4 characters each)",
         ),
-        chunk_overlap: int = Body(default=100, description="Chunk overlap (in characters)")
+        chunk_overlap: int = Body(default=25, description="Chunk overlap (in embedder tokens)"),
+        user_id: str = Query(default="user", description="User receiving the ingestion progress on their websocket"),
 ):
     """Upload a url. Website content will be extracted and segmented into chunks.
     Chunks will be then vectorized and stored into documents memory."""
-    # check that URL is valid
 
+    # Access the `ccat` object from the FastAPI application state
+    ccat = request.app.state.ccat
+
+    # check that URL is valid, without blocking the event loop
     try:
-        # Send a HEAD request to the specified URL
-        response = requests.head(
-            url,
-            headers={"User-Agent": "Magic Browser"},
-            allow_redirects=True
-        )
-        status_code = response.status_code
-
-        if status_code == 200:
-            # Access the `ccat` object from the FastAPI application state
-            ccat = request.app.state.ccat
-
-            # upload file to long term memory, in the background
-            background_tasks.add_task(
-                ccat.rabbit_hole.ingest_file, url, chunk_size, chunk_overlap
-            )
-            return {"url": url, "info": "URL is being ingested asynchronously"}
-        else:
-            raise HTTPException(
-                status_code=400,
-                detail={
-                    "error": "Invalid URL",
-                    "url": url
-                },
-            )
-    except requests.exceptions.RequestException as _e:
+        status_code = await ccat.rabbit_hole.web_fetcher.status(url)
+    except (httpx.HTTPError, httpx.InvalidURL):
         raise HTTPException(
             status_code=400,
             detail={
@@ -108,14 +95,69 @@ async def upload_url(
             },
         )
 
+    if status_code != 200:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "error": "Invalid URL",
+                "url": url
+            },
+        )
+
+    # upload file to long term memory, in the background
+    job = await run_in_threadpool(ccat.rabbit_hole.scheduler.submit_url, url, chunk_size, chunk_overlap, user_id)
+    return {"url": url, "info": "URL is being ingested asynchronously", "job_id": job.job_id}
+
+
+@router.post("/web/crawl/")
+async def upload_web_pages(
+        request: Request,
+        urls: List[str] = Body(
+            default=[],
+            description="URLs of the web pages to save"
+        ),
+        sitemap: str = Body(
+            default=None,
+            description="URL of a sitemap listing more pages to save"
+        ),
+        max_pages: int = Body(default=100, description="Maximum number of pages to save"),
+        chunk_size: int = Body(
+            default=100,
+            description="Maximum length of each chunk after the document is split "
+                        "(in embedder tokens, about 4 characters each)",
+        ),
+        chunk_overlap: int = Body(default=25, description="Chunk overlap (in embedder tokens)"),
+        user_id: str = Query(default="user", description="User receiving the ingestion progress on their websocket"),
+):
+    """Crawl a list of web pages and/or the pages of a sitemap. Pages are downloaded concurrently
+    and their content is segmented into chunks, then vectorized and stored into documents memory."""
+
+    if len(urls) == 0 and sitemap is None:
+        raise HTTPException(
+            status_code=400,
+            detail={"error": "Pass some urls or a sitemap"}
+        )
+
+    ccat = request.app.state.ccat
+    job = await run_in_threadpool(
+        ccat.rabbit_hole.scheduler.submit_crawl, urls, sitemap, max_pages, chunk_size, chunk_overlap, user_id
+    )
+
+    return {
+        "urls": urls,
+        "sitemap": sitemap,
+        "info": "Web pages are being ingested asynchronously",
+        "job_id": job.job_id
+    }
+
 
 @router.post("/memory/")
 async def upload_memory(
         request: Request,
         file: UploadFile,
-        background_tasks: BackgroundTasks
+        user_id: str = Query(default="user", description="User receiving the ingestion progress on their websocket"),
 ) -> Dict:
-    """Upload a memory json file to the cat memory"""
+    """Upload a memory json file (or a binary memory dump, zip) to the cat memory"""
 
     # access cat instance
     ccat = request.app.state.ccat
@@ -123,21 +165,22 @@ async def upload_memory(
     # Get file mime type
     content_type = mimetypes.guess_type(file.filename)[0]
     log.info(f"Uploaded {content_type} down the rabbit hole")
-    if content_type != "application/json":
+    if content_type not in ["application/json", "application/zip"]:
         raise HTTPException(
             status_code=400,
             detail={
-                "error": f"MIME type {content_type} not supported. Admitted types: 'application/json'"
+                "error": f"MIME type {content_type} not supported. Admitted types: 'application/json', 'application/zip'"
             })
 
     # Ingest memories in background and notify client
-    background_tasks.add_task(ccat.rabbit_hole.ingest_memory, file)
+    job = await run_in_threadpool(ccat.rabbit_hole.scheduler.submit_memory, file, user_id)
 
     # reply to client
     return {
         "filename": file.filename,
         "content_type": file.content_type,
-        "info": "Memory is being ingested asynchronously"
+        "info": "Memory is being ingested asynchronously",
+        "job_id": job.job_id,
     }
 
 
@@ -151,4 +194,91 @@ async def get_allowed_mimetypes(request: Request) -> Dict:
 
     return {
         "allowed": admitted_types
-    }
\ No newline at end of file
+    }
+
+@router.get("/jobs/")
+async def get_jobs(request: Request) -> Dict:
+    """List ingestion jobs, queued, running and finished"""
+
+    ccat = request.app.state.ccat
+    jobs = ccat.rabbit_hole.scheduler.list_jobs()
+
+    return {
+        "jobs": [job.info() for job in jobs]
+    }
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(request: Request, job_id: str) -> Dict:
+    """Get status and progress of an ingestion job (chunks done, chunks per second and ETA in seconds)"""
+
+    ccat = request.app.state.ccat
+    job = ccat.rabbit_hole.scheduler.get_job(job_id)
+
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail={"error": f"Job {job_id} does not exist."}
+        )
+
+    return job.info()
+
+
+# seconds without events before a keep-alive comment is sent on the event stream
+EVENTS_KEEPALIVE = 15
+
+
+@router.get("/jobs/{job_id}/events")
+async def get_job_events(request: Request, job_id: str) -> StreamingResponse:
+    """Follow an ingestion job as Server-Sent Events, until it is over. Each event is the job state, with chunks
+    parsed, embedded and stored, and latency percentiles and rate of the embedder and the vector DB"""
+
+    ccat = request.app.state.ccat
+    job = ccat.rabbit_hole.scheduler.get_job(job_id)
+
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail={"error": f"Job {job_id} does not exist."}
+        )
+
+    # subscribe before reading the job state, not to miss any event
+    notifications = ccat.notifications.subscribe(job.user_id)
+
+    async def events():
+        try:
+            is_over = job.is_over()
+            yield f"data: {json.dumps(job.info())}\n\n"
+
+            # the stream ends with the event of the finished job
+            while not is_over:
+                try:
+                    message = await asyncio.wait_for(notifications.get(), timeout=EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # the last event could have been dropped by a full queue
+                    is_over = job.is_over()
+                    yield f"data: {json.dumps(job.info())}\n\n" if is_over else ": keep-alive\n\n"
+                    continue
+                if message["type"] == "ingestion" and message["content"]["job_id"] == job_id:
+                    is_over = message["content"]["status"] in ["done", "failed", "cancelled"]
+                    yield f"data: {json.dumps(message['content'])}\n\n"
+        finally:
+            ccat.notifications.unsubscribe(job.user_id, notifications)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(request: Request, job_id: str) -> Dict:
+    """Cancel an ingestion job. Chunks already stored by a running job are kept in memory"""
+
+    ccat = request.app.state.ccat
+    job = ccat.rabbit_hole.scheduler.cancel(job_id)
+
+    if job is None:
+        raise HTTPException(
+            status_code=404,
+            detail={"error": f"Job {job_id} does not exist or is not running."}
+        )
+
+    return job.info()
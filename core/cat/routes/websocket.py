@@ -3,13 +3,9 @@ import asyncio
 
 from fastapi import APIRouter, WebSocketDisconnect, WebSocket
 from cat.log import log
-from fastapi.concurrency import run_in_threadpool
 
 router = APIRouter()
 
-# This constant sets the interval (in seconds) at which the system checks for notifications.
-QUEUE_CHECK_INTERVAL = 1  # seconds
-
 
 class ConnectionManager:
     """
@@ -57,58 +53,61 @@ class ConnectionManager:
 manager = ConnectionManager()
 
 
-async def receive_message(websocket: WebSocket, ccat: object):
+async def receive_message(websocket: WebSocket, ccat: object, user_id: str):
     """
     Continuously receive messages from the WebSocket and forward them to the `ccat` object for processing.
     """
     while True:
             # message received from specific user
             user_message = await websocket.receive_json()
+            user_message.setdefault("user_id", user_id)
 
             print("user_message",user_message)
 
             await manager.broadcast_except_me( {'error': False, 'type': 'chat', 'content': {'text': user_message["text"],'sender': 'user'}},websocket)
 
             # get response from the cat
-            cat_message = await run_in_threadpool(ccat, user_message)
+            #   (tokens are streamed to this websocket if the message asks for it)
+            cat_message = await ccat.acall(
+                user_message,
+                stream_callback=lambda msg: manager.send_personal_message(msg, websocket)
+            )
 
             # send output to specific user
             print("cat_message",cat_message)
             await manager.broadcast(cat_message)
 
 
-async def check_messages(websocket: WebSocket, ccat):
+async def send_notifications(websocket: WebSocket, notifications: asyncio.Queue):
     """
-    Periodically check if there are any new notifications from the `ccat` instance and send them to the user.
+    Send to the user the notifications pushed by the `ccat` instance (i.e. ingestion progress), as they come.
     """
     while True:
-        if ccat.ws_messages:
-            # extract from FIFO list websocket notification
-            notification = ccat.ws_messages.pop(0)
-            await manager.send_personal_message(notification, websocket)
-
-        # Sleep for the specified interval before checking for notifications again.
-        await asyncio.sleep(QUEUE_CHECK_INTERVAL)
+        notification = await notifications.get()
+        await manager.send_personal_message(notification, websocket)
 
 
 @router.websocket_route("/ws")
+@router.websocket_route("/ws/{user_id}")
 async def websocket_endpoint(websocket: WebSocket):
     """
-    Endpoint to handle incoming WebSocket connections, process messages, and check for messages.
+    Endpoint to handle incoming WebSocket connections, process messages, and send notifications.
+    Connect to `/ws/{user_id}` to get the notifications of a specific user (`/ws` is user `user`).
     """
 
     # Retrieve the `ccat` instance from the application's state.
     ccat = websocket.app.state.ccat
+    user_id = websocket.path_params.get("user_id", "user")
 
     # Add the new WebSocket connection to the manager.
     await manager.connect(websocket)
+    notifications = ccat.notifications.subscribe(user_id)
+
+    # Send notifications while processing messages.
+    notifications_task = asyncio.create_task(send_notifications(websocket, notifications))
 
     try:
-        # Process messages and check for notifications concurrently.
-        await asyncio.gather(
-            receive_message(websocket, ccat),
-            check_messages(websocket, ccat)
-        )
+        await receive_message(websocket, ccat, user_id)
     except WebSocketDisconnect:
         # Handle the event where the user disconnects their WebSocket.
         log.info("WebSocket connection closed")
@@ -123,4 +122,6 @@ async def websocket_endpoint(websocket: WebSocket):
         }, websocket)
     finally:
         # Always ensure the WebSocket is removed from the manager, regardless of how the above block exits.
+        notifications_task.cancel()
+        ccat.notifications.unsubscribe(user_id, notifications)
         manager.disconnect(websocket)
@@ -0,0 +1,257 @@
+import re
+import copy
+from functools import lru_cache
+from typing import Callable, Iterator, List, Tuple
+
+from langchain.docstore.document import Document
+
+from cat.log import log
+
+
+# a sentence (or a line) with the whitespace following it
+SENTENCE_PATTERN = re.compile(r"(?:[^.!?\n]+|[.!?]+(?!\s|$))*(?:[.!?]+|\n|$)\s*")
+# a word (or a run of symbols) with the whitespace following it
+WORD_PATTERN = re.compile(r"\S+\s*|\s+")
+# average characters per token of BPE tokenizers on english text
+CHARACTERS_PER_TOKEN = 4
+
+# break points, from the worst to the best
+WORD, LINE, SENTENCE, PARAGRAPH = range(4)
+# text up to the last end of sentence (with a whitespace)
+LAST_SENTENCE_PATTERN = re.compile(r".*[.!?]\s", re.S)
+# break points but a word, where the overlap of a chunk can start
+OVERLAP_BREAKS = (". ", "! ", "? ", "\n")
+
+
+def approximate_token_count(text: str) -> int:
+    """Token count estimate for embedders without a known tokenizer (about 4 characters per token)."""
+    return -(-len(text) // CHARACTERS_PER_TOKEN)
+
+
+@lru_cache(maxsize=8)
+def get_tiktoken_counter(model: str) -> Callable[[str], int]:
+    import tiktoken
+
+    encoding = tiktoken.encoding_for_model(model)
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+
+def get_token_counter(embedder) -> Callable[[str], int]:
+    """Function counting tokens with the tokenizer of the embedder.
+
+    OpenAI embedders are measured with tiktoken, other embedders (or tiktoken failing to load its encoding,
+    i.e. offline) fall back to `approximate_token_count`.
+    """
+    # unwrap the cached embedder
+    embedder = getattr(embedder, "embedder", embedder)
+
+    model = getattr(embedder, "model", None)
+    if type(embedder).__name__ == "OpenAIEmbeddings" and isinstance(model, str):
+        try:
+            return get_tiktoken_counter(model)
+        except Exception as e:
+            log.warning(f"Could not load tokenizer for {model}, token counts are approximate: {e}")
+
+    return approximate_token_count
+
+
+class LinearTextSplitter:
+    """Split text in overlapping chunks of at most `chunk_size` tokens, in a single pass.
+
+    Text is cut in sentences (with their trailing whitespace), each measured once; only sentences longer
+    than a chunk are cut in words. Sentences are added to the current chunk until it is full; the chunk
+    is then cut at the best break point in its second half (end of paragraph, line, sentence or word)
+    and the next chunk starts with the last `chunk_overlap` tokens of the previous one.
+    Chunks shorter than `min_chunk_size` characters are merged into the previous chunk (the next one if first)
+    when the merged chunk still fits in `chunk_size`, instead of being lost.
+
+    With a real tokenizer, it is about twice as fast as the previous `RecursiveCharacterTextSplitter`
+    measuring tokens, as every sentence is encoded once. With the approximate token count, the length of a text
+    only depends on its characters: chunks are cut from windows of `chunk_size` tokens worth of characters,
+    searching the same break points from the end of the window (`split_characters`), as fast as the previous
+    splitter (see `benchmarks/text_splitter.py`).
+
+    Attributes
+    ----------
+    chunk_size : int
+        Maximum tokens in a chunk.
+    chunk_overlap : int
+        Tokens repeated at the beginning of the next chunk.
+    length_function : Callable[[str], int]
+        Token counter (see `get_token_counter`).
+    min_chunk_size : int
+        Chunks with fewer characters are merged with a neighbour.
+    """
+
+    def __init__(self, chunk_size: int = 100, chunk_overlap: int = 25,
+                 length_function: Callable[[str], int] = approximate_token_count, min_chunk_size: int = 10):
+        if chunk_overlap >= chunk_size:
+            raise ValueError(f"Chunk overlap ({chunk_overlap}) must be smaller than chunk size ({chunk_size})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.length_function = length_function
+        self.min_chunk_size = min_chunk_size
+
+    def pieces(self, text: str) -> Iterator[Tuple[str, int, int]]:
+        """Sentences (or lines) of the text with their length (tokens) and the quality of the break after them."""
+        length_function = self.length_function
+        chunk_size = self.chunk_size
+        for sentence in SENTENCE_PATTERN.findall(text):
+            if sentence == "":
+                continue
+            length = length_function(sentence)
+
+            # sentences longer than a chunk are cut in words
+            if length > chunk_size:
+                yield from self.word_pieces(sentence)
+                continue
+
+            content = sentence.rstrip()
+            if len(content) == len(sentence):
+                # no whitespace after it, only at the end of the text
+                break_quality = SENTENCE if content[-1] in ".!?" else WORD
+            elif content == "" or "\n\n" in sentence[len(content):]:
+                break_quality = PARAGRAPH
+            elif content[-1] in ".!?":
+                break_quality = SENTENCE
+            elif "\n" in sentence[len(content):]:
+                break_quality = LINE
+            else:
+                break_quality = WORD
+
+            yield sentence, length, break_quality
+
+    def word_pieces(self, sentence: str) -> Iterator[Tuple[str, int, int]]:
+        for match in WORD_PATTERN.finditer(sentence):
+            word = match.group()
+            length = self.length_function(word)
+
+            # words longer than a chunk (i.e. encoded data) are cut by characters
+            if length > self.chunk_size:
+                step = max(len(word) * self.chunk_size // length, 1)
+                for start in range(0, len(word), step):
+                    sub_word = word[start:start + step]
+                    yield sub_word, self.length_function(sub_word), WORD
+            else:
+                yield word, length, WORD
+
+    def split_chunks(self, text: str) -> List[str]:
+        if self.length_function is approximate_token_count:
+            return self.merge_short_chunks(self.split_characters(text))
+
+        chunks = []
+        # current chunk: pieces and running token count
+        current = []
+        current_length = 0
+
+        for piece in self.pieces(text):
+            if current_length + piece[1] > self.chunk_size and len(current) > 0:
+                cut = self.best_cut(current)
+                chunks.append("".join(p[0] for p in current[:cut]))
+
+                # the next chunk starts with the tail of this one (overlap) and the pieces after the cut
+                overlap_start = cut
+                overlap_length = 0
+                while overlap_start > 0 and overlap_length + current[overlap_start - 1][1] <= self.chunk_overlap:
+                    overlap_start -= 1
+                    overlap_length += current[overlap_start][1]
+                current = current[overlap_start:]
+                current_length = sum(p[1] for p in current)
+
+                # overlap and rest could still not leave room for the new piece
+                while len(current) > 0 and current_length + piece[1] > self.chunk_size:
+                    current_length -= current.pop(0)[1]
+
+            current.append(piece)
+            current_length += piece[1]
+
+        if len(current) > 0:
+            chunks.append("".join(p[0] for p in current))
+
+        return self.merge_short_chunks([c.strip() for c in chunks])
+
+    def split_characters(self, text: str) -> List[str]:
+        """Split text measured with `approximate_token_count`, a chunk at a time.
+
+        Windows of `chunk_size` tokens worth of characters are cut at the best break point in their second half,
+        found from the end of the window; the next window starts with the last sentences (or lines)
+        of `chunk_overlap` tokens worth of characters.
+        """
+        chunk_chars = self.chunk_size * CHARACTERS_PER_TOKEN
+        overlap_chars = self.chunk_overlap * CHARACTERS_PER_TOKEN
+        find = text.find
+        last_start = len(text) - chunk_chars
+        chunks = []
+        start = 0
+        while start < last_start:
+            end = start + chunk_chars
+            cut = self.last_break(text, start + chunk_chars // 2, end) or self.last_break(text, start + 1, end) or end
+            chunks.append(text[start:cut].strip())
+
+            # first break in the overlap, found with `str.find` (a regular expression search is slower)
+            next_start = cut
+            if overlap_chars > 0:
+                lower = max(cut - overlap_chars - 1, start + 1)
+                for marker in OVERLAP_BREAKS:
+                    position = find(marker, lower, next_start)
+                    if position >= 0:
+                        next_start = position + len(marker)
+            start = next_start
+
+        chunks.append(text[start:].strip())
+        return chunks
+
+    @staticmethod
+    def last_break(text: str, lower: int, upper: int) -> int:
+        """Position after the last of the best break points between `lower` and `upper` (None if no break).
+
+        The whitespace of the break can be after `upper`, it ends up stripped.
+        """
+        position = text.rfind("\n\n", lower, upper + 2)
+        if position >= 0:
+            return position + 2
+        match = LAST_SENTENCE_PATTERN.match(text, lower, upper + 1)
+        if match is not None:
+            return match.end()
+        position = text.rfind("\n", lower, upper + 1)
+        if position < 0:
+            position = max(text.rfind(" ", lower, upper + 1), text.rfind("\t", lower, upper + 1))
+        if position >= 0:
+            return position + 1
+        return None
+
+    def best_cut(self, pieces: List[Tuple[str, int, int]]) -> int:
+        """Number of pieces to keep in the chunk: up to the best break in the second half."""
+        total = sum(p[1] for p in pieces)
+        best_cut, best_quality = len(pieces), -1
+        length = 0
+        for i, (_, piece_length, break_quality) in enumerate(pieces):
+            length += piece_length
+            if length >= total / 2 and break_quality >= best_quality:
+                best_cut, best_quality = i + 1, break_quality
+        return best_cut
+
+    def merge_short_chunks(self, chunks: List[str]) -> List[str]:
+        if len(chunks) == 0 or min(map(len, chunks)) > self.min_chunk_size:
+            return chunks
+
+        merged = []
+        for chunk in chunks:
+            if chunk == "":
+                continue
+            if len(merged) > 0 and (len(chunk) <= self.min_chunk_size or len(merged[-1]) <= self.min_chunk_size):
+                # merged only if the result still fits in a chunk
+                candidate = merged[-1] + "\n" + chunk
+                if self.length_function(candidate) <= self.chunk_size:
+                    merged[-1] = candidate
+                    continue
+            merged.append(chunk)
+        return merged
+
+    def split_documents(self, docs: List[Document]) -> List[Document]:
+        """Split documents, each chunk keeping a copy of the metadata of its document."""
+        return [
+            Document(page_content=chunk, metadata=copy.deepcopy(doc.metadata))
+            for doc in docs
+            for chunk in self.split_chunks(doc.page_content)
+        ]
@@ -1,7 +1,11 @@
 """Various utiles used from the projects."""
 
+import time
+import threading
 from datetime import timedelta
 
+from cat.log import log
+
 
 def to_camel_case(text :str ) -> str:
     """Format string to camel case.
@@ -67,3 +71,88 @@ def verbal_timedelta(td: timedelta) -> str:
         return "{} ago".format(abs_delta)
     else:
         return "{} ago".format(abs_delta)
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """Check if an exception comes from an API rate limit (HTTP 429).
+
+    Providers raise different exception classes, so the status code and the message are both inspected.
+
+    Parameters
+    ----------
+    e : Exception
+        Exception raised by an API call.
+
+    Returns
+    -------
+    bool
+        True if the API asked to slow down.
+    """
+    for status in [getattr(e, "status_code", None), getattr(e, "http_status", None),
+                   getattr(getattr(e, "response", None), "status_code", None)]:
+        if status == 429:
+            return True
+
+    description = str(e).lower()
+    return "ratelimit" in type(e).__name__.lower() or "429" in description or "rate limit" in description
+
+
+class RateLimiter:
+    """Adaptive pause between calls to a rate limited API.
+
+    Calls run at full speed until the provider answers with a rate limit error.
+    Then the call is retried after a pause that doubles at each rate limit error,
+    and halves again after each successful call.
+
+    Attributes
+    ----------
+    min_delay : float
+        Pause between calls when the API is not complaining.
+    max_delay : float
+        Longest pause between calls.
+    max_retries : int
+        Rate limit errors tolerated for a single call before giving up.
+    delay : float
+        Current pause between calls.
+
+    Examples
+    --------
+    >>> rate_limiter = RateLimiter()
+    >>> vectors = rate_limiter.call(embedder.embed_documents, texts)
+    """
+
+    def __init__(self, min_delay: float = 0., max_delay: float = 60., max_retries: int = 8):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.delay = min_delay
+        self.lock = threading.Lock()
+
+    def call(self, func, *args, **kwargs):
+        """Call `func`, waiting and retrying on rate limit errors."""
+        for attempt in range(self.max_retries + 1):
+            if self.delay > 0:
+                time.sleep(self.delay)
+
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                self.slow_down()
+                log.warning(f"Rate limit reached, retrying in {self.delay:.1f}s")
+                continue
+
+            self.speed_up()
+            return result
+
+    def slow_down(self):
+        with self.lock:
+            self.delay = min(self.max_delay, max(self.delay * 2, self.min_delay, 1.))
+
+    def speed_up(self):
+        with self.lock:
+            self.delay = self.delay / 2
+            # go back to full speed when pauses get negligible
+            if self.delay < max(self.min_delay, 0.05):
+                self.delay = self.min_delay
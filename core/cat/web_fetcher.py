@@ -0,0 +1,197 @@
+import os
+import shutil
+import asyncio
+import tempfile
+import threading
+from typing import Iterator, List, Tuple, Union
+from urllib.parse import urlparse
+from concurrent.futures import Future, as_completed
+import xml.etree.ElementTree as ElementTree
+
+import httpx
+
+from cat.log import log
+
+
+class DownloadTooLarge(Exception):
+    """Raised when a web page exceeds the maximum download size."""
+    pass
+
+
+class WebFetcher:
+    """Shared HTTP client used by the Rabbit Hole to fetch web pages.
+
+    One pooled `httpx.AsyncClient` (keep-alive, timeouts) runs in its own event loop, in a background thread.
+    Endpoints await it without blocking the server event loop, while ingestion workers (threads)
+    use the blocking wrappers. Downloads go straight to disk, up to a maximum size.
+
+    Attributes
+    ----------
+    timeout : float
+        Seconds before giving up a connection or a read. Can be set in the `.env` file with `RABBITHOLE_HTTP_TIMEOUT`.
+    max_size : int
+        Maximum bytes downloaded for a page. Can be set in the `.env` file with `RABBITHOLE_MAX_DOWNLOAD_MB`.
+    max_connections : int
+        Pages downloaded at the same time. Can be set in the `.env` file with `RABBITHOLE_CRAWL_CONCURRENCY`.
+    per_host : int
+        Pages downloaded at the same time from the same host, to be gentle with websites.
+        Can be set in the `.env` file with `RABBITHOLE_CRAWL_PER_HOST`.
+    """
+
+    user_agent = "Magic Browser"
+
+    def __init__(self, timeout: float = None, max_size: int = None, max_connections: int = None, per_host: int = None):
+        self.timeout = timeout or float(os.getenv("RABBITHOLE_HTTP_TIMEOUT", 10))
+        self.max_size = max_size or int(os.getenv("RABBITHOLE_MAX_DOWNLOAD_MB", 50)) * 1024 * 1024
+        self.max_connections = max_connections or int(os.getenv("RABBITHOLE_CRAWL_CONCURRENCY", 8))
+        self.per_host = per_host or int(os.getenv("RABBITHOLE_CRAWL_PER_HOST", 2))
+
+        # event loop and client are started at the first request
+        self.loop = None
+        self.thread = None
+        self.client = None
+        self.start_lock = threading.Lock()
+
+        # concurrency limits, only used inside the fetcher event loop
+        self.slots = None
+        self.host_slots = {}
+
+    def start(self):
+        with self.start_lock:
+            if self.loop is not None:
+                return
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self.loop.run_forever, name="web_fetcher", daemon=True)
+            self.thread.start()
+            self.client = httpx.AsyncClient(
+                headers={"User-Agent": self.user_agent},
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections),
+                follow_redirects=True,
+            )
+
+    def submit(self, coroutine) -> Future:
+        """Run a coroutine in the fetcher event loop."""
+        self.start()
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def get_host_slots(self, url: str) -> asyncio.Semaphore:
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_connections)
+        host = urlparse(url).netloc
+        if host not in self.host_slots:
+            self.host_slots[host] = asyncio.Semaphore(self.per_host)
+        return self.host_slots[host]
+
+    async def _status(self, url: str) -> int:
+        response = await self.client.head(url)
+        return response.status_code
+
+    async def status(self, url: str) -> int:
+        """Status code of a HEAD request to the URL, awaitable from any event loop."""
+        return await asyncio.wrap_future(self.submit(self._status(url)))
+
+    async def _download(self, url: str, path: str) -> str:
+        host_slots = self.get_host_slots(url)
+        async with host_slots, self.slots:
+            async with self.client.stream("GET", url) as response:
+                response.raise_for_status()
+
+                content_length = response.headers.get("content-length")
+                if content_length is not None and int(content_length) > self.max_size:
+                    raise DownloadTooLarge(f"{url} is bigger than {self.max_size} bytes")
+
+                size = 0
+                with open(path, "wb") as f:
+                    async for data in response.aiter_bytes():
+                        size += len(data)
+                        if size > self.max_size:
+                            raise DownloadTooLarge(f"{url} is bigger than {self.max_size} bytes")
+                        f.write(data)
+
+                return response.headers.get("content-type", "text/html").split(";")[0].strip()
+
+    def download(self, url: str, path: str) -> str:
+        """Save a web page in a file, returns its mime type."""
+        return self.submit(self._download(url, path)).result()
+
+    async def _try_download(self, url: str, path: str) -> Union[str, Exception]:
+        try:
+            return await self._download(url, path)
+        except Exception as e:
+            return e
+
+    def download_many(self, urls: List[str]) -> Iterator[Tuple[str, str, Union[str, Exception]]]:
+        """Download web pages concurrently, yielding them as they are ready.
+
+        Yields
+        ------
+        url : str
+            URL of the page.
+        path : str
+            Temporary file with the content, removed at the next iteration.
+        result : str, Exception
+            Mime type of the page, or the error preventing the download.
+        """
+        folder = tempfile.mkdtemp(prefix="rabbithole_crawl_")
+        futures = {}
+        try:
+            for i, url in enumerate(urls):
+                path = os.path.join(folder, str(i))
+                futures[self.submit(self._try_download(url, path))] = (url, path)
+
+            for future in as_completed(futures):
+                url, path = futures[future]
+                yield url, path, future.result()
+                if os.path.exists(path):
+                    os.remove(path)
+        finally:
+            # stop pending downloads if the consumer gives up (i.e. job cancelled)
+            for future in futures:
+                future.cancel()
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def sitemap_urls(self, sitemap_url: str, max_pages: int = 100) -> List[str]:
+        """Page URLs listed in a sitemap (sitemap indexes are followed), at most `max_pages`."""
+        urls = []
+        sitemaps = [sitemap_url]
+        while len(sitemaps) > 0 and len(urls) < max_pages:
+            fd, path = tempfile.mkstemp(prefix="rabbithole_sitemap_")
+            os.close(fd)
+            try:
+                self.download(sitemaps.pop(0), path)
+
+                # the sitemap is parsed incrementally, it may be big
+                is_index = None
+                for event, element in ElementTree.iterparse(path, events=("start", "end")):
+                    if is_index is None:
+                        is_index = element.tag.endswith("sitemapindex")
+                    if event == "end" and element.tag.split("}")[-1] == "loc" and element.text:
+                        if is_index:
+                            sitemaps.append(element.text.strip())
+                        elif len(urls) < max_pages:
+                            urls.append(element.text.strip())
+                        element.clear()
+            except Exception as e:
+                log.warning(f"Could not read sitemap: {e}")
+            finally:
+                os.remove(path)
+
+        return urls
+
+    def close(self):
+        """Close pooled connections and stop the event loop."""
+        if self.loop is None:
+            return
+        self.submit(self.client.aclose()).result(timeout=self.timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=self.timeout)
+        self.loop.close()
+
+        # a new loop is started at the next request
+        with self.start_lock:
+            self.loop = None
+            self.thread = None
+            self.client = None
+            self.slots = None
+            self.host_slots = {}
@@ -27,7 +27,8 @@ def clean_up_mocks():
         "tests/mocks/metadata-test.json",
         "tests/mocks/mock_plugin.zip",
         "tests/mocks/mock_plugin_folder/mock_plugin",
-        "tests/mocks/empty_folder"
+        "tests/mocks/empty_folder",
+        "tests/mocks/rabbithole_jobs"
     ]
     for tbr in to_be_removed:
         if os.path.exists(tbr):
@@ -61,6 +62,9 @@ def app(monkeypatch) -> Generator[FastAPI, Any, None]:
         return "tests/mocks/metadata-test.json"
     monkeypatch.setattr(Database, "get_file_name", mock_get_file_name)
 
+    # Uploads waiting to be ingested go in the mocks folder
+    monkeypatch.setenv("RABBITHOLE_JOBS_FOLDER", "tests/mocks/rabbithole_jobs/")
+
     # clean up service files and mocks
     clean_up_mocks()
     Database._instance = None
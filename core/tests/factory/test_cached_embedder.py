@@ -0,0 +1,63 @@
+import time
+
+from cat.factory.custom_embedder import DumbEmbedder
+from cat.factory.cached_embedder import CachedEmbedder
+
+
+def test_cached_embedder_hits():
+
+    embedder = CachedEmbedder(DumbEmbedder(), max_size=10, ttl=60)
+
+    v1 = embedder.embed_query("Red Queen")
+    # same text (whitespace apart) is not embedded again
+    v2 = embedder.embed_query("  Red   Queen ")
+    v3 = embedder.embed_documents(["Red Queen", "White Rabbit"])
+    v4 = embedder.embed_documents(["Red Queen"])
+
+    assert v1 == v2 == v3[0] == v4[0]
+    info = embedder.cache_info()
+    assert info["hits"] == 2
+    assert info["misses"] == 3
+    assert info["size"] == 3
+
+
+class AsymmetricEmbedder(DumbEmbedder):
+    # queries are embedded with an instruction, as some models do
+
+    def embed_query(self, text):
+        return super().embed_query("query: " + text)
+
+
+def test_cached_embedder_keeps_queries_and_documents_apart():
+
+    embedder = CachedEmbedder(AsymmetricEmbedder(), max_size=10, ttl=60)
+
+    query_vector = embedder.embed_query("Red Queen")
+    document_vector = embedder.embed_documents(["Red Queen"])[0]
+
+    assert query_vector != document_vector
+    assert embedder.embed_query("Red Queen") == query_vector
+    assert embedder.embed_documents(["Red Queen"])[0] == document_vector
+
+
+def test_cached_embedder_eviction():
+
+    embedder = CachedEmbedder(DumbEmbedder(), max_size=2, ttl=60)
+
+    embedder.embed_documents(["a cat", "a hatter", "a rabbit"])
+    assert embedder.cache_info()["size"] == 2
+
+    # oldest text was evicted
+    embedder.embed_documents(["a cat"])
+    assert embedder.cache_info()["hits"] == 0
+
+
+def test_cached_embedder_ttl():
+
+    embedder = CachedEmbedder(DumbEmbedder(), max_size=10, ttl=0.01)
+
+    embedder.embed_query("Red Queen")
+    time.sleep(0.02)
+    embedder.embed_query("Red Queen")
+    assert embedder.cache_info()["hits"] == 0
+    assert embedder.cache_info()["misses"] == 2
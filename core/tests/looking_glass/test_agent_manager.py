@@ -0,0 +1,77 @@
+
+def test_memory_chain_is_reused(client):
+
+    from cat.main import cheshire_cat_api
+    agent_manager = cheshire_cat_api.state.ccat.agent_manager
+
+    agent_input = {"input": "meow", "chat_history": ""}
+    chain = agent_manager.get_memory_chain(agent_input, "Prefix", "{chat_history} {input}")
+
+    # same prompt, same chain
+    assert agent_manager.get_memory_chain(agent_input, "Prefix", "{chat_history} {input}") is chain
+    # different prompt, different chain
+    assert agent_manager.get_memory_chain(agent_input, "Other prefix", "{input}") is not chain
+
+    # cache is emptied when hooks and tools are reloaded
+    cheshire_cat_api.state.ccat.mad_hatter.sync_hooks_and_tools()
+    assert agent_manager.get_memory_chain(agent_input, "Prefix", "{chat_history} {input}") is not chain
+
+
+def test_tool_routing(client, monkeypatch):
+
+    from cat.main import cheshire_cat_api
+    from cat.looking_glass.stray_cat import StrayCat
+    from cat.memory.vector_memory import MemoryHit
+
+    ccat = cheshire_cat_api.state.ccat
+    agent_manager = ccat.agent_manager
+    tools = ccat.mad_hatter.tools
+
+    def route(score):
+        stray = StrayCat(ccat, "user", {
+            "procedural_memories": [MemoryHit("", {"name": "get_the_time"}, score, id="id")]
+        })
+        return agent_manager.route_tools(stray, tools)
+
+    # by default every recalled tool goes to the tool agent
+    mode, routed_tools = route(0.75)
+    assert mode == "tool_agent"
+    assert [t.name for t in routed_tools] == ["get_the_time"]
+
+    # plugins can ask for a minimum score
+    execute_hook = ccat.mad_hatter.execute_hook
+
+    def strict_routing(hook_name, *args):
+        if hook_name == "agent_tool_routing":
+            return {**args[0], "threshold": 0.8}
+        return execute_hook(hook_name, *args)
+
+    monkeypatch.setattr(ccat.mad_hatter, "execute_hook", strict_routing)
+
+    # relevant tool goes to the tool agent
+    _, routed_tools = route(0.9)
+    assert [t.name for t in routed_tools] == ["get_the_time"]
+
+    # weak match skips the tool agent
+    _, routed_tools = route(0.75)
+    assert routed_tools == []
+
+
+def test_single_pass_action_parsing(client):
+
+    from cat.main import cheshire_cat_api
+    ccat = cheshire_cat_api.state.ccat
+    agent_manager = ccat.agent_manager
+    tools = ccat.mad_hatter.tools
+
+    tool, tool_input = agent_manager.parse_single_pass_action("Action: get_the_time\nAction Input: now", tools)
+    assert tool.name == "get_the_time"
+    assert tool_input == "now"
+
+    # direct answers and unknown tools are not actions
+    assert agent_manager.parse_single_pass_action("It is late", tools) is None
+    assert agent_manager.parse_single_pass_action("Action: fly\nAction Input: now", tools) is None
+
+    # tools are listed in the prompt, escaped for the template
+    prefix = agent_manager.get_single_pass_prefix("Prefix", tools)
+    assert "get_the_time" in prefix
@@ -0,0 +1,91 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from cat.looking_glass.stray_cat import StrayCat, current_stray
+from cat.mad_hatter.decorators import tool
+
+
+def test_stray_cat_delegates_to_cat(client):
+
+    ccat = client.app.state.ccat
+    working_memory = ccat.working_memory_list.get_working_memory("Alice")
+    stray = StrayCat(ccat, "Alice", working_memory)
+
+    assert stray.user_id == "Alice"
+    assert stray.working_memory is working_memory
+    assert stray.mad_hatter is ccat.mad_hatter
+    assert stray.memory is ccat.memory
+
+
+def test_concurrent_users_keep_their_context(client):
+
+    ccat = client.app.state.ccat
+    users = ["Alice", "Bob", "Caterpillar"]
+    messages = [{"text": f"I am {u}", "user_id": u} for u in users for _ in range(2)]
+
+    with ThreadPoolExecutor(max_workers=len(messages)) as executor:
+        replies = list(executor.map(ccat, messages))
+
+    assert all(r["type"] != "error" for r in replies)
+
+    # each user history only contains its own messages
+    for u in users:
+        history = ccat.working_memory_list.get_working_memory(u)["history"]
+        human_turns = [turn["message"] for turn in history if turn["who"] == "Human"]
+        assert human_turns == [f"I am {u}"] * 2
+
+    # no session leaks outside the request
+    assert current_stray.get() is None
+    # nor locks of users with no message in progress
+    assert ccat.user_locks == {}
+
+
+def test_async_concurrent_users_keep_their_context(client):
+
+    ccat = client.app.state.ccat
+    users = ["Alice", "Bob"]
+    messages = [{"text": f"I am {u}", "user_id": u} for u in users for _ in range(2)]
+
+    async def chat():
+        return await asyncio.gather(*[ccat.acall(m) for m in messages])
+
+    replies = asyncio.run(chat())
+
+    assert all(r["type"] != "error" for r in replies)
+    for u in users:
+        history = ccat.working_memory_list.get_working_memory(u)["history"]
+        human_turns = [turn["message"] for turn in history if turn["who"] == "Human"]
+        assert human_turns == [f"I am {u}"] * 2
+    assert ccat.user_async_locks == {}
+
+
+def test_tool_notifications_reach_only_the_user(client):
+
+    ccat = client.app.state.ccat
+
+    @tool
+    def notify(topic, cat):
+        """Notify the user about a topic."""
+        cat.send_ws_message(f"Working on {topic}")
+        return topic
+
+    notify.augment_tool(ccat)
+
+    with client.websocket_connect("/ws/Alice") as alice, client.websocket_connect("/ws/Bob") as bob:
+        while set(ccat.notifications.subscribers) != {"Alice", "Bob"}:
+            time.sleep(0.01)
+
+        # the tool runs while serving a message of Alice
+        token = current_stray.set(StrayCat(ccat, "Alice", ccat.working_memory_list.get_working_memory("Alice")))
+        try:
+            notify.run("tea")
+        finally:
+            current_stray.reset(token)
+
+        # messages without a user still go to everybody
+        ccat.send_ws_message("Hello everybody")
+
+        assert alice.receive_json() == {"type": "notification", "content": "Working on tea"}
+        assert alice.receive_json()["content"] == "Hello everybody"
+        assert bob.receive_json()["content"] == "Hello everybody"
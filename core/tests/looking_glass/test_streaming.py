@@ -0,0 +1,61 @@
+import asyncio
+from typing import Any, List, Optional
+
+from langchain.llms.base import LLM
+
+
+class FakeStreamingLLM(LLM):
+    streaming: bool = False
+
+    @property
+    def _llm_type(self):
+        return "fake-streaming"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None) -> str:
+        return "Tea party time"
+
+    async def _acall(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None) -> str:
+        answer = self._call(prompt)
+        if self.streaming:
+            for token in answer.split(" "):
+                await run_manager.on_llm_new_token(token + " ")
+        return answer
+
+
+def chat(ccat, message):
+
+    sent = []
+
+    async def stream_callback(msg):
+        sent.append(msg)
+
+    reply = asyncio.run(ccat.acall(message, stream_callback=stream_callback))
+    return reply, sent
+
+
+def test_stream_tokens(client):
+
+    ccat = client.app.state.ccat
+    ccat._llm = FakeStreamingLLM()
+
+    reply, sent = chat(ccat, {"text": "Is it tea time?", "stream": True})
+
+    # tokens arrive before the final message
+    assert [m["type"] for m in sent] == ["chat_token"] * 3
+    assert "".join(m["content"] for m in sent).strip() == "Tea party time"
+    assert reply["type"] == "chat"
+    assert "why" in reply
+
+    # shared LLM is not switched to streaming
+    assert ccat._llm.streaming is False
+
+
+def test_no_stream_if_not_requested(client):
+
+    ccat = client.app.state.ccat
+    ccat._llm = FakeStreamingLLM()
+
+    reply, sent = chat(ccat, {"text": "Is it tea time?"})
+
+    assert sent == []
+    assert reply["type"] == "chat"
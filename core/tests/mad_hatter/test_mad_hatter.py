@@ -142,3 +142,21 @@ def test_plugin_uninstall(mad_hatter: MadHatter, plugin_is_flat):
     active_plugins = mad_hatter.load_active_plugins_from_db()
     assert len(active_plugins) == 1
     assert active_plugins[0] == "core_plugin"
+
+
+def test_tools_index_matches_vector_db(mad_hatter: MadHatter):
+
+    procedural = mad_hatter.ccat.memory.vectors.procedural
+    embedding = mad_hatter.ccat.embedder.embed_query("what time is it")
+
+    from_index = mad_hatter.recall_tools(embedding, k=3, threshold=None)
+    from_db = procedural.recall_memories_from_embedding(embedding, k=3, threshold=None)
+
+    assert [m[3] for m in from_index] == [m[3] for m in from_db]
+    assert from_index[0][0].page_content == from_db[0][0].page_content
+    assert abs(from_index[0][1] - from_db[0][1]) < 1e-3
+
+    # threshold over any similarity
+    assert mad_hatter.recall_tools(embedding, k=3, threshold=1.1) == []
+    # metadata filters are left to the vector DB
+    assert mad_hatter.recall_tools(embedding, metadata={"source": "tool"}) is None
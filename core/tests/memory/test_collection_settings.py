@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+from qdrant_client.http.models import BinaryQuantization, Disabled
+
+from cat.memory.collection_settings import CollectionSettings
+
+
+def collection_info(settings):
+    """Collection info as returned by Qdrant for a collection created with the settings."""
+    return SimpleNamespace(config=SimpleNamespace(
+        hnsw_config=SimpleNamespace(
+            m=settings.hnsw_m, ef_construct=settings.hnsw_ef_construct, payload_m=settings.hnsw_payload_m
+        ),
+        params=SimpleNamespace(vectors=SimpleNamespace(on_disk=settings.on_disk or None)),
+        quantization_config=settings.quantization_config(),
+    ))
+
+
+def test_index_profile():
+
+    settings = CollectionSettings(hnsw_m=32, on_disk=True, quantization="binary", always_ram=True)
+    assert settings.vectors_config(128).on_disk
+    assert settings.hnsw_config().m == 32
+    assert settings.quantization_config() == BinaryQuantization(binary={"always_ram": True})
+
+    # without quantization, updates disable it in the vector DB
+    assert CollectionSettings(quantization="none").update_params()["quantization_config"] == Disabled.DISABLED
+
+
+def test_profile_changes_are_detected():
+
+    current = CollectionSettings()
+    info = collection_info(current)
+    assert current.matches(info)
+
+    assert not CollectionSettings(hnsw_ef_construct=200).matches(info)
+    assert not CollectionSettings(on_disk=True).matches(info)
+    assert not CollectionSettings(quantile=0.99).matches(info)
+
+    # search params do not need the index to change
+    assert CollectionSettings(hnsw_ef=128, exact=True).matches(info)
+
+
+def test_partitioned_profile():
+
+    settings = CollectionSettings(hnsw_m=32)
+    partitioned = settings.partitioned()
+
+    # no global graph, a graph for each user
+    assert partitioned.hnsw_config().m == 0
+    assert partitioned.hnsw_config().payload_m == 32
+    assert not partitioned.matches(collection_info(settings))
+    assert partitioned.matches(collection_info(partitioned))
+
+
+def test_search_params_overrides():
+
+    settings = CollectionSettings(hnsw_ef=64, oversampling=2.0)
+
+    params = settings.search_params()
+    assert params.hnsw_ef == 64
+    assert params.quantization.oversampling == 2.0
+    assert params.quantization.rescore
+
+    params = settings.search_params({"exact": True, "rescore": False})
+    assert params.exact and params.hnsw_ef == 64
+    assert not params.quantization.rescore
+
+    assert CollectionSettings(quantization="none").search_params().quantization is None
+
+    with pytest.raises(ValueError):
+        settings.search_params({"ef": 10})
@@ -0,0 +1,129 @@
+import time
+import threading
+
+import pytest
+
+from cat.db import crud
+from cat.memory.memory_retention import MemoryRetention
+
+
+def get_episodic(client):
+    from cat.main import cheshire_cat_api
+    ccat = cheshire_cat_api.state.ccat
+    return ccat.memory.vectors.episodic, len(ccat.embedder.embed_query("Red Queen"))
+
+
+def one_hot(size, i, noise=0.0):
+    vector = [0.0] * size
+    vector[i] = 1.0
+    vector[size - 1] = noise
+    return vector
+
+
+def get_contents(episodic, user_id):
+    return sorted(p.payload["page_content"] for p in episodic.iter_points(metadata={"source": user_id}))
+
+
+def test_retention_disabled_by_default(client):
+
+    episodic, _ = get_episodic(client)
+    retention = MemoryRetention(episodic)
+    assert not retention.enabled
+
+    retention.start()
+    assert retention.thread is None
+
+
+def test_expired_memories_are_deleted(client):
+
+    episodic, size = get_episodic(client)
+    now = time.time()
+    episodic.add_points(
+        ["old", "recent"],
+        [{"source": "A", "when": now - 3600}, {"source": "B", "when": now}],
+        [one_hot(size, 0), one_hot(size, 1)]
+    )
+
+    retention = MemoryRetention(episodic, max_age=60, batch_size=1, pause=0)
+    assert retention.compact() == {"expired": 1, "duplicates": 0, "over_limit": 0}
+    assert get_contents(episodic, "A") == []
+    assert get_contents(episodic, "B") == ["recent"]
+
+
+def test_only_recent_memories_of_each_user_are_kept(client):
+
+    episodic, size = get_episodic(client)
+    now = time.time()
+    texts = [f"memory {i}" for i in range(5)]
+    episodic.add_points(
+        texts + ["other user"],
+        [{"source": "A", "when": now - 100 + i} for i in range(5)] + [{"source": "B", "when": now - 100}],
+        [one_hot(size, i) for i in range(6)]
+    )
+
+    retention = MemoryRetention(episodic, max_points_per_user=2, batch_size=2, pause=0, settle=0)
+    assert retention.compact() == {"expired": 0, "duplicates": 0, "over_limit": 3}
+    assert get_contents(episodic, "A") == ["memory 3", "memory 4"]
+    assert get_contents(episodic, "B") == ["other user"]
+
+
+# duplicates in different pages are found too
+@pytest.mark.parametrize("batch_size", [256, 1])
+def test_near_duplicates_are_collapsed(client, batch_size):
+
+    episodic, size = get_episodic(client)
+    now = time.time()
+    episodic.add_points(
+        ["hello", "hello!", "hello again", "goodbye", "hello"],
+        [{"source": "A", "when": now - 100 + i} for i in range(4)] + [{"source": "B", "when": now - 100}],
+        [one_hot(size, 0), one_hot(size, 0, noise=0.2), one_hot(size, 0, noise=0.1), one_hot(size, 1),
+         one_hot(size, 0)]
+    )
+
+    # the most recent of the near duplicates is kept, memories of other users are not compared
+    retention = MemoryRetention(episodic, duplicate_threshold=0.95, batch_size=batch_size, pause=0, settle=0)
+    assert retention.compact() == {"expired": 0, "duplicates": 2, "over_limit": 0}
+    assert get_contents(episodic, "A") == ["goodbye", "hello again"]
+    assert get_contents(episodic, "B") == ["hello"]
+
+
+def test_compaction_is_incremental(client):
+
+    episodic, size = get_episodic(client)
+    retention = MemoryRetention(episodic, duplicate_threshold=0.95, batch_size=1, pause=0, settle=0)
+
+    now = time.time()
+    episodic.add_points(["hello", "hello"], [{"source": "A", "when": now - 100}] * 2, [one_hot(size, 0)] * 2)
+    assert retention.compact()["duplicates"] == 1
+    assert retention.checkpoint >= now
+
+    # memories before the checkpoint are not read again
+    episodic.add_points(["goodbye", "goodbye"], [{"source": "A", "when": now - 50}] * 2, [one_hot(size, 1)] * 2)
+    assert retention.compact()["duplicates"] == 0
+
+    # new memories are compared with the older ones
+    episodic.add_points(["hello!"], [{"source": "A", "when": time.time()}], [one_hot(size, 0, noise=0.1)])
+    assert retention.compact()["duplicates"] == 1
+    assert get_contents(episodic, "A") == ["goodbye", "goodbye", "hello!"]
+
+
+def test_checkpoint_is_thread_safe(client):
+
+    episodic, _ = get_episodic(client)
+    retentions = [MemoryRetention(episodic) for _ in range(8)]
+
+    # the retention thread and requests write the settings DB at the same time
+    def save(retention, i):
+        for j in range(20):
+            retention.checkpoint = i * 100 + j
+            assert retention.checkpoint is not None
+
+    threads = [threading.Thread(target=save, args=(r, i)) for i, r in enumerate(retentions)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # one record, holding one of the saved checkpoints
+    assert len(crud.get_settings(retentions[0].checkpoint_name)) == 1
+    assert retentions[0].checkpoint % 100 == 19
@@ -0,0 +1,73 @@
+from cat.memory.memory_writer import MemoryWriter
+
+
+def get_episodic_count(episodic):
+    return episodic.client.count(collection_name=episodic.collection_name).count
+
+
+def test_writer_batches_and_flushes(client):
+
+    from cat.main import cheshire_cat_api
+    ccat = cheshire_cat_api.state.ccat
+    episodic = ccat.memory.vectors.episodic
+    vector = ccat.embedder.embed_query("Red Queen")
+
+    # long interval, only size and flush trigger a write
+    writer = MemoryWriter(episodic, batch_size=100, interval=60)
+    writer.add("Red Queen", {"source": "user", "when": 0}, vector)
+    writer.add("White Rabbit", {"source": "user", "when": 0}, vector)
+    assert get_episodic_count(episodic) == 0
+
+    writer.flush()
+    assert get_episodic_count(episodic) == 2
+
+    hits = episodic.recall_memories_from_embedding(vector, k=2)
+    assert {h.page_content for h in hits} == {"Red Queen", "White Rabbit"}
+    assert hits[0].metadata["source"] == "user"
+
+    # pending points are written on close
+    writer.add("Cheshire Cat", {"source": "user", "when": 0}, vector)
+    writer.close()
+    assert get_episodic_count(episodic) == 3
+
+
+def test_writer_without_batching(client):
+
+    from cat.main import cheshire_cat_api
+    ccat = cheshire_cat_api.state.ccat
+    episodic = ccat.memory.vectors.episodic
+
+    writer = MemoryWriter(episodic, batch_size=0)
+    writer.add("Red Queen", {"source": "user", "when": 0}, ccat.embedder.embed_query("Red Queen"))
+    assert get_episodic_count(episodic) == 1
+
+
+def test_writer_retries_failed_points(client, monkeypatch):
+
+    from cat.main import cheshire_cat_api
+    ccat = cheshire_cat_api.state.ccat
+    episodic = ccat.memory.vectors.episodic
+    vector = ccat.embedder.embed_query("Red Queen")
+
+    writer = MemoryWriter(episodic, batch_size=100, interval=60, max_pending=2)
+    upsert = episodic.client.upsert
+
+    def failing_upsert(*args, **kwargs):
+        raise ConnectionError("Vector DB is down")
+
+    # points are kept while the vector DB is down (up to `max_pending`, the oldest are dropped)
+    monkeypatch.setattr(episodic.client, "upsert", failing_upsert)
+    writer.add("Red Queen", {"source": "user", "when": 0}, vector)
+    writer.add("White Rabbit", {"source": "user", "when": 0}, vector)
+    writer.flush()
+    writer.add("Cheshire Cat", {"source": "user", "when": 0}, vector)
+    writer.flush()
+    assert len(writer.pending) == 2
+
+    # and stored at the next flush
+    monkeypatch.setattr(episodic.client, "upsert", upsert)
+    writer.flush()
+    assert writer.pending == []
+    contents = {p.payload["page_content"] for p in episodic.iter_points(with_vectors=False)}
+    assert contents == {"White Rabbit", "Cheshire Cat"}
+    writer.close()
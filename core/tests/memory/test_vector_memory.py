@@ -0,0 +1,148 @@
+import time
+
+import pytest
+
+from langchain.docstore.document import Document
+
+from cat.memory.vector_memory import MemoryHit
+
+
+def test_memory_hit_tuple_compatibility():
+
+    hit = MemoryHit("Red Queen", {"source": "user"}, 0.9, id="point_id")
+
+    # old (document, score, vector, id) interface
+    document, score, vector, id = hit
+    assert isinstance(document, Document)
+    assert document.page_content == "Red Queen"
+    assert document.metadata == {"source": "user"}
+    assert score == hit[1] == 0.9
+    assert vector is None
+    assert id == hit[3] == "point_id"
+
+    assert hit.to_dict() == {
+        "page_content": "Red Queen",
+        "metadata": {"source": "user"},
+        "score": 0.9,
+        "id": "point_id",
+    }
+
+
+def test_recall_without_vectors(client):
+
+    from cat.main import cheshire_cat_api
+    procedural = cheshire_cat_api.state.ccat.memory.vectors.procedural
+    embedding = cheshire_cat_api.state.ccat.embedder.embed_query("what time is it")
+
+    hits = procedural.recall_memories_from_embedding(embedding, k=1)
+    assert len(hits) == 1
+    assert hits[0].vector is None
+    assert "get_the_time" in hits[0].page_content
+
+    hits = procedural.recall_memories_from_embedding(embedding, k=1, with_vectors=True, payload_fields=["metadata"])
+    assert len(hits[0].vector) > 0
+    assert hits[0].page_content is None
+    assert hits[0].metadata["name"] == "get_the_time"
+
+
+def test_iter_points_follows_scroll_offset(client):
+
+    from cat.main import cheshire_cat_api
+    declarative = cheshire_cat_api.state.ccat.memory.vectors.declarative
+
+    texts = [f"memory {i}" for i in range(7)]
+    vectors = cheshire_cat_api.state.ccat.embedder.embed_documents(texts)
+    ids = declarative.add_points(texts, [{"source": "test"}] * 7, vectors)
+
+    pages = list(declarative.scroll_pages(page_size=3))
+    assert [len(p) for p in pages] == [3, 3, 1]
+    assert {p.id for p in declarative.iter_points(page_size=3)} == set(ids)
+    assert len(declarative.get_all_points()) == 7
+
+
+def test_recall_time_window(client):
+
+    from cat.main import cheshire_cat_api
+    episodic = cheshire_cat_api.state.ccat.memory.vectors.episodic
+
+    now = time.time()
+    texts = ["I met the White Rabbit", "I met the Mad Hatter", "I met the Dormouse"]
+    metadatas = [
+        {"source": "alice", "when": now - 3600},
+        {"source": "alice", "when": now - 10},
+        {"source": "bill", "when": now - 10},
+    ]
+    vectors = cheshire_cat_api.state.ccat.embedder.embed_documents(texts)
+    episodic.add_points(texts, metadatas, vectors)
+
+    embedding = cheshire_cat_api.state.ccat.embedder.embed_query("Who did I meet?")
+    hits = episodic.recall_memories_from_embedding(embedding, metadata={"source": "alice"}, k=10)
+    assert {h.page_content for h in hits} == set(texts[:2])
+
+    # only the last minute, still filtered by user
+    hits = episodic.recall_memories_from_embedding(embedding, metadata={"source": "alice"}, k=10, time_window=60)
+    assert [h.page_content for h in hits] == ["I met the Mad Hatter"]
+
+    hits = episodic.recall_memories_from_embedding(embedding, k=10, time_window=60)
+    assert {h.page_content for h in hits} == set(texts[1:])
+
+
+@pytest.mark.parametrize("remote", [False, True])
+def test_recall_configs_are_applied_to_their_collection(client, monkeypatch, remote):
+
+    from cat.main import cheshire_cat_api
+    from cat.memory.vector_memory import VectorMemory
+    ccat = cheshire_cat_api.state.ccat
+    vectors = ccat.memory.vectors
+
+    # searches on the collections are sent from a thread pool with a remote vector DB
+    monkeypatch.setattr(VectorMemory, "db_is_remote", lambda self: remote)
+
+    size = len(ccat.embedder.embed_query("Red Queen"))
+    query = [1.0] + [0.0] * (size - 1)
+    near = [1.0] + [0.0] * (size - 2) + [0.2]
+    vectors.episodic.add_points(["hello", "hello again", "hello!"], [{"source": "user"}] * 3, [query, query, near])
+    vectors.declarative.add_points(["page", "page again", "similar page"], [{"source": "book"}] * 3, [query, query, near])
+
+    # swapped configs would recall 2 episodic memories and 1 declarative memory
+    recall_configs = {
+        "episodic": {"embedding": query, "k": 1, "threshold": 0.5, "metadata": {"source": "user"}},
+        "declarative": {"embedding": query, "k": 3, "threshold": 0.99, "metadata": None},
+        # the tool is not similar to the query
+        "procedural": {"embedding": query, "k": 3, "threshold": 0.5, "metadata": None},
+    }
+    memories = ccat.recall_memories_from_embeddings(recall_configs)
+
+    assert len(memories["episodic"]) == 1
+    assert memories["episodic"][0].page_content in ["hello", "hello again"]
+    assert sorted(m.page_content for m in memories["declarative"]) == ["page", "page again"]
+    assert memories["procedural"] == []
+
+
+def test_recall_configs_come_from_their_hook(client, monkeypatch):
+
+    from cat.main import cheshire_cat_api
+    ccat = cheshire_cat_api.state.ccat
+
+    # each hook sets its own k
+    hook_k = {
+        "before_cat_recalls_episodic_memories": 1,
+        "before_cat_recalls_declarative_memories": 2,
+        "before_cat_recalls_procedural_memories": 3,
+    }
+    execute_hook = ccat.mad_hatter.execute_hook
+
+    def set_k(hook_name, *args):
+        if hook_name in hook_k:
+            return {**args[0], "k": hook_k[hook_name]}
+        return execute_hook(hook_name, *args)
+
+    monkeypatch.setattr(ccat.mad_hatter, "execute_hook", set_k)
+
+    class Stray:
+        user_id = "user"
+
+    recall_configs = ccat.get_recall_configs(Stray(), [1.0, 0.0])
+    assert {name: config["k"] for name, config in recall_configs.items()} == \
+        {"episodic": 1, "declarative": 2, "procedural": 3}
+    assert recall_configs["episodic"]["metadata"] == {"source": "user"}
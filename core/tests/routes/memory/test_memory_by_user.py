@@ -1,3 +1,8 @@
+import json
+
+import pytest
+
+from cat.main import cheshire_cat_api
 
 from tests.utils import send_websocket_message
 
@@ -43,3 +48,43 @@ def test_episodic_memory_by_user(client):
         assert len(episodic_memories) == 1
         assert episodic_memories[0]["metadata"]["source"] == "A"
 
+
+@pytest.fixture
+def partitioned(monkeypatch):
+    monkeypatch.setenv("EPISODIC_TENANCY", "partitioned")
+
+
+def get_episodic_memories(client, user_id):
+    response = client.get("/memory/recall/", params={"text": "I am user", "user_id": user_id})
+    assert response.status_code == 200
+    return response.json()["vectors"]["collections"]["episodic"]
+
+
+def test_episodic_memory_partitioned_by_user(partitioned, client):
+
+    vector_memory = cheshire_cat_api.state.ccat.memory.vectors
+    assert vector_memory.tenancy == "partitioned"
+    assert vector_memory.episodic.index_settings.hnsw_m == 0
+    assert vector_memory.declarative.index_settings.hnsw_m == 16
+
+    for user_id in ["A", "B"]:
+        send_websocket_message({"text": f"I am user {user_id}", "user_id": user_id}, client)
+
+    # recall only visits the memories of the user
+    episodic_memories = get_episodic_memories(client, "A")
+    assert [m["metadata"]["source"] for m in episodic_memories] == ["A"]
+
+    # export of a single user
+    response = client.get("/memory/export/", params={"user_id": "A"})
+    exported = json.loads(response.content)["collections"]["episodic"]
+    assert [m["metadata"]["source"] for m in exported] == ["A"]
+
+    # users cannot delete memories of other users
+    memory_id = episodic_memories[0]["id"]
+    response = client.delete(f"/memory/collections/episodic/points/{memory_id}/", params={"user_id": "B"})
+    assert response.status_code == 400
+
+    response = client.request("DELETE", "/memory/collections/episodic/points", params={"user_id": "B"}, json={})
+    assert response.status_code == 200
+    assert len(get_episodic_memories(client, "B")) == 0
+    assert len(get_episodic_memories(client, "A")) == 1
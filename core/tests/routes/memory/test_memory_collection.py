@@ -1,4 +1,4 @@
-from tests.utils import send_websocket_message, get_collections_names_and_point_count
+from tests.utils import send_websocket_message, get_collections_names_and_point_count, wait_for_job
 
 
 def test_memory_collections_created(client):
@@ -103,7 +103,8 @@ def test_memory_collections_wipe(client):
         files = {
             'file': (file_name, f, "text/plain")
         }
-        response = client.post("/rabbithole/", files=files)
+        response = client.post("/rabbithole/", files=files, data={"chunk_size": 100, "chunk_overlap": 20})
+    wait_for_job(client, response.json()["job_id"])
 
     collections_n_points = get_collections_names_and_point_count(client)
     assert collections_n_points["procedural"] == 1   # default tool
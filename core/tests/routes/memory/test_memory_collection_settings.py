@@ -0,0 +1,49 @@
+from tests.utils import get_declarative_memory_contents, wait_for_job
+
+
+def test_get_collection_settings(client):
+
+    response = client.get("/memory/collections/episodic/settings/")
+    assert response.status_code == 200
+    json = response.json()
+    assert json["name"] == "episodic"
+    assert json["value"]["quantization"] == "scalar"
+    assert json["value"]["hnsw_m"] == 16
+    assert "properties" in json["schema"]
+
+    response = client.get("/memory/collections/wonderland/settings/")
+    assert response.status_code == 400
+
+
+def test_upsert_collection_settings(client):
+
+    settings = {"hnsw_m": 32, "quantization": "binary", "hnsw_ef": 128, "exact": True}
+    response = client.put("/memory/collections/declarative/settings/", json=settings)
+    assert response.status_code == 200
+    assert response.json()["value"]["hnsw_ef"] == 128
+
+    # settings are saved, other collections keep theirs
+    response = client.get("/memory/collections/declarative/settings/")
+    assert response.json()["value"]["quantization"] == "binary"
+    response = client.get("/memory/collections/episodic/settings/")
+    assert response.json()["value"]["quantization"] == "scalar"
+
+    # recall goes on with the new search params
+    with open("tests/mocks/sample.txt", "rb") as f:
+        response = client.post("/rabbithole/", files={"file": ("sample.txt", f, "text/plain")})
+    wait_for_job(client, response.json()["job_id"])
+    assert len(get_declarative_memory_contents(client)) > 0
+
+    # collections created again (i.e. after a wipe) use the saved settings
+    client.delete("/memory/collections/declarative/")
+    response = client.get("/memory/collections/declarative/settings/")
+    assert response.json()["value"]["hnsw_m"] == 32
+
+
+def test_upsert_invalid_collection_settings(client):
+
+    response = client.put("/memory/collections/declarative/settings/", json={"quantization": "product"})
+    assert response.status_code == 400
+
+    response = client.put("/memory/collections/wonderland/settings/", json={})
+    assert response.status_code == 400
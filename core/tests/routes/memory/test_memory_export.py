@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from tests.utils import get_collections_names_and_point_count, wait_for_job
+
+
+def test_export_memories(client):
+
+    # upload memories
+    with open("tests/mocks/sample.json", "rb") as f:
+        response = client.post("/rabbithole/memory/", files={"file": ("sample.json", f, "application/json")})
+    wait_for_job(client, response.json()["job_id"])
+
+    response = client.get("/memory/export/")
+    assert response.status_code == 200
+    assert "attachment" in response.headers["content-disposition"]
+
+    memories = json.loads(response.content)
+    assert memories["embedder"] == "DumbEmbedder"
+    assert set(memories["collections"].keys()) == {"episodic", "declarative", "procedural"}
+    assert len(memories["collections"]["declarative"]) == 1
+    assert len(memories["collections"]["procedural"]) == 1  # default tool
+    memory = memories["collections"]["declarative"][0]
+    assert set(memory.keys()) == {"page_content", "metadata", "id", "vector"}
+
+    # the export can be imported again
+    client.delete("/memory/collections/declarative/")
+    response = client.post("/rabbithole/memory/", files={"file": ("export.json", response.content, "application/json")})
+    assert wait_for_job(client, response.json()["job_id"])["status"] == "done"
+    assert get_collections_names_and_point_count(client)["declarative"] == 1
+
+
+def test_export_memories_of_a_collection(client):
+
+    response = client.get("/memory/export/", params={"collections": ["procedural"]})
+    assert response.status_code == 200
+    assert list(json.loads(response.content)["collections"].keys()) == ["procedural"]
+
+    response = client.get("/memory/export/", params={"collections": ["wonderland"]})
+    assert response.status_code == 400
+
+
+def test_export_and_import_memory_dump(client):
+
+    # upload memories
+    with open("tests/mocks/sample.json", "rb") as f:
+        response = client.post("/rabbithole/memory/", files={"file": ("sample.json", f, "application/json")})
+    wait_for_job(client, response.json()["job_id"])
+    exported = json.loads(client.get("/memory/export/").content)["collections"]["declarative"]
+
+    for dtype in ["float32", "float16"]:
+        response = client.get("/memory/export/dump/", params={"dtype": dtype})
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/zip"
+        dump = response.content
+
+        # import the dump in an empty collection
+        client.delete("/memory/collections/declarative/")
+        response = client.post("/rabbithole/memory/", files={"file": ("dump.zip", dump, "application/zip")})
+        assert wait_for_job(client, response.json()["job_id"])["status"] == "done"
+
+        imported = json.loads(client.get("/memory/export/").content)["collections"]["declarative"]
+        assert len(imported) == 1
+        assert imported[0]["id"] == exported[0]["id"]
+        assert imported[0]["page_content"] == exported[0]["page_content"]
+        assert imported[0]["vector"] == pytest.approx(exported[0]["vector"], abs=1e-2)
+
+    response = client.get("/memory/export/dump/", params={"dtype": "int8"})
+    assert response.status_code == 400
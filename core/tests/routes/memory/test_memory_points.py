@@ -1,4 +1,4 @@
-from tests.utils import send_websocket_message, get_declarative_memory_contents
+from tests.utils import send_websocket_message, get_declarative_memory_contents, wait_for_job
 
 
 def test_point_deleted(client):
@@ -64,9 +64,10 @@ def test_points_deleted_by_metadata(client):
             'file': (file_name, f, content_type)
         }
 
-        response = client.post("/rabbithole/", files=files)
+        response = client.post("/rabbithole/", files=files, data={"chunk_size": 100, "chunk_overlap": 20})
     # check response
     assert response.status_code == 200
+    wait_for_job(client, response.json()["job_id"])
 
     # upload another document
     with open(file_path, 'rb') as f:
@@ -74,9 +75,10 @@ def test_points_deleted_by_metadata(client):
             'file': ("sample2.pdf", f, content_type)
         }
 
-        response = client.post("/rabbithole/", files=files)
+        response = client.post("/rabbithole/", files=files, data={"chunk_size": 100, "chunk_overlap": 20})
     # check response
     assert response.status_code == 200
+    wait_for_job(client, response.json()["job_id"])
 
     # check memory contents
     declarative_memories = get_declarative_memory_contents(client)
@@ -25,6 +25,11 @@ def test_memory_recall_default_success(client):
         assert type(json["vectors"]["collections"][collection]) == list
         if collection == "procedural":
             assert len(json["vectors"]["collections"][collection]) > 0
+            # memories come with their vectors, to be plotted
+            memory = json["vectors"]["collections"][collection][0]
+            assert type(memory["vector"]) == list
+            assert type(memory["score"]) == float
+            assert "page_content" in memory and "metadata" in memory
         else:
             assert len(json["vectors"]["collections"][collection]) == 0
 
@@ -1,5 +1,5 @@
 
-from tests.utils import get_declarative_memory_contents
+from tests.utils import get_declarative_memory_contents, wait_for_job
 
 
 def test_rabbithole_upload_txt(client):
@@ -12,7 +12,8 @@ def test_rabbithole_upload_txt(client):
             'file': (file_name, f, content_type)
         }
 
-        response = client.post("/rabbithole/", files=files)
+        # chunk sizes are in tokens, small chunks to get several of them
+        response = client.post("/rabbithole/", files=files, data={"chunk_size": 100, "chunk_overlap": 20})
 
     # check response
     assert response.status_code == 200
@@ -21,6 +22,11 @@ def test_rabbithole_upload_txt(client):
     assert json["content_type"] == content_type
     assert "File is being ingested" in json["info"]
 
+    # wait for ingestion to be over
+    job = wait_for_job(client, json["job_id"])
+    assert job["status"] == "done"
+    assert job["chunks_done"] == job["chunks_total"]
+
     # check memory contents
     # check declarative memory is empty
     declarative_memories = get_declarative_memory_contents(client)
@@ -37,7 +43,8 @@ def test_rabbithole_upload_pdf(client):
             'file': (file_name, f, content_type)
         }
 
-        response = client.post("/rabbithole/", files=files)
+        # chunk sizes are in tokens, small chunks to get several of them
+        response = client.post("/rabbithole/", files=files, data={"chunk_size": 100, "chunk_overlap": 20})
 
     # check response
     assert response.status_code == 200
@@ -46,7 +53,61 @@ def test_rabbithole_upload_pdf(client):
     assert json["content_type"] == content_type
     assert "File is being ingested" in json["info"]
 
+    # wait for ingestion to be over
+    job = wait_for_job(client, json["job_id"])
+    assert job["status"] == "done"
+    assert job["chunks_done"] == job["chunks_total"]
+
     # check memory contents
     # check declarative memory is empty
     declarative_memories = get_declarative_memory_contents(client)
-    assert len(declarative_memories) == 5
\ No newline at end of file
+    assert len(declarative_memories) == 5
+
+
+def test_rabbithole_reupload_skips_stored_chunks(client):
+
+    content_type = "text/plain"
+    file_name = "sample.txt"
+    file_path = f"tests/mocks/{file_name}"
+    chunking = {"chunk_size": 100, "chunk_overlap": 20}
+
+    # upload the same file twice
+    for _ in range(2):
+        with open(file_path, 'rb') as f:
+            response = client.post("/rabbithole/", files={'file': (file_name, f, content_type)}, data=chunking)
+        assert response.status_code == 200
+        job = wait_for_job(client, response.json()["job_id"])
+        assert job["status"] == "done"
+
+    # chunks are stored once, with their content hash
+    declarative_memories = get_declarative_memory_contents(client)
+    assert len(declarative_memories) == 5
+    assert all(m["metadata"]["content_hash"] for m in declarative_memories)
+
+    # upload an updated version of the file, cut in half
+    with open(file_path) as f:
+        content = f.read()
+    updated_content = content[:content.find("\n\n", len(content) // 2)]
+    response = client.post("/rabbithole/", files={'file': (file_name, updated_content.encode(), content_type)},
+                           data=chunking)
+    wait_for_job(client, response.json()["job_id"])
+
+    # only the chunks still in the file are kept
+    declarative_memories = get_declarative_memory_contents(client)
+    assert 0 < len(declarative_memories) < 5
+    assert all(m["page_content"] in updated_content for m in declarative_memories)
+
+
+def test_store_documents_adds_to_source(client):
+
+    from langchain.docstore.document import Document
+    rabbit_hole = client.app.state.ccat.rabbit_hole
+
+    # a plugin storing a source in several calls keeps all its chunks
+    rabbit_hole.store_documents([Document(page_content="Red Queen")], source="notes")
+    rabbit_hole.store_documents([Document(page_content="White Rabbit")], source="notes")
+    assert {m["page_content"] for m in get_declarative_memory_contents(client)} == {"Red Queen", "White Rabbit"}
+
+    # unless the documents are the whole source
+    rabbit_hole.store_documents([Document(page_content="Cheshire Cat")], source="notes", delete_stale=True)
+    assert [m["page_content"] for m in get_declarative_memory_contents(client)] == ["Cheshire Cat"]
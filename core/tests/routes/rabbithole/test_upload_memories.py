@@ -2,10 +2,9 @@ import json
 import time
 import uuid
 import random
-import pytest
 from fastapi import HTTPException
 
-from tests.utils import get_declarative_memory_contents, get_collections_names_and_point_count
+from tests.utils import get_declarative_memory_contents, get_collections_names_and_point_count, wait_for_job
 
 
 # all good memory upload
@@ -25,6 +24,7 @@ def test_upload_memory(client):
     assert json["filename"] == file_name
     assert json["content_type"] == content_type
     assert "Memory is being ingested" in json["info"]
+    assert wait_for_job(client, json["job_id"])["status"] == "done"
 
     # new declarative memory was saved
     collections_n_points = get_collections_names_and_point_count(client)
@@ -55,16 +55,17 @@ def test_upload_memory_check_embedder(client):
     another_embedder = "AnotherEmbedder"
     fake_memory = get_fake_memory_export(embedder_name=another_embedder)
 
-    with pytest.raises(Exception) as e:
-        response = client.post(
-            "/rabbithole/memory/",
-            files={
-                "file": ("test_file.json", json.dumps(fake_memory), "application/json")
-            }
-        )
+    response = client.post(
+        "/rabbithole/memory/",
+        files={
+            "file": ("test_file.json", json.dumps(fake_memory), "application/json")
+        }
+    )
+    job = wait_for_job(client, response.json()["job_id"])
 
     # ...but found a different embedder
-    assert f"Embedder mismatch: file embedder {another_embedder} is different from DumbEmbedder" in str(e.value)
+    assert job["status"] == "failed"
+    assert f"Embedder mismatch: file embedder {another_embedder} is different from DumbEmbedder" in job["error"]
     # and did not update collection
     collections_n_points = get_collections_names_and_point_count(client)
     assert collections_n_points["declarative"] == 0
@@ -75,21 +76,43 @@ def test_upload_memory_check_dimensionality(client):
     wrong_dim = 9
     fake_memory = get_fake_memory_export(dim=wrong_dim)
 
-    with pytest.raises(Exception) as e:
-        response = client.post(
-            "/rabbithole/memory/",
-            files={
-                "file": ("test_file.json", json.dumps(fake_memory), "application/json")
-            }
-        )
+    response = client.post(
+        "/rabbithole/memory/",
+        files={
+            "file": ("test_file.json", json.dumps(fake_memory), "application/json")
+        }
+    )
+    job = wait_for_job(client, response.json()["job_id"])
 
     # ...but found a different embedder
-    assert f"Embedding size mismatch" in str(e.value)
+    assert job["status"] == "failed"
+    assert f"Embedding size mismatch" in job["error"]
     # and did not update collection
     collections_n_points = get_collections_names_and_point_count(client)
     assert collections_n_points["declarative"] == 0
 
 
+def test_upload_memory_check_dimensionality_of_all_vectors(client):
+    # only the last memory has a wrong dimension
+    fake_memory = get_fake_memory_export()
+    wrong_memory = get_fake_memory_export(dim=9)["collections"]["declarative"][0]
+    fake_memory["collections"]["declarative"].append(wrong_memory)
+
+    response = client.post(
+        "/rabbithole/memory/",
+        files={
+            "file": ("test_file.json", json.dumps(fake_memory), "application/json")
+        }
+    )
+    job = wait_for_job(client, response.json()["job_id"])
+
+    # the whole file is rejected before writing anything
+    assert job["status"] == "failed"
+    assert "Embedding size mismatch" in job["error"]
+    collections_n_points = get_collections_names_and_point_count(client)
+    assert collections_n_points["declarative"] == 0
+
+
 def get_fake_memory_export(embedder_name="DumbEmbedder", dim=2367):
     return {
         "embedder": embedder_name,
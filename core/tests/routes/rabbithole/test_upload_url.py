@@ -1,5 +1,5 @@
 
-from tests.utils import get_declarative_memory_contents
+from tests.utils import get_declarative_memory_contents, wait_for_job
 
 def test_rabbithole_upload_invalid_url(client):
 
@@ -30,6 +30,7 @@ def test_rabbithole_upload_url(client):
     json = response.json()
     assert json["info"] == "URL is being ingested asynchronously"
     assert json["url"] == payload["url"]
+    wait_for_job(client, json["job_id"])
 
     # check declarative memories have been stored
     declarative_memories = get_declarative_memory_contents(client)
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import threading
+
+from cat.db.database import get_db
+from cat.ingestion_jobs import IngestionScheduler, StageStats, current_job
+from tests.utils import wait_for_job
+
+
+class MessagesCat:
+    """Keeps the websocket messages sent by the scheduler."""
+
+    def __init__(self):
+        self.messages = []
+
+    def send_ws_message(self, content, msg_type="notification", user_id=None):
+        self.messages.append((content, msg_type, user_id))
+
+
+class SlowRabbitHole:
+    """Ingests a two chunks page, when allowed to."""
+
+    def __init__(self):
+        self.go_on = threading.Event()
+        self.scheduler = None
+        self.cat = MessagesCat()
+
+    def ingest_file(self, file, chunk_size, chunk_overlap):
+        job = current_job.get()
+        self.scheduler.report_progress(job, 0, 2)
+        self.go_on.wait(10)
+        self.scheduler.report_progress(job, 1)
+        self.scheduler.report_progress(job, 2)
+
+
+def test_job_not_found(client):
+
+    response = client.get("/rabbithole/jobs/not_a_job")
+    assert response.status_code == 404
+
+    response = client.delete("/rabbithole/jobs/not_a_job")
+    assert response.status_code == 404
+
+
+def test_jobs_run_with_bounded_workers(client):
+
+    rabbit_hole = SlowRabbitHole()
+    scheduler = IngestionScheduler(rabbit_hole, max_workers=1)
+    rabbit_hole.scheduler = scheduler
+
+    first = scheduler.submit_url("https://example.com/1")
+    second = scheduler.submit_url("https://example.com/2")
+    third = scheduler.submit_url("https://example.com/3")
+
+    # only one job runs, the others wait
+    assert second.status == "queued"
+
+    # queued job never starts
+    scheduler.cancel(third.job_id)
+    assert third.status == "cancelled"
+
+    rabbit_hole.go_on.set()
+    first.future.result()
+    second.future.result()
+    assert first.status == second.status == "done"
+    assert first.chunks_done == first.chunks_total == 2
+    assert first.info()["chunks_per_second"] > 0
+
+    # jobs are saved in the DB
+    assert {j.job_id for j in scheduler.list_jobs()} >= {first.job_id, second.job_id, third.job_id}
+    scheduler.shutdown()
+
+
+def test_cancel_running_job(client):
+
+    rabbit_hole = SlowRabbitHole()
+    scheduler = IngestionScheduler(rabbit_hole, max_workers=1)
+    rabbit_hole.scheduler = scheduler
+
+    job = scheduler.submit_url("https://example.com")
+    while job.status != "running" or job.chunks_total is None:
+        time.sleep(0.01)
+
+    # running job stops at the next progress report
+    scheduler.cancel(job.job_id)
+    rabbit_hole.go_on.set()
+    job.future.result()
+    assert job.status == "cancelled"
+    assert job.chunks_done == 0
+    scheduler.shutdown()
+
+
+def test_upload_returns_job(client):
+
+    with open("tests/mocks/sample.txt", "rb") as f:
+        response = client.post("/rabbithole/", files={"file": ("sample.txt", f, "text/plain")})
+
+    job = wait_for_job(client, response.json()["job_id"])
+    assert job["source"] == "sample.txt"
+    assert job["kind"] == "file"
+    assert "path" not in job
+
+    response = client.get("/rabbithole/jobs/")
+    assert job["job_id"] in [j["job_id"] for j in response.json()["jobs"]]
+
+
+def test_progress_events_go_to_job_user(client):
+
+    rabbit_hole = SlowRabbitHole()
+    scheduler = IngestionScheduler(rabbit_hole, max_workers=1)
+    rabbit_hole.scheduler = scheduler
+
+    rabbit_hole.go_on.set()
+    job = scheduler.submit_url("https://example.com", user_id="alice")
+    job.future.result()
+
+    # structured events, only for the user who started the job
+    assert len(rabbit_hole.cat.messages) >= 2
+    assert all(msg_type == "ingestion" and user_id == "alice" for _, msg_type, user_id in rabbit_hole.cat.messages)
+
+    first, last = rabbit_hole.cat.messages[0][0], rabbit_hole.cat.messages[-1][0]
+    assert first["status"] == "running"
+    assert last["status"] == "done"
+    assert last["chunks_done"] == 2
+    for key in ["chunks_parsed", "chunks_embedded", "chunks_stored", "embed", "upsert"]:
+        assert key in last
+    scheduler.shutdown()
+
+
+def test_stage_stats():
+
+    stats = StageStats()
+    assert stats.summary()["p50_ms"] is None
+
+    for ms in range(1, 101):
+        stats.record(ms / 1000, chunks=10)
+
+    summary = stats.summary()
+    assert summary["calls"] == 100
+    assert summary["chunks"] == 1000
+    assert summary["p50_ms"] < summary["p95_ms"] < summary["p99_ms"] <= 100
+    assert summary["chunks_per_second"] == round(1000 / 5.05, 2)
+
+
+def test_upload_progress_pushed_to_user_websocket(client):
+
+    with client.websocket_connect("/ws/alice") as websocket:
+        with open("tests/mocks/sample.txt", "rb") as f:
+            response = client.post("/rabbithole/", files={"file": ("sample.txt", f, "text/plain")},
+                                   params={"user_id": "alice"})
+        job_id = response.json()["job_id"]
+
+        # events come without asking, until the job is over
+        events = []
+        while len(events) == 0 or events[-1]["status"] == "running":
+            message = websocket.receive_json()
+            if message["type"] == "ingestion":
+                assert message["content"]["job_id"] == job_id
+                events.append(message["content"])
+
+    job = events[-1]
+    assert job["status"] == "done"
+    assert job["user_id"] == "alice"
+    assert job["chunks_stored"] == job["chunks_embedded"] == job["chunks_parsed"] > 0
+    assert job["embed"]["calls"] > 0 and job["embed"]["p50_ms"] is not None
+    assert job["upsert"]["chunks_per_second"] > 0
+
+
+def test_job_events_stream(client):
+
+    with open("tests/mocks/sample.txt", "rb") as f:
+        response = client.post("/rabbithole/", files={"file": ("sample.txt", f, "text/plain")})
+    job_id = response.json()["job_id"]
+
+    # the stream ends when the job is over
+    response = client.get(f"/rabbithole/jobs/{job_id}/events")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert all(e["job_id"] == job_id for e in events)
+    assert events[-1]["status"] == "done"
+    assert events[-1]["chunks_done"] == events[-1]["chunks_total"]
+
+
+def test_finished_jobs_are_pruned(client):
+
+    rabbit_hole = SlowRabbitHole()
+    scheduler = IngestionScheduler(rabbit_hole, max_workers=1)
+    rabbit_hole.scheduler = scheduler
+
+    rabbit_hole.go_on.set()
+    job = scheduler.submit_url("https://example.com")
+    job.future.result()
+
+    # jobs have their own DB, not the settings one
+    assert os.path.exists(os.path.join(scheduler.folder, "jobs.json"))
+    assert "ingestion_jobs" not in get_db().tables()
+    assert job.job_id in [j.job_id for j in scheduler.list_jobs()]
+
+    scheduler.jobs_ttl = 0
+    scheduler.prune_jobs()
+    assert scheduler.list_jobs() == []
+    assert scheduler.get_job(job.job_id) is None
+    scheduler.shutdown()
@@ -0,0 +1,145 @@
+import io
+import json
+
+from langchain.document_loaders.blob_loaders.schema import Blob
+
+from cat.parsers import (cut_block, TextBlockParser, HTMLBlockParser, PDFPageParser, ParserPool,
+                         JSONStreamReader, read_json_value, iter_json_array)
+
+
+def test_cut_block():
+
+    # short text is kept for the next block
+    assert cut_block("hello", 10) == (None, "hello")
+
+    # blocks end at a word boundary
+    block, rest = cut_block("aaaa bbbb cccc", 10)
+    assert block == "aaaa bbbb "
+    assert rest == "cccc"
+
+    # paragraphs are preferred
+    block, rest = cut_block("aaaaaa\n\nbb cc dd", 10)
+    assert block == "aaaaaa\n\n"
+
+
+def test_text_parser_yields_blocks():
+
+    text = " ".join(["word"] * 1000)
+    docs = list(TextBlockParser(block_size=100).lazy_parse(Blob(data=text.encode())))
+
+    assert len(docs) > 1
+    assert all(len(d.page_content) <= 100 for d in docs)
+    assert "".join(d.page_content for d in docs) == text
+
+
+def test_html_parser_skips_scripts():
+
+    html = b"<html><head><title>Cat</title><script>var x = 1;</script></head>" \
+           b"<body><p>Hello</p><p>world</p></body></html>"
+    docs = list(HTMLBlockParser().lazy_parse(Blob(data=html)))
+
+    assert len(docs) == 1
+    assert docs[0].metadata["title"] == "Cat"
+    assert "var x" not in docs[0].page_content
+    assert docs[0].page_content.split() == ["Hello", "world"]
+
+
+def test_pdf_parser_yields_pages():
+
+    docs = list(PDFPageParser().lazy_parse(Blob(path="tests/mocks/sample.pdf")))
+
+    assert len(docs) == docs[0].metadata["total_pages"]
+    assert [d.metadata["page"] for d in docs] == list(range(1, len(docs) + 1))
+
+
+def make_pdf(pages):
+    """Minimal PDF with a line of text in each page."""
+    n = len(pages)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [" + " ".join(f"{4 + 2 * i} 0 R" for i in range(n)) + f"] /Count {n} >>",
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, text in enumerate(pages):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {5 + 2 * i} 0 R "
+                       "/Resources << /Font << /F1 3 0 R >> >> >>")
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    pdf = "%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += f"{i} 0 obj\n{obj}\nendobj\n"
+    xref = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n"
+    pdf += "".join(f"{o:010d} 00000 n \n" for o in offsets)
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    return pdf.encode("latin-1")
+
+
+def test_parser_pool_splits_pdf_pages(tmp_path):
+
+    path = tmp_path / "wonderland.pdf"
+    path.write_bytes(make_pdf([f"Chapter {i}" for i in range(1, 6)]))
+
+    blob = Blob(path=str(path))
+    parser = PDFPageParser(pages_per_part=2)
+    assert parser.split_parts(blob) == [(0, 2, 5), (2, 4, 5), (4, 5, 5)]
+    expected = list(parser.lazy_parse(blob))
+    assert [d.page_content.strip() for d in expected] == [f"Chapter {i}" for i in range(1, 6)]
+
+    pool = ParserPool(processes=2)
+    try:
+        docs = list(pool.lazy_parse(parser, blob))
+    finally:
+        pool.shutdown()
+
+    # same pages, in the same order
+    assert [d.page_content for d in docs] == [d.page_content for d in expected]
+    assert [d.metadata for d in docs] == [d.metadata for d in expected]
+
+
+def test_parser_pool_runs_other_parsers_in_process():
+
+    class LocalParser(TextBlockParser):
+        # opted in, but a local class cannot be pickled
+        use_process_pool = True
+
+    pool = ParserPool(processes=2)
+    assert not pool.can_run(TextBlockParser())
+    assert not pool.can_run(LocalParser())
+    # HTML cannot be split in parts, it would come back from the pool as a whole
+    assert not pool.can_run(HTMLBlockParser())
+    assert pool.can_run(PDFPageParser())
+
+    docs = list(pool.lazy_parse(LocalParser(), Blob(data=b"Alice")))
+    assert docs[0].page_content == "Alice"
+    assert pool.executor is None
+
+
+def test_json_stream_reader():
+
+    document = {
+        "export_time": 1690474241268,
+        "collections": {
+            "episodic": [{"page_content": "skip me", "vector": [0.25] * 50}],
+            "declarative": [{"id": i, "vector": [0.123456789] * 50} for i in range(10)]
+        },
+        "embedder": "DumbEmbedder"
+    }
+    data = json.dumps(document, indent=2).encode()
+
+    # values are found wherever they are in the file
+    assert read_json_value(io.BytesIO(data), ["embedder"]) == "DumbEmbedder"
+    assert read_json_value(io.BytesIO(data), ["export_time"]) == 1690474241268
+    assert list(iter_json_array(io.BytesIO(data), ["collections", "declarative"])) == \
+        document["collections"]["declarative"]
+
+    # values split across blocks are decoded correctly
+    reader = JSONStreamReader(io.TextIOWrapper(io.BytesIO(data)), block_size=3)
+    assert reader.find(["collections", "declarative"])
+    assert list(reader.iter_array()) == document["collections"]["declarative"]
+
+    reader = JSONStreamReader(io.TextIOWrapper(io.BytesIO(data)), block_size=3)
+    assert not reader.find(["collections", "procedural"])
@@ -0,0 +1,109 @@
+import pytest
+from langchain.docstore.document import Document
+
+from cat.text_splitter import LinearTextSplitter, approximate_token_count, get_token_counter
+
+
+def test_chunks_fit_in_chunk_size():
+
+    with open("tests/mocks/sample.txt") as f:
+        text = f.read()
+
+    splitter = LinearTextSplitter(chunk_size=50, chunk_overlap=10)
+    chunks = splitter.split_chunks(text)
+
+    assert len(chunks) > 1
+    assert all(approximate_token_count(c) <= 50 for c in chunks)
+    # no text is lost
+    assert all(word in " ".join(chunks) for word in text.split())
+
+
+def test_chunks_overlap():
+
+    text = " ".join(f"word{i}" for i in range(100))
+    # a token per word
+    splitter = LinearTextSplitter(chunk_size=20, chunk_overlap=5, length_function=lambda t: len(t.split()))
+    chunks = splitter.split_chunks(text)
+
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous.split()[-5:] == chunk.split()[:5]
+
+
+def test_chunks_end_at_sentences():
+
+    text = "The Cat grins. " * 30
+    chunks = LinearTextSplitter(chunk_size=25, chunk_overlap=0).split_chunks(text)
+
+    assert all(c.endswith("grins.") for c in chunks)
+
+
+def test_short_chunks_are_merged():
+
+    text = "Alice was beginning to get very tired of sitting by her sister.\n\n12"
+    chunks = LinearTextSplitter(chunk_size=14, chunk_overlap=0).split_chunks(text)
+
+    # page number is kept with the previous text
+    assert chunks[-1].endswith("12")
+    assert all(len(c) > 10 for c in chunks)
+
+
+def test_merged_chunks_fit_in_chunk_size():
+
+    # a token per word, the short last chunk does not fit in the previous one
+    text = "one two three four five. six"
+    chunks = LinearTextSplitter(chunk_size=5, chunk_overlap=0, length_function=lambda t: len(t.split())) \
+        .split_chunks(text)
+    assert chunks == ["one two three four five.", "six"]
+
+    # with the approximate token count too
+    text = "Alice was beginning to get very tired.\n\n12"
+    chunks = LinearTextSplitter(chunk_size=10, chunk_overlap=0).split_chunks(text)
+    assert chunks == ["Alice was beginning to get very tired.", "12"]
+
+
+def test_approximate_chunks_overlap_by_sentences():
+
+    text = " ".join(f"Sentence {i}." for i in range(100))
+    chunks = LinearTextSplitter(chunk_size=20, chunk_overlap=5).split_chunks(text)
+
+    assert all(approximate_token_count(c) <= 20 for c in chunks)
+    # chunks end at a sentence, and the next chunk starts with the last sentence
+    for previous, chunk in zip(chunks, chunks[1:]):
+        assert previous.endswith(".")
+        assert chunk.startswith(previous.split(". ")[-1])
+
+
+def test_long_words_are_cut():
+
+    text = "a" * 1000
+    splitter = LinearTextSplitter(chunk_size=10, chunk_overlap=2, length_function=lambda t: len(t) // 10)
+    chunks = splitter.split_chunks(text)
+
+    assert "".join(chunks) == text
+    assert all(len(c) <= 100 for c in chunks)
+
+
+def test_split_documents_keeps_metadata():
+
+    docs = [Document(page_content="Off with her head! " * 20, metadata={"source": "queen.txt", "page": 1})]
+    chunks = LinearTextSplitter(chunk_size=20, chunk_overlap=5).split_documents(docs)
+
+    assert len(chunks) > 1
+    assert all(c.metadata == {"source": "queen.txt", "page": 1} for c in chunks)
+    chunks[0].metadata["page"] = 2
+    assert chunks[1].metadata["page"] == 1
+
+
+def test_invalid_overlap():
+
+    with pytest.raises(ValueError):
+        LinearTextSplitter(chunk_size=10, chunk_overlap=10)
+
+
+def test_token_counter_fallback():
+
+    class DumbEmbedder:
+        pass
+
+    assert get_token_counter(DumbEmbedder()) is approximate_token_count
+    assert approximate_token_count("Who are you?") == 3
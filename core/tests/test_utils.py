@@ -0,0 +1,50 @@
+import pytest
+
+from cat.utils import RateLimiter, is_rate_limit_error
+
+
+class RateLimitError(Exception):
+    pass
+
+
+def test_is_rate_limit_error():
+
+    assert is_rate_limit_error(RateLimitError("slow down"))
+    assert is_rate_limit_error(Exception("HTTP 429 Too Many Requests"))
+    assert not is_rate_limit_error(ValueError("wrong input"))
+
+
+def test_rate_limiter_retries_and_recovers():
+
+    calls = []
+
+    def flaky_embed(texts):
+        calls.append(texts)
+        if len(calls) < 3:
+            raise RateLimitError("Rate limit reached")
+        return [[1.0] for _ in texts]
+
+    rate_limiter = RateLimiter(max_delay=0.01)
+    assert rate_limiter.call(flaky_embed, ["a", "b"]) == [[1.0], [1.0]]
+    assert len(calls) == 3
+
+    # speeds up again after successful calls
+    rate_limiter.call(lambda: None)
+    rate_limiter.call(lambda: None)
+    assert rate_limiter.delay == 0
+
+
+def test_rate_limiter_gives_up():
+
+    def always_limited():
+        raise RateLimitError("Rate limit reached")
+
+    def broken():
+        raise ValueError("not a rate limit")
+
+    rate_limiter = RateLimiter(max_delay=0.001, max_retries=2)
+    with pytest.raises(RateLimitError):
+        rate_limiter.call(always_limited)
+    # other errors are not retried
+    with pytest.raises(ValueError):
+        rate_limiter.call(broken)
@@ -0,0 +1,76 @@
+import threading
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+
+from cat.web_fetcher import WebFetcher, DownloadTooLarge
+from tests.utils import get_declarative_memory_contents, wait_for_job
+
+
+PAGES = {
+    "alice.html": "<html><head><title>Alice</title></head><body><p>Alice follows the White Rabbit down the hole.</p></body></html>",
+    "queen.html": "<html><body><p>The Queen of Hearts wants everybody's head off.</p></body></html>",
+    "big.html": "<p>" + "meow " * 10000 + "</p>",
+}
+
+
+@pytest.fixture
+def website(tmp_path):
+    for name, content in PAGES.items():
+        (tmp_path / name).write_text(content)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(SimpleHTTPRequestHandler, directory=str(tmp_path)))
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    (tmp_path / "sitemap.xml").write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        f'<url><loc>{base_url}/alice.html</loc></url><url><loc>{base_url}/queen.html</loc></url>'
+        '</urlset>'
+    )
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield base_url
+    server.shutdown()
+
+
+def test_download_many(website):
+
+    fetcher = WebFetcher(max_size=10000, per_host=1)
+    urls = [f"{website}/alice.html", f"{website}/queen.html", f"{website}/big.html", f"{website}/missing.html"]
+
+    results = {}
+    for url, path, result in fetcher.download_many(urls):
+        if not isinstance(result, Exception):
+            with open(path) as f:
+                assert f.read() == PAGES[url.split("/")[-1]]
+        results[url.split("/")[-1]] = result
+
+    assert results["alice.html"] == "text/html"
+    assert results["queen.html"] == "text/html"
+    assert isinstance(results["big.html"], DownloadTooLarge)
+    assert isinstance(results["missing.html"], Exception)
+
+    fetcher.close()
+
+
+def test_sitemap_urls(website):
+
+    fetcher = WebFetcher()
+    assert fetcher.sitemap_urls(f"{website}/sitemap.xml") == [f"{website}/alice.html", f"{website}/queen.html"]
+    assert fetcher.sitemap_urls(f"{website}/sitemap.xml", max_pages=1) == [f"{website}/alice.html"]
+    fetcher.close()
+
+
+def test_crawl_sitemap(client, website):
+
+    response = client.post("/rabbithole/web/crawl/", json={"sitemap": f"{website}/sitemap.xml"})
+    assert response.status_code == 200
+    assert wait_for_job(client, response.json()["job_id"])["status"] == "done"
+
+    declarative_memories = get_declarative_memory_contents(client)
+    assert {m["metadata"]["source"] for m in declarative_memories} == {f"{website}/alice.html", f"{website}/queen.html"}
+
+    # urls or sitemap are needed
+    response = client.post("/rabbithole/web/crawl/", json={})
+    assert response.status_code == 400
@@ -1,4 +1,5 @@
 import os
+import time
 import shutil
 
 
@@ -83,4 +84,16 @@ def get_collections_names_and_point_count(client):
     json = response.json()
     assert response.status_code == 200
     collections_n_points = { c["name"]: c["vectors_count"] for c in json["collections"]}
-    return collections_n_points
\ No newline at end of file
+    return collections_n_points
+
+# utility to wait for an ingestion job to finish, returns the final job info
+def wait_for_job(client, job_id, timeout=30):
+    start = time.time()
+    while time.time() - start < timeout:
+        response = client.get(f"/rabbithole/jobs/{job_id}")
+        assert response.status_code == 200
+        job = response.json()
+        if job["status"] in ["done", "failed", "cancelled"]:
+            return job
+        time.sleep(0.1)
+    raise TimeoutError(f"Job {job_id} did not finish in {timeout} seconds")